@@ -0,0 +1 @@
+"""Benchmarks for the websmash API hot paths"""
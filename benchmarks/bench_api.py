@@ -0,0 +1,178 @@
+"""Load test the API hot paths in-process, at a configurable concurrency
+
+Requests go through the Flask test client from a pool of threads, so this measures the
+cost of the views and their Redis traffic without any HTTP server in front of them.
+Run from the repository root:
+
+    python -m benchmarks.bench_api --queued 10000 --requests 2000 --concurrency 16 --output results.json
+
+Use --redis-url to run against a local redis-server instead of fakeredis (the database is flushed!),
+and --baseline to compare against the JSON output of an earlier run. Comparing a run with
+--rate-limits against one without shows the overhead of the rate limiter.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable
+
+from antismash_models import SyncNotice as Notice
+from flask import g
+
+from websmash import app, default_settings, get_git_version, notices
+from benchmarks.common import make_client, percentile, seed_queue
+
+SCENARIOS = ('submit', 'status', 'stats', 'news')
+
+
+def make_requests(scenario: str, job_ids: list[str], users: int) -> Callable[[Any, int], Any]:
+    """Get a function sending the i-th request of a scenario with a test client"""
+    if scenario == 'submit':
+        def submit(client, i):
+            return client.post('/api/v1.0/submit',
+                               data={'ncbi': 'NC_{:06d}'.format(i), 'email': 'user{}@example.com'.format(i % users)},
+                               headers={'X-Forwarded-For': '10.1.{}.{}'.format(i % 250, i % 200)})
+        return submit
+
+    if scenario == 'status':
+        def status(client, i):
+            return client.get('/api/v1.0/status/{}'.format(random.choice(job_ids)))
+        return status
+
+    path = {'stats': '/api/v1.0/stats', 'news': '/api/v1.0/news'}[scenario]
+    return lambda client, i: client.get(path)
+
+
+def seed_notices(redis_store, count: int) -> None:
+    """Add some notices to show"""
+    for i in range(count):
+        notice = Notice(redis_store, 'bench-{}'.format(i), teaser='Notice {}'.format(i), text='Benchmark notice')
+        notices.add_notice(redis_store, notice, app.config)
+
+
+def run_scenario(scenario: str, redis_store, counter, job_ids: list[str], args) -> dict[str, Any]:
+    """Send the requests of one scenario and collect the statistics"""
+    send = make_requests(scenario, job_ids, args.users)
+    latencies: list[float] = []
+    errors = [0]
+
+    def worker(offset: int) -> None:
+        client = app.test_client()
+        # requests reuse this app context, so every request talks to the benchmark client
+        with app.app_context():
+            g._database = redis_store
+            for i in range(offset, args.requests, args.concurrency):
+                start = time.perf_counter()
+                response = send(client, i)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    counter.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker, offset) for offset in range(args.concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'round_trips_per_request': counter.count / len(latencies),
+        'commands_per_request': counter.commands / len(latencies),
+        'reply_bytes_per_request': counter.received / len(latencies),
+    }
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any]) -> None:
+    """Print the change of each scenario relative to a baseline run"""
+    for scenario, result in results.items():
+        old = baseline['results'].get(scenario)
+        if old is None:
+            continue
+        changes = []
+        for key in ('requests_per_second', 'p95_ms', 'commands_per_request', 'reply_bytes_per_request'):
+            if old.get(key):
+                changes.append("{} {:+.1f}%".format(key, (result[key] - old[key]) / old[key] * 100))
+        print("{:>8} vs baseline: {}".format(scenario, ', '.join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs='*', metavar='scenario',
+                        help="Scenarios to run, any of {}, default all".format(', '.join(SCENARIOS)))
+    parser.add_argument("--queued", type=int, default=10000, help="Jobs already in the default queue")
+    parser.add_argument("--users", type=int, default=500, help="Number of distinct submitters")
+    parser.add_argument("--notices", type=int, default=5, help="Active notices to serve")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--no-cache", action='store_true', help="Don't cache the stats and news responses")
+    parser.add_argument("--rate-limits", action='store_true',
+                        help="Check rate limits that are never hit, to measure the limiter's overhead")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="Simulated network round trip time")
+    parser.add_argument("--redis-url", default=None, help="Redis server to use instead of fakeredis")
+    parser.add_argument("--output", default=None, help="File to save the results to as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare to")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario {!r}".format(scenario))
+    if not args.scenarios:
+        args.scenarios = list(SCENARIOS)
+
+    redis_store, counter = make_client(args.redis_url, args.rtt_ms)
+    redis_store.flushdb()
+    job_ids = seed_queue(redis_store, app.config, args.queued)
+    seed_notices(redis_store, args.notices)
+
+    app.config['RESULTS_PATH'] = tempfile.mkdtemp(prefix='websmash-bench-')
+    app.config['DARK_LAUNCH_PERCENTAGE'] = 0
+    app.config['DARK_LAUNCH_WORKERS'] = 0
+    # the sampler thread would connect to the configured Redis server, not the benchmarked one
+    app.config['METRICS_SAMPLE_INTERVAL'] = 0
+    # the benchmark clients would hit the real limits
+    app.config['RATE_LIMITS'] = {}
+    if args.rate_limits:
+        unlimited = {'ip': (10 ** 9, 1), 'email': (10 ** 9, 1)}
+        app.config['RATE_LIMITS'] = {endpoint: unlimited for endpoint in default_settings.RATE_LIMITS}
+    if args.no_cache:
+        app.config['STATS_CACHE_TTL'] = 0
+        app.config['NEWS_CACHE_TTL'] = 0
+
+    results = {}
+    for scenario in args.scenarios:
+        result = results[scenario] = run_scenario(scenario, redis_store, counter, job_ids, args)
+        print("{:>8}: {requests_per_second:9.1f} req/s, p50 {p50_ms:7.2f} ms, p95 {p95_ms:7.2f} ms, "
+              "p99 {p99_ms:7.2f} ms, {commands_per_request:7.1f} commands, "
+              "{round_trips_per_request:6.1f} round trips, {reply_bytes_per_request:8.0f} reply bytes, "
+              "{errors} errors".format(scenario, **result))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as handle:
+            compare(results, json.load(handle))
+
+    if args.output:
+        report = {
+            'meta': {
+                'git': get_git_version(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'redis': 'fakeredis' if args.redis_url is None else 'redis-server',
+                'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+            },
+            'results': results,
+        }
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Measure how long a fresh worker takes to import websmash and create the app
+
+Each run starts a new interpreter, like a worker that isn't forked from a preloaded master.
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --runs 10 --max-ms 800
+
+With --max-ms, the exit code is 1 if the median startup time is above that, so this can
+guard against import time regressions in CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+STARTUP_CODE = "import websmash; websmash.create_app()"
+
+
+def time_startup(env: dict[str, str]) -> float:
+    """Start an interpreter importing websmash, returning the wall time in seconds"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', STARTUP_CODE], check=True, env=env)
+    return time.perf_counter() - start
+
+
+def slowest_imports(env: dict[str, str], count: int) -> list[tuple[str, int]]:
+    """Get the modules with the highest cumulative import time, in microseconds"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+                            check=True, env=env, capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # nested imports are indented by two spaces per level, only count websmash's own imports
+        # and the packages they pull in directly, not the modules those import in turn
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append((name.strip(), int(cumulative)))
+    return sorted(modules, key=lambda module: module[1], reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if the median startup takes longer")
+    parser.add_argument("--output", default=None, help="File to save the results to as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('PYTHONPATH', os.getcwd())
+
+    timings = [time_startup(env) * 1000 for _ in range(args.runs)]
+    result = {
+        'runs': args.runs,
+        'min_ms': min(timings),
+        'median_ms': statistics.median(timings),
+        'max_ms': max(timings),
+        'slowest_imports': slowest_imports(env, args.top),
+    }
+
+    print("startup: min {min_ms:.1f} ms, median {median_ms:.1f} ms, max {max_ms:.1f} ms".format(**result))
+    for name, cumulative in result['slowest_imports']:
+        print("{:>10.1f} ms  {}".format(cumulative / 1000, name))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump(result, handle, indent=2, sort_keys=True)
+
+    if args.max_ms is not None and result['median_ms'] > args.max_ms:
+        print("median startup time above {} ms".format(args.max_ms), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Compare round trips and latency of the legacy and the scripted job submission
+
+Run from the repository root:
+
+    python -m benchmarks.bench_submit --queued 5000 --submits 200 --rtt-ms 0.2
+"""
+import argparse
+import time
+
+from antismash_models import SyncJob as Job
+
+from websmash import app
+from websmash import utils
+from benchmarks.common import make_client, percentile, seed_queue
+
+
+def _legacy_count_pending(redis_store, config, attribute, value) -> int:
+    """Count the jobs in the default queue with the given attribute value, one round trip per job"""
+    count = 0
+    for job_id in redis_store.lrange(config['DEFAULT_QUEUE'], 0, -1):
+        if redis_store.hget("job:{}".format(job_id), attribute) == value:
+            count += 1
+    return count
+
+
+def _legacy_waitlist_job(job, config, attribute) -> None:
+    job.state = 'waiting'
+    job.status = 'waiting: Too many jobs in queue for this user.'
+    job.target_queues.append('{}:{}'.format(config['WAITLIST_PREFIX'], attribute))
+
+
+def legacy_submit(redis_store, job, config):
+    """Job submission as done before the server-side script"""
+    job.state = 'queued'
+    limit = config['MAX_JOBS_PER_USER']
+
+    if job.email in config['VIP_USERS']:
+        job.target_queues.append(config['PRIORITY_QUEUE'])
+    elif job.minimal:
+        job.target_queues.append(config['FAST_QUEUE'])
+    else:
+        job.target_queues.append(config['DEFAULT_QUEUE'])
+
+        if job.email and _legacy_count_pending(redis_store, config, 'email', job.email) > limit:
+            _legacy_waitlist_job(job, config, job.email)
+        elif _legacy_count_pending(redis_store, config, 'ip_addr', job.ip_addr) > limit:
+            _legacy_waitlist_job(job, config, job.ip_addr)
+
+    if job.needs_download:
+        job.target_queues.append(config['DOWNLOAD_QUEUE'])
+    queue = job.target_queues.pop()
+    job.commit()
+    redis_store.lpush(queue, job.job_id)
+
+
+def run(name, submit, args) -> dict:
+    redis_store, counter = make_client(args.redis_url, args.rtt_ms)
+    redis_store.flushdb()
+    config = dict(app.config)
+    config['MAX_JOBS_PER_USER'] = 1000000
+    seed_queue(redis_store, config, args.queued)
+
+    counter.reset()
+    latencies = []
+    for i in range(args.submits):
+        job = Job(redis_store, "bacteria-bench{}".format(i))
+        job.email = "submitter{}@example.com".format(i % 20)
+        job.ip_addr = "192.168.1.{}".format(i % 20)
+        start = time.perf_counter()
+        submit(redis_store, job, config)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "name": name,
+        "round_trips_per_submit": counter.count / args.submits,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queued", type=int, default=2000, help="Jobs already in the default queue")
+    parser.add_argument("--submits", type=int, default=100, help="Jobs to submit per variant")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="Simulated network round trip time")
+    parser.add_argument("--redis-url", default=None, help="Redis server to use instead of fakeredis")
+    args = parser.parse_args()
+
+    for name, submit in (("legacy", legacy_submit), ("scripted", utils._submit_job)):
+        result = run(name, submit, args)
+        print("{name:>10}: {round_trips_per_submit:10.1f} round trips, "
+              "p50 {p50_ms:8.2f} ms, p99 {p99_ms:8.2f} ms".format(**result))
+
+
+if __name__ == "__main__":
+    main()
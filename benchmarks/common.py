@@ -0,0 +1,121 @@
+"""Shared helpers for the websmash benchmarks"""
+import math
+import threading
+import time
+from typing import Optional
+
+from antismash_models import SyncJob as Job
+from fakeredis import FakeRedis
+from redis import Redis
+
+from websmash import utils
+
+
+class RoundTripCounter:
+    """Count the round trips made, commands sent and reply bytes received on all connections of a client"""
+
+    def __init__(self, rtt: float = 0.0) -> None:
+        self._lock = threading.Lock()
+        self.count = 0
+        self.commands = 0
+        self.received = 0
+        self.rtt = rtt
+
+    def add(self, round_trips: int = 0, commands: int = 0, received: int = 0) -> None:
+        with self._lock:
+            self.count += round_trips
+            self.commands += commands
+            self.received += received
+
+    def reset(self) -> None:
+        with self._lock:
+            self.count = 0
+            self.commands = 0
+            self.received = 0
+
+
+def reply_size(reply) -> int:
+    """Get the payload size of a decoded Redis reply, ignoring the protocol overhead"""
+    if isinstance(reply, (list, tuple)):
+        return sum(reply_size(item) for item in reply)
+    if isinstance(reply, bytes):
+        return len(reply)
+    if reply is None:
+        return 0
+    return len(str(reply).encode())
+
+
+def make_client(redis_url: Optional[str] = None, rtt_ms: float = 0.0):
+    """Create a Redis client counting round trips
+
+    :param redis_url: URL of a Redis server to use, or None to use fakeredis
+    :param rtt_ms: extra latency to add per round trip, to simulate a networked server
+    :return: tuple of client and its RoundTripCounter
+    """
+    if redis_url:
+        client = Redis.from_url(redis_url, encoding='utf-8', decode_responses=True)
+    else:
+        client = FakeRedis(encoding='utf-8', decode_responses=True)
+
+    counter = RoundTripCounter(rtt_ms / 1000)
+    base_class = client.connection_pool.connection_class
+
+    def send_packed_command(self, command, check_health=True):
+        counter.add(round_trips=1)
+        if counter.rtt:
+            time.sleep(counter.rtt)
+        return base_class.send_packed_command(self, command, check_health)
+
+    def send_command(self, *args, **kwargs):
+        counter.add(commands=1)
+        return base_class.send_command(self, *args, **kwargs)
+
+    def pack_commands(self, commands):
+        commands = list(commands)
+        counter.add(commands=len(commands))
+        return base_class.pack_commands(self, commands)
+
+    def read_response(self, *args, **kwargs):
+        response = base_class.read_response(self, *args, **kwargs)
+        counter.add(received=reply_size(response))
+        return response
+
+    client.connection_pool.connection_class = type(
+        "Counting{}".format(base_class.__name__), (base_class,), {
+            "send_packed_command": send_packed_command,
+            "send_command": send_command,
+            "pack_commands": pack_commands,
+            "read_response": read_response,
+        })
+    client.connection_pool.reset()
+    return client, counter
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Get the nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def seed_queue(redis_store, config, queued: int) -> list[str]:
+    """Fill the default queue with jobs from many different users
+
+    :return: the IDs of the queued jobs
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    job_ids = []
+    for i in range(queued):
+        job = Job(redis_store, "bacteria-seed{}".format(i))
+        job.email = "user{}@example.com".format(i % 500)
+        job.ip_addr = "10.0.{}.{}".format(i % 250, i % 200)
+        job.state = 'queued'
+        pipe.hset("job:{}".format(job.job_id), mapping=job.to_dict())
+        pipe.lpush(config['DEFAULT_QUEUE'], job.job_id)
+        pipe.sadd(utils._pending_index_key(config, 'email', job.email), job.job_id)
+        pipe.sadd(utils._pending_index_key(config, 'ip', job.ip_addr), job.job_id)
+        job_ids.append(job.job_id)
+    pipe.execute()
+    return job_ids
@@ -0,0 +1,117 @@
+"""Simulate the job wait times with a single FIFO queue and with fair-share queueing
+
+One heavy user submits a burst of jobs at the start while many light users submit a few
+jobs each at random times. Jobs go through the real submission and queueing code on
+fakeredis, only the clock and the workers are simulated. Run from the repository root:
+
+    python -m benchmarks.sim_fair_share --workers 8 --heavy-jobs 300 --light-users 50
+"""
+import argparse
+import heapq
+import json
+import random
+from typing import Any
+
+from antismash_models import SyncJob as Job
+from fakeredis import FakeRedis
+
+from websmash import app, fair_share, utils
+from benchmarks.common import percentile
+
+HEAVY_USER = 'heavy@example.com'
+
+
+def make_arrivals(args) -> list[tuple[float, str]]:
+    """Get the submission times and submitters of all jobs, in order"""
+    rng = random.Random(args.seed)
+    arrivals = [(0.0, HEAVY_USER)] * args.heavy_jobs
+    for i in range(args.light_users):
+        user = 'light{}@example.com'.format(i)
+        arrivals.extend((rng.uniform(0, args.duration * 60), user) for _ in range(args.light_jobs))
+    return sorted(arrivals, key=lambda arrival: arrival[0])
+
+
+def simulate(fair: bool, arrivals: list[tuple[float, str]], args) -> dict[str, list[float]]:
+    """Run the jobs through the queue, returning the wait times in minutes of heavy and light users"""
+    redis_store = FakeRedis(encoding='utf-8', decode_responses=True)
+    config = dict(app.config)
+    config['FAIR_SHARE'] = fair
+    config['MAX_JOBS_PER_USER'] = len(arrivals)
+    config['VIP_USERS'] = set()
+    rng = random.Random(args.seed)
+
+    submitted: dict[str, tuple[float, str]] = {}
+    waits: dict[str, list[float]] = {'heavy': [], 'light': []}
+    # events are (time, sequence, submitter), with a submitter of None for a job finishing
+    events = [(when, i, user) for i, (when, user) in enumerate(arrivals)]
+    heapq.heapify(events)
+    sequence = len(events)
+    idle = args.workers
+
+    while events:
+        now = events[0][0]
+        while events and events[0][0] == now:
+            _, _, user = heapq.heappop(events)
+            if user is None:
+                idle += 1
+                continue
+            job = Job(redis_store, 'bacteria-sim{}'.format(len(submitted)))
+            job.email = user
+            job.ip_addr = '10.0.0.{}'.format(len(submitted) % 250)
+            utils._submit_jobs(redis_store, [job], config, [{}], batch_size=1)
+            submitted[job.job_id] = (now, user)
+
+        while idle:
+            if fair:
+                job_ids = fair_share.take_jobs(redis_store, config, 1)
+                job_id = job_ids[0] if job_ids else None
+            else:
+                job_id = redis_store.rpop(config['DEFAULT_QUEUE'])
+            if job_id is None:
+                break
+            when, user = submitted[job_id]
+            waits['heavy' if user == HEAVY_USER else 'light'].append((now - when) / 60)
+            idle -= 1
+            sequence += 1
+            heapq.heappush(events, (now + rng.expovariate(1 / (args.job_minutes * 60)), sequence, None))
+
+    return waits
+
+
+def summarise(waits: list[float]) -> dict[str, Any]:
+    """Get the wait time percentiles of a group of jobs"""
+    return {
+        'jobs': len(waits),
+        'p50_minutes': percentile(waits, 50),
+        'p95_minutes': percentile(waits, 95),
+        'max_minutes': max(waits, default=0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8, help="Number of jobs running at the same time")
+    parser.add_argument("--heavy-jobs", type=int, default=300, help="Jobs the heavy user submits at the start")
+    parser.add_argument("--light-users", type=int, default=50, help="Number of light users")
+    parser.add_argument("--light-jobs", type=int, default=3, help="Jobs each light user submits")
+    parser.add_argument("--duration", type=float, default=600, help="Minutes over which light users submit")
+    parser.add_argument("--job-minutes", type=float, default=15, help="Mean job run time in minutes")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--output", default=None, help="File to save the results to as JSON")
+    args = parser.parse_args()
+
+    arrivals = make_arrivals(args)
+    results = {}
+    for mode, fair in (('fifo', False), ('fair-share', True)):
+        results[mode] = {users: summarise(waits) for users, waits in simulate(fair, arrivals, args).items()}
+        for users, result in results[mode].items():
+            print("{:>10} {:>5}: {jobs:5d} jobs, wait p50 {p50_minutes:7.1f} min, p95 {p95_minutes:7.1f} min, "
+                  "max {max_minutes:7.1f} min".format(mode, users, **result))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            json.dump({'settings': vars(args), 'results': results}, handle, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
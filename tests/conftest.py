@@ -21,11 +21,16 @@ def app(request, tmpdir_factory, monkeysession):
     results_dir = tmpdir_factory.mktemp('results')
     flask_app.config['TESTING'] = True
     flask_app.config['FAKE_DB'] = True
+    flask_app.config['STATS_CACHE_TTL'] = 0
+    flask_app.config['NEWS_CACHE_TTL'] = 0
     flask_app.config['RESULTS_PATH'] = str(results_dir)
     flask_app.config['MAIL_SUPPRESS_SEND'] = True
     flask_app.config['MAIL_DEFAULT_SENDER'] = "test@antismash.secondarymetabolites.org"
     flask_app.config['MAIL_HOST'] = 'localhost'
     flask_app.config['DARK_LAUNCH_PERCENTAGE'] = 0
+    flask_app.config['DARK_LAUNCH_WORKERS'] = 0
+    flask_app.config['METRICS_SAMPLE_INTERVAL'] = 0
+    flask_app.config['RATE_LIMITS'] = {}
     flask_app.config['LEGACY_JOBTYPE'] = "antismash5"
     mail = Mail()
     mail.init_app(flask_app)
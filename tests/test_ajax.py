@@ -2,7 +2,7 @@
 from antismash_models import SyncJob as Job, SyncNotice as Notice
 from tests.test_shared import WebsmashTestCase
 
-from websmash import get_db
+from websmash import get_db, notices
 
 class AjaxTestCase(WebsmashTestCase):
     def setUp(self):
@@ -89,6 +89,6 @@ class AjaxTestCase(WebsmashTestCase):
         n = Notice(redis_store, 'fake')
         n.teaser = 'Teaser'
         n.text = 'Text'
-        n.commit()
+        notices.add_notice(redis_store, n, self.app.config)
         rv = self.client.get('/api/v1.0/news')
         self.assertEqual(rv.json, dict(notices=[n.to_dict()]))
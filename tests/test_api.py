@@ -3,7 +3,8 @@ import os
 from antismash_models import SyncJob as Job
 from flask import url_for
 
-from websmash import get_db
+import websmash
+from websmash import get_db, outbox
 
 
 def test_version(client, app, git_version):
@@ -19,6 +20,26 @@ def test_version(client, app, git_version):
     assert response.json['git'] == git_version
 
 
+def test_git_version_stamp(monkeypatch, tmpdir):
+    """Test the git version is taken from the environment or the build-time stamp"""
+    monkeypatch.setattr(websmash, 'VERSION_STAMP', str(tmpdir.join('GIT_VERSION')))
+    monkeypatch.setenv('WEBSMASH_GIT_VERSION', 'fromenv')
+    websmash.get_git_version.cache_clear()
+    assert websmash.get_git_version() == 'fromenv'
+
+    monkeypatch.delenv('WEBSMASH_GIT_VERSION')
+    tmpdir.join('GIT_VERSION').write('stamped\n')
+    websmash.get_git_version.cache_clear()
+    assert websmash.get_git_version() == 'stamped'
+
+    tmpdir.join('GIT_VERSION').write('')
+    monkeypatch.setattr(websmash, '_get_git_version', lambda: 'fromgit')
+    websmash.get_git_version.cache_clear()
+    assert websmash.get_git_version() == 'fromgit'
+
+    websmash.get_git_version.cache_clear()
+
+
 def test_api_submit_upload(client, fake_sequence):
     """Test submitting a job with an uploaded file"""
     fake_fh = open(str(fake_sequence), 'rb')
@@ -32,6 +53,38 @@ def test_api_submit_upload(client, fake_sequence):
     assert redis.exists(job_key)
 
 
+def test_api_submit_bulk(client, fake_sequence):
+    """Test submitting several jobs in one request"""
+    with open(str(fake_sequence), 'rb') as first, open(str(fake_sequence), 'rb') as second:
+        data = dict(ncbi=['FAKE1', 'FAKE2'], seq=[first, second], email='bulk@example.com', minimal='true')
+        response = client.post(url_for('api_submit_bulk'), data=data)
+    assert 200 == response.status_code
+    job_ids = response.json['ids']
+    assert len(set(job_ids)) == 4
+
+    redis = get_db()
+    jobs = []
+    for job_id in job_ids:
+        job = Job(redis, job_id)
+        job.fetch()
+        jobs.append(job)
+    assert [job.download for job in jobs[:2]] == ['FAKE1', 'FAKE2']
+    assert all(job.filename.endswith('test.fa') for job in jobs[2:])
+    assert all(job.email == 'bulk@example.com' and job.minimal for job in jobs)
+
+
+def test_api_submit_bulk_invalid(client):
+    """Test bulk submissions are checked before any job is created"""
+    redis = get_db()
+    before = len(redis.keys('job:*'))
+    response = client.post(url_for('api_submit_bulk'), data=dict(ncbi=['FAKE1', 'FA KE2']))
+    assert 400 == response.status_code
+    assert len(redis.keys('job:*')) == before
+
+    response = client.post(url_for('api_submit_bulk'), data=dict(email='bulk@example.com'))
+    assert 400 == response.status_code
+
+
 def test_api_submit_upload_leading_dash(client, tmpdir_factory):
     """Test submitting a job with an uploaded file with a leading dash"""
     fake_sequence = tmpdir_factory.mktemp('to_upload').join('-test.fa')
@@ -89,11 +142,138 @@ def test_api_status_pending(client):
     assert 404 == response.status_code
 
 
+def test_api_status_queue_position(client, app, fake_sequence):
+    """Test queued jobs show their queue position"""
+    redis = get_db()
+    redis.delete(app.config['QUEUE_POSITION_INDEX'])
+    job_ids = []
+    for _ in range(2):
+        with open(str(fake_sequence), 'rb') as handle:
+            job_ids.append(client.post(url_for('api_submit'), data=dict(seq=handle)).json['id'])
+
+    response = client.get(url_for('status', task_id=job_ids[1]))
+    assert response.json['queue_position'] == 2
+    etag = response.headers['ETag']
+    assert client.post(url_for('batch_status'), json=dict(ids=job_ids)).json['jobs'][job_ids[1]] == response.json
+
+    redis.hset('job:{}'.format(job_ids[0]), 'state', 'running')
+    response = client.get(url_for('status', task_id=job_ids[1]), headers={'If-None-Match': etag})
+    assert 200 == response.status_code
+    assert response.json['queue_position'] == 1
+
+
 def test_api_email_send(client, app):
     """Test sending a feedback email"""
-    with app.mail.record_messages() as outbox:
+    redis = get_db()
+    redis.delete(app.config['MAIL_OUTBOX'])
+    with app.mail.record_messages() as sent:
         response = client.post(url_for('send_email'),
                                data=json.dumps(dict(email="test@example.com", message="Test message")),
                                content_type='application/json')
         assert 204 == response.status_code
-        assert len(outbox) == 2
+        assert len(sent) == 0
+        assert redis.llen(app.config['MAIL_OUTBOX']) == 2
+
+        assert outbox.send_batch(redis, app.config, app.mail, outbox.pop_batch(redis, app.config)) == 2
+        assert len(sent) == 2
+    assert sent[0].recipients == app.config['DEFAULT_RECIPIENTS']
+    assert sent[1].recipients == ["test@example.com"]
+
+    for email in ["a@b.c\nBcc: x@example.com", "not an address", ["test@example.com"]]:
+        response = client.post(url_for('send_email'), json=dict(email=email, message="Test message"))
+        assert 400 == response.status_code
+    assert redis.llen(app.config['MAIL_OUTBOX']) == 0
+
+
+def test_api_batch_status(client, app):
+    """Test reading the status of several jobs at once"""
+    job_ids = []
+    for _ in range(3):
+        response = client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+        job_ids.append(response.json['id'])
+
+    redis = get_db()
+    job = Job(redis, job_ids[0])
+    job.fetch()
+    job.state = 'done'
+    job.commit()
+
+    response = client.post(url_for('batch_status'), json=dict(ids=job_ids + ['nonexistent']))
+    assert 200 == response.status_code
+    jobs = response.json['jobs']
+    assert sorted(jobs) == sorted(job_ids + ['nonexistent'])
+    assert jobs['nonexistent'] == {'error': 'Not found'}
+    for job_id in job_ids:
+        assert jobs[job_id] == client.get(url_for('status', task_id=job_id)).json
+    assert 'result_url' in jobs[job_ids[0]]
+
+
+def test_api_batch_status_streamed(client, app, monkeypatch):
+    """Test large batch status requests are streamed"""
+    monkeypatch.setitem(app.config, 'STATUS_BATCH_CHUNK_SIZE', 2)
+    job_ids = [client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).json['id'] for _ in range(3)]
+
+    response = client.post(url_for('batch_status'), json=dict(ids=job_ids + ['nonexistent', job_ids[0]]))
+    assert 200 == response.status_code
+    assert response.is_streamed
+    jobs = json.loads(response.get_data(as_text=True))['jobs']
+    assert list(jobs) == job_ids + ['nonexistent']
+    assert jobs['nonexistent'] == {'error': 'Not found'}
+    for job_id in job_ids:
+        assert jobs[job_id] == client.get(url_for('status', task_id=job_id)).json
+
+
+def test_api_batch_status_invalid(client, app, monkeypatch):
+    """Test invalid batch status requests are rejected"""
+    assert 400 == client.post(url_for('batch_status'), json=dict(ids='not-a-list')).status_code
+    assert 400 == client.post(url_for('batch_status'), json=[1, 2]).status_code
+    monkeypatch.setitem(app.config, 'STATUS_BATCH_MAX_IDS', 1)
+    assert 400 == client.post(url_for('batch_status'), json=dict(ids=['a', 'b'])).status_code
+
+
+def test_api_status_conditional(client):
+    """Test job status responses can be revalidated"""
+    job_id = client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).json['id']
+
+    response = client.get(url_for('status', task_id=job_id))
+    assert 200 == response.status_code
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert response.cache_control.no_cache
+
+    response = client.get(url_for('status', task_id=job_id), headers={'If-None-Match': etag})
+    assert 304 == response.status_code
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get(url_for('status', task_id=job_id), headers={'If-Modified-Since': last_modified})
+    assert 304 == response.status_code
+
+    redis = get_db()
+    job = Job(redis, job_id)
+    job.fetch()
+    job.state = 'running'
+    job.commit()
+
+    response = client.get(url_for('status', task_id=job_id), headers={'If-None-Match': etag})
+    assert 200 == response.status_code
+    assert response.json['state'] == 'running'
+    assert response.headers['ETag'] != etag
+
+
+def test_api_status_round_trips(client, app, monkeypatch):
+    """Test status requests read the job and its queue position in as few round trips as possible"""
+    monkeypatch.setitem(app.config, 'REDIS_TRACING', True)
+    monkeypatch.setitem(app.config, 'REDIS_TRACING_HEADER', True)
+    job_id = client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).json['id']
+    # the first request loads the script
+    response = client.get(url_for('status', task_id=job_id))
+    etag = response.headers['ETag']
+
+    response = client.get(url_for('status', task_id=job_id))
+    assert response.headers['X-Redis-Trace'].startswith('commands=2; round_trips=2;')
+    response = client.get(url_for('status', task_id=job_id), headers={'If-None-Match': etag})
+    assert 304 == response.status_code
+    assert response.headers['X-Redis-Trace'].startswith('commands=1; round_trips=1;')
+    response = client.post(url_for('batch_status'), json=dict(ids=[job_id, 'nonexistent']))
+    assert response.headers['X-Redis-Trace'].startswith('commands=1; round_trips=1;')
@@ -0,0 +1,208 @@
+"""Tests for the async serving mode"""
+import asyncio
+import json
+import os
+import time
+
+from antismash_models import SyncJob as Job
+from flask import url_for
+
+from websmash import events, get_db, ratelimit, uploads
+from websmash.asgi import create_asgi_app
+from websmash.uploads import staging_dir
+
+
+def _request(method, path, headers=None, body=b'', messages=None, after=None):
+    """Send a request through the ASGI app, returning status, headers and body
+
+    :param messages: the messages to receive instead of a single one with the body
+    :param after: coroutine function run alongside the app once the messages are received
+    """
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        'client': ('127.0.0.1', 12345),
+        'server': ('localhost', 80),
+    }
+    if messages is None:
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+    done = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # the client stays connected until told otherwise
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        if after is None:
+            await create_asgi_app()(scope, receive, send)
+            return
+        app_task = asyncio.ensure_future(create_asgi_app()(scope, receive, send))
+        await after()
+        done.set()
+        await app_task
+
+    asyncio.run(run())
+
+    if not sent:
+        return None
+    assert sent[0]['type'] == 'http.response.start'
+    response_headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_asgi_matches_wsgi(client, app):
+    """Test the async endpoints give the same responses as the regular ones"""
+    response = client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    job_id = response.json['id']
+
+    for path in ('/api/v1.0/version', '/api/v1.0/stats', '/api/v1.0/news', '/api/v1.0/status/{}'.format(job_id)):
+        status, headers, body = _request('GET', path)
+        expected = client.get(path)
+        assert status == expected.status_code
+        assert json.loads(body) == expected.json
+        assert headers.get('etag') == expected.headers.get('ETag')
+
+
+def test_asgi_status(client, app):
+    """Test status errors and conditional requests in the async mode"""
+    status, _, body = _request('GET', '/api/v1.0/status/nonexistent')
+    assert status == 404
+    assert json.loads(body) == {'error': 'Not found'}
+
+    response = client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    path = '/api/v1.0/status/{}'.format(response.json['id'])
+    _, headers, _ = _request('GET', path)
+    status, _, body = _request('GET', path, headers={'If-None-Match': headers['etag']})
+    assert status == 304
+    assert body == b''
+
+
+def test_asgi_status_rate_limit(app, monkeypatch):
+    """Test the async status view is rate limited without the blocking Redis client"""
+    monkeypatch.setattr(ratelimit, '_empty_buckets', {})
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'status': {'ip': (1, 60)}})
+    monkeypatch.setattr(ratelimit, 'get_db', None)
+    get_db().delete('{}:status:ip:127.0.0.1'.format(app.config['RATE_LIMIT_PREFIX']))
+
+    status, _, _ = _request('GET', '/api/v1.0/status/nonexistent')
+    assert status == 404
+    status, headers, body = _request('GET', '/api/v1.0/status/nonexistent')
+    assert status == 429
+    assert headers['retry-after'] == '60'
+    assert json.loads(body) == {'error': 'Too many requests'}
+
+
+def test_asgi_submit(app):
+    """Test the endpoints without async views are served by the regular Flask views"""
+    status, _, body = _request('POST', '/api/v1.0/submit', body=b'ncbi=FAKE',
+                               headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    assert status == 200
+    job = Job(get_db(), json.loads(body)['id'])
+    job.fetch()
+    assert job.download == 'FAKE'
+
+    status, _, body = _request('GET', '/api/v1.0/nonexistent')
+    assert status == 404
+    assert json.loads(body) == {'error': 'Not found'}
+
+
+def test_asgi_body_limit(app, monkeypatch):
+    """Test request bodies are only read up to MAX_CONTENT_LENGTH"""
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 10)
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    status, _, _ = _request('POST', '/api/v1.0/submit', body=b'ncbi=FAKE&x=1', headers=headers)
+    assert status == 413
+
+    # the declared length is checked before reading anything
+    messages = []
+    status, _, _ = _request('POST', '/api/v1.0/submit', messages=messages, headers={'Content-Length': '11', **headers})
+    assert status == 413
+
+    # without a declared length, reading stops once the limit is passed
+    messages = [{'type': 'http.request', 'body': b'ncbi=FAKE', 'more_body': True},
+                {'type': 'http.request', 'body': b'&x=1', 'more_body': True},
+                {'type': 'http.request', 'body': b'never read', 'more_body': False}]
+    status, _, _ = _request('POST', '/api/v1.0/submit', messages=messages, headers=headers)
+    assert status == 413
+    assert len(messages) == 1
+
+
+def test_asgi_streamed_upload(app, monkeypatch):
+    """Test request bodies are streamed to the Flask views instead of being read up front"""
+    content = b'>test\n' + b'ATGC' * 100000 + b'\n'
+    body = (b'--boundary\r\nContent-Disposition: form-data; name="seq"; filename="test.fa"\r\n\r\n'
+            + content + b'\r\n--boundary--\r\n')
+    chunk = 16 * 1024
+    messages = [{'type': 'http.request', 'body': body[i:i + chunk], 'more_body': i + chunk < len(body)}
+                for i in range(0, len(body), chunk)]
+    unreceived = []
+    monkeypatch.setattr(uploads, 'staging_dir', lambda config: unreceived.append(len(messages)) or staging_dir(config))
+
+    status, _, response = _request('POST', '/api/v1.0/submit', messages=messages,
+                                   headers={'Content-Type': 'multipart/form-data; boundary=boundary'})
+    assert status == 200
+    # the upload was staged while the body was still arriving
+    assert unreceived and unreceived[0] > 0
+    job_id = json.loads(response)['id']
+    with open(os.path.join(app.config['RESULTS_PATH'], job_id, 'input', 'test.fa'), 'rb') as handle:
+        assert handle.read() == content
+
+
+def test_asgi_disconnect_during_body(app):
+    """Test requests of clients leaving before sending the whole body are dropped"""
+    messages = [{'type': 'http.request', 'body': b'ncbi=', 'more_body': True}, {'type': 'http.disconnect'}]
+    assert _request('POST', '/api/v1.0/submit', messages=messages,
+                    headers={'Content-Type': 'application/x-www-form-urlencoded'}) is None
+
+
+def test_asgi_status_events(client, app, monkeypatch):
+    """Test event streams are served asynchronously"""
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.05)
+    job = Job(get_db(), 'bacteria-asgi-events')
+    job.state = 'queued'
+    job.commit()
+
+    async def finish_job():
+        await asyncio.sleep(0.2)
+        job.state = 'done'
+        job.commit()
+        events.publish_job_update(get_db(), app.config, job.job_id)
+        await asyncio.sleep(0.2)
+
+    status, headers, body = _request('GET', '/api/v1.0/status/{}/events'.format(job.job_id), after=finish_job)
+    assert status == 200
+    assert headers['content-type'].startswith('text/event-stream')
+    body = body.decode()
+    assert body.count('event: status') == 2
+    assert ': keepalive' in body
+    assert events.limiter.active == 0
+
+
+def test_asgi_status_events_disconnect(app, monkeypatch):
+    """Test event streams end when the client goes away"""
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 60)
+    job = Job(get_db(), 'bacteria-asgi-events')
+    job.state = 'queued'
+    job.commit()
+
+    start = time.monotonic()
+    status, _, body = _request('GET', '/api/v1.0/status/{}/events'.format(job.job_id),
+                               after=lambda: asyncio.sleep(0.1))
+    assert time.monotonic() - start < 5
+    assert status == 200
+    assert body.decode().count('event: status') == 1
+    assert events.limiter.active == 0
+
+    status, _, _ = _request('GET', '/api/v1.0/status/nonexistent/events')
+    assert status == 404
+    assert events.limiter.active == 0
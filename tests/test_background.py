@@ -0,0 +1,62 @@
+"""Tests for the background executor"""
+import threading
+
+from websmash.background import BackgroundExecutor
+
+
+def test_background_executor():
+    executor = BackgroundExecutor('test')
+    done = []
+
+    def task(value):
+        done.append(value)
+
+    def failing_task():
+        raise RuntimeError("broken")
+
+    assert executor.submit(2, 10, task, 1)
+    assert executor.submit(2, 10, failing_task)
+    assert executor.drain(timeout=5)
+    executor.shutdown()
+
+    assert done == [1]
+    stats = executor.stats()
+    assert stats['submitted'] == 2
+    assert stats['completed'] == 1
+    assert stats['failed'] == 1
+    assert stats['pending'] == 0
+    assert stats['max_lag'] >= stats['last_lag'] >= 0
+
+
+def test_background_executor_bounded():
+    executor = BackgroundExecutor('test')
+    release = threading.Event()
+
+    assert executor.submit(1, 1, release.wait, 5)
+    assert not executor.submit(1, 1, release.wait, 5)
+    assert executor.stats()['dropped'] == 1
+
+    release.set()
+    executor.shutdown()
+    assert executor.pending == 0
+
+
+def test_background_executor_inline():
+    executor = BackgroundExecutor('test')
+    done = []
+    assert executor.submit(0, 0, done.append, 1)
+    assert done == [1]
+    assert executor.stats()['completed'] == 1
+
+
+def test_background_executor_shutdown_timeout():
+    executor = BackgroundExecutor('test')
+    release = threading.Event()
+    done = []
+
+    assert executor.submit(1, 10, release.wait, 5)
+    assert executor.submit(1, 10, done.append, 1)
+    assert not executor.shutdown(timeout=0.05)
+    release.set()
+    # the task still waiting was dropped
+    assert done == []
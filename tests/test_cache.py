@@ -0,0 +1,101 @@
+"""Tests for the in-process snapshot cache"""
+import asyncio
+import threading
+import time
+
+from websmash.cache import AsyncSnapshotCache, SnapshotCache
+
+
+def test_snapshot_cache_max_age(monkeypatch):
+    cache = SnapshotCache()
+    calls = []
+
+    def refresh():
+        calls.append(1)
+        return len(calls)
+
+    clock = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+
+    assert cache.get(5, refresh) == 1
+    clock[0] += 4
+    assert cache.get(5, refresh) == 1
+    clock[0] += 2
+    assert cache.get(5, refresh) == 2
+
+    cache.invalidate()
+    assert cache.get(5, refresh) == 3
+
+
+def test_snapshot_cache_single_flight():
+    cache = SnapshotCache()
+    calls = []
+    release = threading.Event()
+
+    def refresh():
+        calls.append(1)
+        release.wait(5)
+        return 'fresh'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(60, refresh))) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ['fresh'] * 10
+
+
+def test_snapshot_cache_serves_stale_during_refresh():
+    cache = SnapshotCache()
+    assert cache.get(0, lambda: 'old') == 'old'
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_refresh():
+        started.set()
+        release.wait(5)
+        return 'new'
+
+    thread = threading.Thread(target=cache.get, args=(0, slow_refresh))
+    thread.start()
+    started.wait(5)
+    assert cache.get(0, lambda: 'unexpected') == 'old'
+    release.set()
+    thread.join()
+    assert cache.get(60, lambda: 'unexpected') == 'new'
+
+
+def test_async_snapshot_cache():
+    cache = AsyncSnapshotCache()
+    calls = []
+    release = asyncio.Event()
+
+    async def refresh():
+        calls.append(1)
+        await release.wait()
+        return len(calls)
+
+    async def run():
+        waiting = [asyncio.ensure_future(cache.get(60, refresh)) for _ in range(10)]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*waiting) == [1] * 10
+
+        # expired values are served while a refresh is running
+        release.clear()
+        refreshing = asyncio.ensure_future(cache.get(0, refresh))
+        await asyncio.sleep(0)
+        assert await cache.get(0, refresh) == 1
+        release.set()
+        assert await refreshing == 2
+
+        cache.invalidate()
+        assert await cache.get(60, refresh) == 3
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+"""Tests for the process-wide Redis connection pools"""
+import asyncio
+
+import pytest
+import redis.asyncio
+import redis.asyncio.sentinel
+from redis.sentinel import SentinelConnectionPool
+
+from websmash import connection
+
+
+@pytest.fixture
+def redis_config(monkeypatch):
+    monkeypatch.setattr(connection, '_pools', {})
+    monkeypatch.setattr(connection, '_clients', {})
+    monkeypatch.setattr(connection, '_async_clients', {})
+    return {
+        'REDIS_URL': 'redis://:secret@localhost:6379/0',
+        'REDIS_MAX_CONNECTIONS': 7,
+        'REDIS_SOCKET_TIMEOUT': None,
+        'REDIS_SOCKET_CONNECT_TIMEOUT': 5,
+        'REDIS_SENTINEL_SOCKET_TIMEOUT': 0.1,
+    }
+
+
+def test_parse_sentinel_url():
+    assert connection.parse_sentinel_url('sentinel://sentinel.example.com/mymaster') == \
+        ([('sentinel.example.com', 26379)], 'mymaster')
+    assert connection.parse_sentinel_url('sentinel://one:26380,two,three:26381/mymaster') == \
+        ([('one', 26380), ('two', 26379), ('three', 26381)], 'mymaster')
+
+    with pytest.raises(ValueError):
+        connection.parse_sentinel_url('sentinel://one:26380')
+
+
+def test_get_client_shares_pool(redis_config):
+    client = connection.get_client(redis_config)
+    assert connection.get_client(redis_config) is client
+    assert client.connection_pool is connection.get_connection_pool(redis_config)
+    assert client.connection_pool.max_connections == 7
+
+    stats = connection.pool_stats()
+    assert stats == {
+        'redis://:***@localhost:6379/0': {'created': 0, 'in_use': 0, 'idle': 0, 'max_connections': 7},
+    }
+
+
+def test_get_client_after_fork(redis_config, monkeypatch):
+    client = connection.get_client(redis_config)
+    monkeypatch.setattr(connection, '_pid', -1)
+    new_client = connection.get_client(redis_config)
+    assert new_client is not client
+    assert new_client.connection_pool is not client.connection_pool
+
+
+def test_get_client_sentinel(redis_config):
+    redis_config['REDIS_URL'] = 'sentinel://one:26380,two:26381/mymaster'
+    pool = connection.get_client(redis_config).connection_pool
+    assert isinstance(pool, SentinelConnectionPool)
+    assert pool.service_name == 'mymaster'
+    assert [s.connection_pool.connection_kwargs['host'] for s in pool.sentinel_manager.sentinels] == ['one', 'two']
+    assert pool.connection_kwargs['socket_timeout'] == 0.1
+
+
+def test_get_client_invalid(redis_config):
+    redis_config['REDIS_URL'] = 'memcached://localhost'
+    with pytest.raises(ValueError, match="Invalid redis configuration"):
+        connection.get_client(redis_config)
+
+
+def test_get_async_client(redis_config):
+    client = connection.get_async_client(redis_config)
+    assert isinstance(client, redis.asyncio.Redis)
+    assert connection.get_async_client(redis_config) is client
+    assert client.connection_pool.max_connections == 7
+
+    asyncio.run(connection.close_async_clients())
+    assert connection.get_async_client(redis_config) is not client
+
+    redis_config['REDIS_URL'] = 'sentinel://one,two/mymaster'
+    client = connection.get_async_client(redis_config)
+    assert isinstance(client.connection_pool, redis.asyncio.sentinel.SentinelConnectionPool)
@@ -0,0 +1,118 @@
+"""Tests for the server-sent job status events"""
+import json
+import threading
+import time
+
+from antismash_models import SyncJob as Job
+from flask import url_for
+import pytest
+
+from websmash import events, get_db
+
+
+def _parse_events(body):
+    """Get the (event, data) pairs of a server-sent event stream"""
+    parsed = []
+    for block in body.split('\n\n'):
+        lines = block.split('\n')
+        if not lines[0].startswith('event: '):
+            continue
+        parsed.append((lines[0][7:], json.loads(lines[1][6:])))
+    return parsed
+
+
+@pytest.fixture
+def job(app):
+    job = Job(get_db(), 'bacteria-events')
+    job.state = 'queued'
+    job.commit()
+    return job
+
+
+def test_status_events_finished_job(client, app, job):
+    job.state = 'done'
+    job.commit()
+
+    response = client.get(url_for('status_events', task_id=job.job_id))
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    parsed = _parse_events(response.get_data(as_text=True))
+    assert [(event, data['state']) for event, data in parsed] == [('status', 'done')]
+    assert 'result_url' in parsed[0][1]
+    assert events.limiter.active == 1
+    response.close()
+    assert events.limiter.active == 0
+
+
+def test_status_events_pushes_updates(client, app, job, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.05)
+    redis_store = get_db()
+
+    def finish_job():
+        time.sleep(0.2)
+        job.state = 'running'
+        job.commit()
+        events.publish_job_update(redis_store, app.config, job.job_id)
+        time.sleep(0.2)
+        job.state = 'done'
+        job.commit()
+        events.publish_job_update(redis_store, app.config, job.job_id)
+
+    worker = threading.Thread(target=finish_job)
+    worker.start()
+    response = client.get(url_for('status_events', task_id=job.job_id))
+    body = response.get_data(as_text=True)
+    response.close()
+    worker.join()
+
+    states = [data['state'] for _, data in _parse_events(body)]
+    assert states == ['queued', 'running', 'done']
+    assert ': keepalive' in body
+
+
+def test_status_events_max_duration(client, app, job, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.01)
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_DURATION', 0.05)
+    response = client.get(url_for('status_events', task_id=job.job_id))
+    assert [data['state'] for _, data in _parse_events(response.get_data(as_text=True))] == ['queued']
+    response.close()
+
+
+def test_status_events_fallback(client, app, job, monkeypatch):
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_CONNECTIONS', 0)
+    response = client.get(url_for('status_events', task_id=job.job_id))
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert response.json == client.get(url_for('status', task_id=job.job_id)).json
+
+
+def test_status_events_not_found(client, app):
+    response = client.get(url_for('status_events', task_id='nonexistent'))
+    assert response.status_code == 404
+    assert events.limiter.active == 0
+
+
+def test_job_updates_published(client, app, fake_sequence):
+    pubsub = get_db().pubsub()
+    pubsub.psubscribe('{}:*'.format(app.config['JOB_UPDATES_PREFIX']))
+    assert pubsub.get_message(timeout=1)['type'] == 'psubscribe'
+    try:
+        with open(str(fake_sequence), 'rb') as handle:
+            response = client.post(url_for('api_submit'), data=dict(seq=handle))
+        message = pubsub.get_message(timeout=1)
+        assert message['channel'] == events.job_update_channel(app.config, response.json['id'])
+        assert message['data'] == response.json['id']
+    finally:
+        pubsub.close()
+
+
+def test_job_update_published_by_submit_script(client, app, monkeypatch):
+    """Test announcing a new job doesn't take another round trip"""
+    monkeypatch.setitem(app.config, 'REDIS_TRACING', True)
+    monkeypatch.setitem(app.config, 'REDIS_TRACING_HEADER', True)
+    # the first submission loads the script
+    client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    response = client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    trace = response.headers['X-Redis-Trace']
+    assert trace.startswith('commands=1; round_trips=1;')
+    assert trace.endswith('by_command=EVALSHA=1')
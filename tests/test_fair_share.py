@@ -0,0 +1,124 @@
+"""Tests for the fair-share queueing"""
+from antismash_models import SyncJob as Job
+import pytest
+
+from websmash import fair_share, get_db, stats, utils, waitlist
+
+
+@pytest.fixture
+def fake_db(app, monkeypatch):
+    redis_store = get_db()
+    for prefix in ('FAIR_SHARE_PREFIX', 'FAIR_SHARE_INDEX', 'WAITLIST_PREFIX', 'PENDING_INDEX_PREFIX'):
+        for key in redis_store.scan_iter(match='{}:*'.format(app.config[prefix])):
+            redis_store.delete(key)
+    redis_store.delete(app.config['FAIR_SHARE_INDEX'], app.config['WAITLIST_INDEX'], app.config['DEFAULT_QUEUE'])
+    monkeypatch.setitem(app.config, 'FAIR_SHARE', True)
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 100)
+    return redis_store
+
+
+def _submit(redis_store, config, email, count):
+    jobs = []
+    for i in range(count):
+        job = Job(redis_store, 'taxon-{}-{}'.format(email.split('@')[0], i))
+        job.email = email
+        job.ip_addr = '10.0.0.1'
+        jobs.append(job)
+    utils._submit_jobs(redis_store, jobs, config, [{}] * count, batch_size=count)
+    return [job.job_id for job in jobs]
+
+
+def test_submit_to_sub_queue(app, fake_db):
+    job_ids = _submit(fake_db, app.config, 'heavy@example.com', 3)
+    queue = fair_share.queue_name(app.config, 'heavy@example.com')
+    assert fake_db.lrange(queue, 0, -1) == job_ids[::-1]
+    assert fake_db.zrange(app.config['FAIR_SHARE_INDEX'], 0, -1) == [queue]
+    assert fake_db.llen(app.config['DEFAULT_QUEUE']) == 0
+    assert stats.fetch_stats(fake_db, app.config)['queue_length'] == 3
+
+    job = Job(fake_db, job_ids[0])
+    job.fetch()
+    assert job.state == 'queued'
+    assert job.target_queues == []
+
+
+def test_take_jobs_round_robin(app, fake_db):
+    heavy = _submit(fake_db, app.config, 'heavy@example.com', 4)
+    light = _submit(fake_db, app.config, 'light@example.com', 2)
+
+    assert fair_share.take_jobs(fake_db, app.config, 10) == [heavy[0], light[0], heavy[1], light[1], heavy[2], heavy[3]]
+    assert fake_db.zcard(app.config['FAIR_SHARE_INDEX']) == 0
+    assert stats.fetch_stats(fake_db, app.config)['queue_length'] == 0
+
+    # having just run a job doesn't put the heavy user ahead of the others again
+    heavy = _submit(fake_db, app.config, 'heavy@example.com', 2)
+    light = _submit(fake_db, app.config, 'light@example.com', 1)
+    assert fair_share.take_jobs(fake_db, app.config, 3) == [light[0], heavy[0], heavy[1]]
+
+
+def test_take_jobs_weighted(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIP_USERS', {'vip@example.com'})
+    monkeypatch.setitem(app.config, 'FAIR_SHARE_VIP_WEIGHT', 2)
+    fair_share.sync_weights(fake_db, app.config)
+
+    vip = _submit(fake_db, app.config, 'vip@example.com', 4)
+    other = _submit(fake_db, app.config, 'other@example.com', 4)
+    assert fake_db.llen(app.config['PRIORITY_QUEUE']) == 0
+
+    taken = fair_share.take_jobs(fake_db, app.config, 6)
+    assert sum(job_id in vip for job_id in taken) == 4
+    assert sum(job_id in other for job_id in taken) == 2
+
+
+def test_feed_default_queue(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'FAIR_SHARE_BUFFER', 2)
+    heavy = _submit(fake_db, app.config, 'heavy@example.com', 3)
+    light = _submit(fake_db, app.config, 'light@example.com', 1)
+
+    assert fair_share.feed_default_queue(fake_db, app.config) == 2
+    assert fair_share.feed_default_queue(fake_db, app.config) == 0
+    assert fake_db.rpop(app.config['DEFAULT_QUEUE']) == heavy[0]
+    assert fair_share.feed_default_queue(fake_db, app.config) == 1
+    assert fake_db.rpop(app.config['DEFAULT_QUEUE'], 2) == [light[0], heavy[1]]
+
+
+def test_promote_to_sub_queue(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 0)
+    first, waiting = _submit(fake_db, app.config, 'heavy@example.com', 2)
+    queue = fair_share.queue_name(app.config, 'heavy@example.com')
+    assert fair_share.take_jobs(fake_db, app.config, 10) == [first]
+
+    fake_db.hset('job:{}'.format(first), 'state', 'done')
+    assert [job_id for job_id, _ in waitlist.promote_waitlisted(fake_db, app.config)] == [waiting]
+    assert fake_db.lrange(queue, 0, -1) == [waiting]
+    assert fair_share.take_jobs(fake_db, app.config, 10) == [waiting]
+
+
+def test_rebuild_fair_share_index(app, fake_db):
+    queue = fair_share.queue_name(app.config, 'downloaded@example.com')
+    fake_db.lpush(queue, 'taxon-downloaded')
+    fake_db.set('{}:queued'.format(app.config['FAIR_SHARE_INDEX']), -1)
+
+    assert fair_share.rebuild_fair_share_index(fake_db, app.config) == 1
+    assert fake_db.zrange(app.config['FAIR_SHARE_INDEX'], 0, -1) == [queue]
+    assert stats.fetch_stats(fake_db, app.config)['queue_length'] == 1
+    assert fair_share.take_jobs(fake_db, app.config, 10) == ['taxon-downloaded']
+
+
+def test_rebuild_fair_share_index_concurrent_submission(app, fake_db, monkeypatch):
+    downloaded = fair_share.queue_name(app.config, 'downloaded@example.com')
+    fake_db.lpush(downloaded, 'taxon-downloaded')
+    scan_iter = fake_db.scan_iter
+    late = []
+
+    def submit_during_scan(*args, **kwargs):
+        found = list(scan_iter(*args, **kwargs))
+        # a job submitted after the scan, counted by the submission script
+        late.extend(_submit(fake_db, app.config, 'late@example.com', 1))
+        return iter(found)
+
+    monkeypatch.setattr(fake_db, 'scan_iter', submit_during_scan)
+    assert fair_share.rebuild_fair_share_index(fake_db, app.config) == 1
+    assert fake_db.get('{}:queued'.format(app.config['FAIR_SHARE_INDEX'])) == '2'
+    assert sorted(fair_share.take_jobs(fake_db, app.config, 10)) == ['taxon-downloaded'] + late
+    assert fake_db.get('{}:queued'.format(app.config['FAIR_SHARE_INDEX'])) == '0'
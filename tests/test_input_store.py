@@ -0,0 +1,63 @@
+"""Tests for the content-addressed input store"""
+import errno
+import hashlib
+import os
+
+import pytest
+
+from websmash import input_store
+
+
+@pytest.fixture
+def store_config(tmpdir):
+    return {'RESULTS_PATH': str(tmpdir), 'INPUT_STORE_PATH': None}
+
+
+def _job_file(tmpdir, job_id, content):
+    filename = tmpdir.mkdir(job_id).join('input.fa')
+    filename.write_binary(content)
+    return str(filename), "sha256:{}".format(hashlib.sha256(content).hexdigest())
+
+
+def test_add_file_deduplicates(store_config, tmpdir):
+    first, checksum = _job_file(tmpdir, 'bacteria-one', b'>seq\nATG\n')
+    second, _ = _job_file(tmpdir, 'bacteria-two', b'>seq\nATG\n')
+
+    input_store.add_file(store_config, first, checksum)
+    input_store.add_file(store_config, second, checksum)
+
+    stored = input_store.store_path(store_config, checksum)
+    assert stored.startswith(os.path.join(str(tmpdir), '.store', 'sha256'))
+    assert os.stat(stored).st_nlink == 3
+    assert os.stat(first).st_ino == os.stat(second).st_ino == os.stat(stored).st_ino
+    with open(second, 'rb') as handle:
+        assert handle.read() == b'>seq\nATG\n'
+    assert os.listdir(os.path.dirname(second)) == ['input.fa']
+
+
+def test_collect_garbage(store_config, tmpdir):
+    used, used_checksum = _job_file(tmpdir, 'bacteria-used', b'used')
+    unused, unused_checksum = _job_file(tmpdir, 'bacteria-unused', b'unused')
+    input_store.add_file(store_config, used, used_checksum)
+    input_store.add_file(store_config, unused, unused_checksum)
+
+    assert input_store.collect_garbage(store_config) == 0
+    os.unlink(unused)
+    assert input_store.collect_garbage(store_config) == 1
+    assert os.path.exists(input_store.store_path(store_config, used_checksum))
+    assert not os.path.exists(input_store.store_path(store_config, unused_checksum))
+
+
+def test_link_or_copy_across_devices(tmpdir, mocker):
+    source = tmpdir.join('source')
+    source.write('data')
+    destination = str(tmpdir.join('destination'))
+    assert input_store.link_or_copy(str(source), destination) == 'link'
+
+    os.unlink(destination)
+    mocker.patch('os.link', side_effect=OSError(errno.EXDEV, "Invalid cross-device link"))
+    mocker.patch('websmash.input_store._reflink', return_value=False)
+    assert input_store.link_or_copy(str(source), destination) == 'copy'
+    assert os.stat(destination).st_ino != os.stat(str(source)).st_ino
+    with open(destination) as handle:
+        assert handle.read() == 'data'
@@ -0,0 +1,38 @@
+"""Tests for the projected job reads"""
+from antismash_models import SyncJob as Job
+import pytest
+
+from websmash import get_db
+from websmash.job_view import JobView
+
+
+@pytest.fixture
+def job(app):
+    job = Job(get_db(), 'bacteria-view')
+    job.email = 'view@example.com'
+    job.state = 'queued'
+    job.commit()
+    yield job
+    job.delete()
+
+
+def test_fetch(job):
+    view = JobView.fetch(get_db(), job.job_id)
+    assert view.job_id == job.job_id
+    assert view.state == 'queued'
+    assert 'state' not in view.missing
+    assert 'email' in view.missing
+
+    # other fields are read on first use
+    assert view.email == 'view@example.com'
+    assert view.missing == ()
+    assert view.load().to_dict() == job.to_dict()
+
+    assert JobView.fetch(get_db(), 'bacteria-nonexistent') is None
+    with pytest.raises(AttributeError):
+        view.nonexistent
+
+
+def test_missing_job(app):
+    view = JobView(Job(get_db(), 'bacteria-nonexistent'), ('state', 'genefinder'), (None, None))
+    assert not view.exists
@@ -0,0 +1,75 @@
+"""Tests for the Prometheus metrics"""
+from flask import url_for
+from prometheus_client import REGISTRY
+
+from websmash import connection, get_db, metrics
+from websmash.background import dark_launches
+
+
+def _value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_metrics(client, app):
+    before = _value('websmash_requests_total', endpoint='get_version', method='GET', status='200')
+    client.get(url_for('get_version'))
+    assert _value('websmash_requests_total', endpoint='get_version', method='GET', status='200') == before + 1
+    assert _value('websmash_request_duration_seconds_count', endpoint='get_version', method='GET') >= 1
+
+    response = client.get(url_for('metrics'))
+    assert 200 == response.status_code
+    assert b'websmash_request_duration_seconds_bucket{endpoint="get_version"' in response.data
+
+
+def test_submission_metrics(client, app, fake_sequence):
+    before = _value('websmash_jobs_submitted_total', queue=app.config['DOWNLOAD_QUEUE'])
+    client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    assert _value('websmash_jobs_submitted_total', queue=app.config['DOWNLOAD_QUEUE']) == before + 1
+
+    files = _value('websmash_uploaded_files_total')
+    uploaded = _value('websmash_uploaded_bytes_total')
+    with open(str(fake_sequence), 'rb') as handle:
+        client.post(url_for('api_submit'), data=dict(seq=handle))
+    assert _value('websmash_uploaded_files_total') == files + 1
+    assert _value('websmash_uploaded_bytes_total') == uploaded + fake_sequence.size()
+
+    assert metrics._queue_label(app.config, '{}:someone@example.com'.format(app.config['WAITLIST_PREFIX'])) == \
+        'waitlist'
+
+
+def test_sample_queues(app):
+    redis_store = get_db()
+    redis_store.delete(app.config['FAST_QUEUE'])
+    redis_store.rpush(app.config['FAST_QUEUE'], 'a', 'b')
+    for key in redis_store.scan_iter(match='{}:*'.format(app.config['WAITLIST_PREFIX'])):
+        redis_store.delete(key)
+    redis_store.rpush('{}:someone@example.com'.format(app.config['WAITLIST_PREFIX']), 'c', 'd', 'e')
+    redis_store.delete(app.config['WAITLIST_INDEX'])
+    redis_store.sadd(app.config['WAITLIST_INDEX'], '{}:someone@example.com'.format(app.config['WAITLIST_PREFIX']))
+
+    metrics.sample_queues(redis_store, app.config)
+    assert _value('websmash_queue_length', queue=app.config['FAST_QUEUE']) == 2
+    assert _value('websmash_waitlisted_jobs') == 3
+
+
+def test_sample_pools(client, monkeypatch):
+    monkeypatch.setattr(connection, '_pools', {})
+    pool = connection.get_connection_pool({
+        'REDIS_URL': 'redis://:secret@localhost:6379/0',
+        'REDIS_MAX_CONNECTIONS': 7,
+        'REDIS_SOCKET_TIMEOUT': None,
+        'REDIS_SOCKET_CONNECT_TIMEOUT': 5,
+    })
+    assert pool.max_connections == 7
+
+    response = client.get(url_for('metrics'))
+    assert b'websmash_redis_pool_max_connections{url="redis://:***@localhost:6379/0"} 7.0' in response.data
+    assert _value('websmash_redis_pool_connections', url='redis://:***@localhost:6379/0', state='in_use') == 0
+
+
+def test_sample_background_tasks(client):
+    before = _value('websmash_background_tasks', executor='dark-launch', outcome='completed')
+    assert dark_launches.submit(0, 0, lambda: None)
+    client.get(url_for('metrics'))
+    assert _value('websmash_background_tasks', executor='dark-launch', outcome='completed') == before + 1
+    assert _value('websmash_background_tasks', executor='dark-launch', outcome='pending') == 0
@@ -0,0 +1,103 @@
+"""Tests for the indexed notice store"""
+import asyncio
+from datetime import timedelta
+
+from antismash_models import SyncNotice as Notice, utils as am_utils
+import pytest
+
+from websmash import get_async_db, get_db, notices
+
+
+@pytest.fixture
+def fake_db(app):
+    redis_store = get_db()
+    for key in redis_store.scan_iter(match='notice*'):
+        redis_store.delete(key)
+    return redis_store
+
+
+def test_active_notices(app, fake_db):
+    now = am_utils.now()
+    current = Notice(fake_db, 'current', teaser='Current')
+    future = Notice(fake_db, 'future', teaser='Future', show_from=now + timedelta(days=1))
+    for notice in (current, future):
+        notices.add_notice(fake_db, notice, app.config)
+
+    active, valid_until = notices.fetch_active_notices(fake_db, app.config)
+    assert active == [current.to_dict()]
+    assert valid_until == pytest.approx(future.show_from.timestamp())
+
+
+def test_expired_notices_are_pruned(app, fake_db):
+    now = am_utils.now()
+    notices.add_notice(fake_db, Notice(fake_db, 'current'), app.config)
+    fake_db.zadd('notices:show_from', {'expired': (now - timedelta(days=2)).timestamp()})
+    fake_db.zadd('notices:show_until', {'expired': (now - timedelta(days=1)).timestamp()})
+
+    active, _ = notices.fetch_active_notices(fake_db, app.config)
+    assert [notice['teaser'] for notice in active] == ['placeholder']
+    assert fake_db.zrange('notices:show_from', 0, -1) == ['current']
+    assert fake_db.zrange('notices:show_until', 0, -1) == ['current']
+
+    notices.remove_notice(fake_db, 'current', app.config)
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == []
+    assert not fake_db.exists('notice:current')
+
+
+def test_cached_notices_invalidated(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'NEWS_CACHE_TTL', 60)
+    notices._cache.invalidate()
+    assert notices.get_active_notices(fake_db, app.config) == []
+
+    notice = Notice(fake_db, 'cached')
+    notice.commit()
+    assert notices.get_active_notices(fake_db, app.config) == []
+
+    notices.add_notice(fake_db, notice, app.config)
+    assert notices.get_active_notices(fake_db, app.config) == [notice.to_dict()]
+    notices._cache.invalidate()
+
+
+def test_unindexed_notices(app, fake_db):
+    # notices missing from the indexes aren't looked for when reading them
+    committed = Notice(fake_db, 'committed', teaser='Committed')
+    committed.commit()
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == []
+    active, _ = asyncio.run(notices.fetch_active_notices_async(get_async_db(), app.config))
+    assert active == []
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['index-notices'])
+    assert result.exit_code == 0
+    assert "Indexed 1 notices" in result.output
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == [committed.to_dict()]
+
+    # notices already indexed are left alone
+    later = Notice(fake_db, 'later', teaser='Later')
+    later.commit()
+    assert notices.index_unindexed_notices(fake_db, app.config) == 1
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == [committed.to_dict(), later.to_dict()]
+
+
+def test_rebuild_notice_index(app, fake_db):
+    notice = Notice(fake_db, 'legacy', teaser='Legacy')
+    notice.commit()
+    fake_db.zadd('notices:show_until', {'other': float('inf')})
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == []
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['rebuild-notice-index'])
+    assert result.exit_code == 0
+    assert "Indexed 1 notices" in result.output
+    assert notices.fetch_active_notices(fake_db, app.config)[0] == [notice.to_dict()]
+
+
+def test_add_notice_command(app, fake_db):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['add-notice', '--category', 'warning', 'Maintenance', 'Down on Monday'])
+    assert result.exit_code == 0, result.output
+
+    active, _ = notices.fetch_active_notices(fake_db, app.config)
+    assert len(active) == 1
+    assert active[0]['category'] == 'warning'
+    assert active[0]['text'] == 'Down on Monday'
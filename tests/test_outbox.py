@@ -0,0 +1,105 @@
+"""Tests for the email outbox"""
+import json
+import smtplib
+
+from flask_mail import Connection
+import pytest
+
+from websmash import get_db, outbox
+
+
+@pytest.fixture
+def fake_db(app):
+    redis_store = get_db()
+    for key in redis_store.scan_iter(match='mail:*'):
+        redis_store.delete(key)
+    return redis_store
+
+
+def _enqueue(redis_store, config, count):
+    messages = [outbox.build_message("Message {}".format(i), ["test@example.com"], "Body") for i in range(count)]
+    outbox.enqueue_messages(redis_store, config, *messages)
+
+
+def test_send_batch(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAIL_BATCH_SIZE', 2)
+    _enqueue(fake_db, app.config, 3)
+
+    with app.mail.record_messages() as sent:
+        assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config)) == 2
+        assert [message.subject for message in sent] == ["Message 0", "Message 1"]
+        assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config, timeout=1)) == 1
+        assert outbox.pop_batch(fake_db, app.config) == []
+    assert len(sent) == 3
+    assert fake_db.llen(app.config['MAIL_PROCESSING']) == 0
+
+
+def test_send_batch_retries(app, fake_db, monkeypatch):
+    def failing_send(self, message, envelope_from=None):
+        if message.subject == "Message 1":
+            raise smtplib.SMTPRecipientsRefused({})
+        return original_send(self, message, envelope_from)
+
+    original_send = Connection.send
+    monkeypatch.setattr(Connection, 'send', failing_send)
+    monkeypatch.setitem(app.config, 'MAIL_RETRY_BACKOFF', 10)
+    monkeypatch.setitem(app.config, 'MAIL_MAX_ATTEMPTS', 2)
+    _enqueue(fake_db, app.config, 3)
+
+    with app.mail.record_messages() as sent:
+        assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config), now=100) == 2
+    assert len(sent) == 2
+
+    retries = fake_db.zrange(app.config['MAIL_RETRY'], 0, -1, withscores=True)
+    assert len(retries) == 1
+    assert json.loads(retries[0][0])['attempts'] == 1
+    assert retries[0][1] == 110
+
+    # not due yet
+    assert outbox.promote_retries(fake_db, app.config, now=105) == 0
+    assert outbox.promote_retries(fake_db, app.config, now=110) == 1
+
+    assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config), now=110) == 0
+    assert fake_db.zcard(app.config['MAIL_RETRY']) == 0
+    dead = fake_db.lrange(app.config['MAIL_DEAD_LETTER'], 0, -1)
+    assert [json.loads(message)['subject'] for message in dead] == ["Message 1"]
+
+
+def test_send_batch_disconnected(app, fake_db, monkeypatch):
+    def disconnected(self, message, envelope_from=None):
+        raise smtplib.SMTPServerDisconnected()
+
+    monkeypatch.setattr(Connection, 'send', disconnected)
+    _enqueue(fake_db, app.config, 3)
+
+    assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config)) == 0
+    assert fake_db.zcard(app.config['MAIL_RETRY']) == 3
+    assert fake_db.llen(app.config['MAIL_DEAD_LETTER']) == 0
+
+
+def test_send_batch_dead_letter(app, fake_db):
+    messages = [outbox.build_message("Message {}".format(i), ["test@example.com"], "Body") for i in range(3)]
+    messages[1]['subject'] = "Bad\nBcc: someone@example.com"
+    outbox.enqueue_messages(fake_db, app.config, *messages)
+    fake_db.lpush(app.config['MAIL_OUTBOX'], 'not json')
+
+    with app.mail.record_messages() as sent:
+        assert outbox.send_batch(fake_db, app.config, app.mail, outbox.pop_batch(fake_db, app.config)) == 2
+    assert [message.subject for message in sent] == ["Message 0", "Message 2"]
+
+    assert fake_db.zcard(app.config['MAIL_RETRY']) == 0
+    dead = fake_db.lrange(app.config['MAIL_DEAD_LETTER'], 0, -1)
+    assert sorted(dead, key=len) == ['not json', json.dumps(messages[1])]
+    assert fake_db.llen(app.config['MAIL_PROCESSING']) == 0
+
+
+def test_requeue_unacknowledged(app, fake_db):
+    _enqueue(fake_db, app.config, 3)
+    batch = outbox.pop_batch(fake_db, app.config)
+    assert fake_db.lrange(app.config['MAIL_PROCESSING'], 0, -1) == batch[::-1]
+    _enqueue(fake_db, app.config, 1)
+
+    # the sender stopped before sending the batch, it goes out before the newer message
+    assert outbox.requeue_unacknowledged(fake_db, app.config) == 3
+    subjects = [json.loads(raw)['subject'] for raw in outbox.pop_batch(fake_db, app.config)]
+    assert subjects == ["Message 0", "Message 1", "Message 2", "Message 0"]
@@ -0,0 +1,100 @@
+"""Tests for the queue positions"""
+from datetime import datetime, UTC
+
+from antismash_models import SyncJob as Job
+import pytest
+
+from websmash import fair_share, get_db, positions, utils
+
+
+@pytest.fixture
+def fake_db(app, monkeypatch):
+    redis_store = get_db()
+    index = app.config['QUEUE_POSITION_INDEX']
+    redis_store.delete(index, '{}:sequence'.format(index), '{}:rate'.format(index), app.config['DEFAULT_QUEUE'])
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 100)
+    return redis_store
+
+
+def _submit(redis_store, config, count):
+    jobs = []
+    for i in range(count):
+        job = Job(redis_store, 'taxon-position{}'.format(i))
+        job.email = 'position@example.com'
+        job.ip_addr = '10.0.0.3'
+        jobs.append(job)
+    utils._submit_jobs(redis_store, jobs, config, [{}] * count, batch_size=count)
+    return [job.job_id for job in jobs]
+
+
+def _lookup(redis_store, config, job_id, now):
+    keys, args = positions.position_call(config, job_id, now)
+    result = redis_store.register_script(positions.POSITION_SCRIPT)(keys=keys, args=args)
+    return positions.parse_position(result, now)
+
+
+def _dequeue(redis_store, config):
+    job_id = redis_store.rpop(config['DEFAULT_QUEUE'])
+    redis_store.hset('job:{}'.format(job_id), 'state', 'running')
+    return job_id
+
+
+def test_position(app, fake_db):
+    job_ids = _submit(fake_db, app.config, 5)
+    assert positions.get_position(fake_db, app.config, job_ids[0]) == {'queue_position': 1}
+    assert positions.get_position(fake_db, app.config, job_ids[4])['queue_position'] == 5
+    assert positions.get_position(fake_db, app.config, 'nonexistent') is None
+
+    assert _dequeue(fake_db, app.config) == job_ids[0]
+    assert _dequeue(fake_db, app.config) == job_ids[1]
+    assert positions.get_position(fake_db, app.config, job_ids[1]) is None
+    assert positions.get_position(fake_db, app.config, job_ids[4])['queue_position'] == 3
+    # jobs that left the queue were pruned
+    assert fake_db.zcard(app.config['QUEUE_POSITION_INDEX']) == 3
+
+
+def test_estimated_start(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'QUEUE_RATE_SAMPLE_INTERVAL', 10)
+    monkeypatch.setitem(app.config, 'QUEUE_RATE_WINDOW', 600)
+    job_ids = _submit(fake_db, app.config, 10)
+
+    now = 1000000.0
+    assert 'estimated_start_ts' not in _lookup(fake_db, app.config, job_ids[9], now)
+
+    # two jobs per minute
+    for _ in range(4):
+        _dequeue(fake_db, app.config)
+    position = _lookup(fake_db, app.config, job_ids[9], now + 120)
+    assert position['queue_position'] == 6
+    # five jobs ahead take 150 seconds
+    expected = datetime.fromtimestamp(now + 120 + 150, UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert position['estimated_start_ts'] == expected
+
+    # samples older than the window are dropped
+    position = _lookup(fake_db, app.config, job_ids[9], now + 1200)
+    assert 'estimated_start_ts' not in position
+
+
+def test_fed_jobs_are_indexed(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'FAIR_SHARE', True)
+    monkeypatch.setitem(app.config, 'FAIR_SHARE_BUFFER', 2)
+    job_ids = _submit(fake_db, app.config, 3)
+    assert positions.get_position(fake_db, app.config, job_ids[0]) is None
+
+    assert fair_share.feed_default_queue(fake_db, app.config) == 2
+    assert positions.get_position(fake_db, app.config, job_ids[1])['queue_position'] == 2
+    # don't leave jobs in the sub-queues for other tests
+    fair_share.take_jobs(fake_db, app.config, 10)
+
+
+def test_rebuild_position_index(app, fake_db):
+    job_ids = _submit(fake_db, app.config, 3)
+    fake_db.delete(app.config['QUEUE_POSITION_INDEX'])
+    # e.g. a job pushed by the downloader
+    fake_db.hset('job:taxon-downloaded', 'state', 'queued')
+    fake_db.lpush(app.config['DEFAULT_QUEUE'], 'taxon-downloaded')
+
+    assert positions.rebuild_position_index(fake_db, app.config) == 4
+    assert positions.get_position(fake_db, app.config, job_ids[0])['queue_position'] == 1
+    assert positions.get_position(fake_db, app.config, 'taxon-downloaded')['queue_position'] == 4
+    assert positions.get_position(fake_db, app.config, _submit(fake_db, app.config, 4)[3])['queue_position'] == 5
@@ -0,0 +1,115 @@
+"""Tests for the rate limits"""
+import asyncio
+
+from flask import url_for
+import pytest
+from werkzeug.exceptions import TooManyRequests
+
+from websmash import get_async_db, get_db, ratelimit, uploads
+from websmash.uploads import staging_dir
+
+
+@pytest.fixture
+def fake_db(app, monkeypatch):
+    monkeypatch.setattr(ratelimit, '_empty_buckets', {})
+    redis_store = get_db()
+    for key in redis_store.scan_iter(match='{}:*'.format(app.config['RATE_LIMIT_PREFIX'])):
+        redis_store.delete(key)
+    return redis_store
+
+
+def test_limit(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'status': {'ip': (2, 10), 'email': (5, 10)}})
+    now = 1000.0
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: now)
+
+    ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1', email='a@example.com')
+    ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1', email='a@example.com')
+    with pytest.raises(TooManyRequests) as err:
+        ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1', email='a@example.com')
+    assert err.value.retry_after == 5
+
+    # a rejected request takes no tokens from the other buckets
+    assert float(fake_db.hget('ratelimit:status:email:a@example.com', 'tokens')) == 3
+    # other clients and endpoints have their own buckets
+    ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.2')
+    ratelimit.limit(fake_db, app.config, 'batch_status', ip='10.0.0.1')
+
+    now += 5
+    ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1')
+    with pytest.raises(TooManyRequests):
+        ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1')
+
+    # retrying clients are rejected without a round trip while the bucket is empty
+    assert list(ratelimit._empty_buckets) == ['ratelimit:status:ip:10.0.0.1']
+    fake_db.delete('ratelimit:status:ip:10.0.0.1')
+    with pytest.raises(TooManyRequests):
+        ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1')
+
+
+def test_limit_async(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'status': {'ip': (1, 10)}})
+    monkeypatch.setattr(ratelimit.time, 'time', lambda: 1000.0)
+
+    asyncio.run(ratelimit.limit_async(get_async_db(), app.config, 'status', ip='10.0.0.1'))
+    # the buckets are shared with the sync path
+    with pytest.raises(TooManyRequests) as err:
+        ratelimit.limit(fake_db, app.config, 'status', ip='10.0.0.1')
+    assert err.value.retry_after == 10
+    with pytest.raises(TooManyRequests):
+        asyncio.run(ratelimit.limit_async(get_async_db(), app.config, 'status', ip='10.0.0.1'))
+    asyncio.run(ratelimit.limit_async(get_async_db(), app.config, 'status', ip='10.0.0.2'))
+
+
+def test_limit_requests(client, app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {
+        'status': {'ip': (1, 60)},
+        'api_submit': {'ip': (10, 60), 'email': (1, 60)},
+    })
+
+    assert client.get(url_for('status', task_id='nonexistent')).status_code == 404
+    response = client.get(url_for('status', task_id='nonexistent'))
+    assert response.status_code == 429
+    assert response.json == {'error': 'Too many requests'}
+    assert response.headers['Retry-After'] == '60'
+    # the limit is per client
+    response = client.get(url_for('status', task_id='nonexistent'), headers={'X-Forwarded-For': '10.0.0.1'})
+    assert response.status_code == 404
+
+    data = dict(ncbi='FAKE', email='limited@example.com')
+    assert client.post(url_for('api_submit'), data=data).status_code == 200
+    assert client.post(url_for('api_submit'), data=data).status_code == 429
+    assert client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).status_code == 200
+
+
+def test_limit_before_upload(client, app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'api_submit': {'ip': (10, 60), 'email': (1, 60)}})
+    monkeypatch.setitem(app.config, 'REDIS_TRACING', True)
+    monkeypatch.setitem(app.config, 'REDIS_TRACING_HEADER', True)
+    staged = []
+    monkeypatch.setattr(uploads, 'staging_dir', lambda config: staged.append(config) or staging_dir(config))
+
+    def submit(fields, file_first=False):
+        parts = [('seq', 'test.fa', '>test\nATGACCGAGAGTACATAG\n')] + [(name, None, value) for name, value in fields]
+        if not file_first:
+            parts.reverse()
+        body = ''.join('--boundary\r\nContent-Disposition: form-data; name="{}"{}\r\n\r\n{}\r\n'.format(
+            name, '; filename="{}"'.format(filename) if filename else '', value) for name, filename, value in parts)
+        return client.post(url_for('api_submit'), data=body + '--boundary--\r\n',
+                           content_type='multipart/form-data; boundary=boundary')
+
+    # the limits are checked with the email address sent before the file in a single call
+    response = submit([('email', 'upload@example.com')])
+    assert response.status_code == 200
+    assert response.headers['X-Redis-Trace'].startswith('commands=2; round_trips=2;')
+    assert len(staged) == 1
+    response = submit([('email', 'upload@example.com')])
+    assert response.status_code == 429
+    assert len(staged) == 1
+
+    # or after the file has been written, if the email address comes later
+    response = submit([('email', 'late@example.com')], file_first=True)
+    assert response.status_code == 200
+    response = submit([('email', 'late@example.com')], file_first=True)
+    assert response.status_code == 429
+    assert len(staged) == 3
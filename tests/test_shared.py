@@ -12,6 +12,10 @@ class ModelTestCase(TestCase):
         self.app.config['TESTING'] = True
         websmash.mail.suppress = True
         self.app.config['FAKE_DB'] = True
+        self.app.config['STATS_CACHE_TTL'] = 0
+        self.app.config['NEWS_CACHE_TTL'] = 0
+        self.app.config['METRICS_SAMPLE_INTERVAL'] = 0
+        self.app.config['RATE_LIMITS'] = {}
         return self.app
 
     def setUp(self):
@@ -0,0 +1,62 @@
+"""Tests for the queue statistics snapshot"""
+from antismash_models import SyncJob as Job
+
+from websmash import get_db, job_history, stats
+
+
+def test_fetch_stats_missing_job(app):
+    """Test a queued ID without a job hash doesn't break the stats"""
+    fake_db = get_db()
+    queue = app.config['FAST_QUEUE']
+    fake_db.delete(queue)
+    fake_db.lpush(queue, 'taxon-missing')
+
+    result = stats.fetch_stats(fake_db, app.config)
+    assert result['fast'] == 1
+    assert result['status'] == 'working'
+    assert result['ts_fast'] is None
+    fake_db.delete(queue)
+
+
+def test_get_stats_cached(app, monkeypatch):
+    """Test the stats snapshot is only refreshed after STATS_CACHE_TTL"""
+    fake_db = get_db()
+    queue = app.config['FAST_QUEUE']
+    fake_db.delete(queue)
+    monkeypatch.setattr(stats, '_cache', stats.SnapshotCache())
+    monkeypatch.setitem(app.config, 'STATS_CACHE_TTL', 60)
+
+    assert stats.get_stats(fake_db, app.config)['fast'] == 0
+
+    job = Job(fake_db, 'taxon-cached')
+    job.commit()
+    fake_db.lpush(queue, job.job_id)
+    assert stats.get_stats(fake_db, app.config)['fast'] == 0
+
+    stats._cache.invalidate()
+    result = stats.get_stats(fake_db, app.config)
+    assert result['fast'] == 1
+    assert result['ts_fast_m'] == job.last_changed.strftime("%Y-%m-%dT%H:%M:%SZ")
+    fake_db.delete(queue)
+
+
+def test_trim_job_history(app, monkeypatch):
+    """Test trimmed finished jobs are still counted in total_jobs"""
+    fake_db = get_db()
+    fake_db.delete(app.config['JOB_HISTORY_COUNTS'], *job_history.HISTORY_LISTS)
+    monkeypatch.setitem(app.config, 'JOB_HISTORY_LENGTH', 2)
+    fake_db.lpush('jobs:completed', *['taxon-done{}'.format(i) for i in range(7)])
+    fake_db.lpush('jobs:failed', 'taxon-failed')
+    total_jobs = stats.fetch_stats(fake_db, app.config)['total_jobs']
+
+    trimmed = job_history.trim_job_history(fake_db, app.config, batch_size=2)
+    assert trimmed == {'jobs:completed': 5, 'jobs:failed': 0, 'jobs:removed': 0}
+    # the newest jobs are kept
+    assert fake_db.lrange('jobs:completed', 0, -1) == ['taxon-done6', 'taxon-done5']
+    assert stats.fetch_stats(fake_db, app.config)['total_jobs'] == total_jobs
+
+    fake_db.lpush('jobs:completed', 'taxon-done7')
+    job_history.trim_job_history(fake_db, app.config)
+    assert fake_db.hget(app.config['JOB_HISTORY_COUNTS'], 'jobs:completed') == '6'
+    assert stats.fetch_stats(fake_db, app.config)['total_jobs'] == total_jobs + 1
+    fake_db.delete(app.config['JOB_HISTORY_COUNTS'], *job_history.HISTORY_LISTS)
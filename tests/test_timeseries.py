@@ -0,0 +1,72 @@
+"""Tests for the queue statistics time series"""
+from flask import url_for
+import pytest
+
+from websmash import get_db, timeseries
+
+
+@pytest.fixture
+def fake_db(app, monkeypatch):
+    redis_store = get_db()
+    for key in redis_store.scan_iter(match='{}:*'.format(app.config['TIMESERIES_PREFIX'])):
+        redis_store.delete(key)
+    monkeypatch.setitem(app.config, 'TIMESERIES_INTERVAL', 60)
+    monkeypatch.setitem(app.config, 'TIMESERIES_LEVELS', [(60, 10), (600, 6)])
+    return redis_store
+
+
+def test_history(app, fake_db):
+    now = 6000.0
+    for i, queued in enumerate([4, 2, 6]):
+        assert timeseries.record(fake_db, app.config, {'queued': queued}, {'submitted': 10 * i}, now + 60 * i)
+    # samples just after the last one are dropped, e.g. from a second sampler
+    assert not timeseries.record(fake_db, app.config, {'queued': 100}, {'submitted': 30}, now + 140)
+
+    history = timeseries.get_history(fake_db, app.config, 300, now + 150)
+    assert history['resolution'] == 60
+    assert history['summary']['queued'] == {'min': 2, 'avg': 4, 'max': 6}
+    # submissions per minute, known from the second sample on
+    assert history['summary']['submitted'] == {'min': 10, 'avg': 10, 'max': 10}
+    assert [point['time'] for point in history['series']] == [
+        '1970-01-01T01:40:00Z', '1970-01-01T01:41:00Z', '1970-01-01T01:42:00Z']
+
+    # longer windows use the coarser level
+    history = timeseries.get_history(fake_db, app.config, 3600, now + 150)
+    assert history['resolution'] == 600
+    assert history['series'] == [{'time': '1970-01-01T01:40:00Z', 'queued': {'min': 2, 'avg': 4, 'max': 6},
+                                  'submitted': {'min': 10, 'avg': 10, 'max': 10}}]
+
+    with pytest.raises(ValueError, match="Window too long"):
+        timeseries.get_history(fake_db, app.config, 3601, now)
+
+
+def test_history_ring_buffer(app, fake_db):
+    now = 6000.0
+    timeseries.record(fake_db, app.config, {'queued': 1}, {}, now)
+    # ten minutes later the sample reuses the slot of the first one
+    timeseries.record(fake_db, app.config, {'queued': 5}, {}, now + 600)
+    assert fake_db.hlen(timeseries.level_key(app.config, 60)) == 1
+
+    history = timeseries.get_history(fake_db, app.config, 600, now + 600)
+    assert history['summary'] == {'queued': {'min': 5, 'avg': 5, 'max': 5}}
+
+
+def test_sample(app, fake_db, client):
+    values, counters = timeseries.sample(fake_db, app.config)
+    assert set(values) == {'queued', 'fast', 'priority', 'development', 'downloads', 'running', 'wait'}
+
+    assert client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).status_code == 200
+    assert timeseries.sample(fake_db, app.config)[1]['submitted'] == counters['submitted'] + 1
+
+
+def test_history_endpoint(app, fake_db, client):
+    timeseries.record(fake_db, app.config, {'queued': 3}, {})
+    response = client.get(url_for('get_stats_history', window='5m'))
+    assert response.status_code == 200
+    assert response.json['window'] == 300
+    assert response.json['summary'] == {'queued': {'min': 3, 'avg': 3, 'max': 3}}
+
+    response = client.get(url_for('get_stats_history', window='soon'))
+    assert response.status_code == 400
+    assert 'Invalid window' in response.json['message']
+    assert client.get(url_for('get_stats_history', window='1d')).status_code == 400
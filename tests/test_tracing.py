@@ -0,0 +1,66 @@
+"""Tests for Redis tracing and request profiling"""
+from fakeredis import FakeRedis
+from flask import url_for
+
+from websmash import get_db, ratelimit
+from websmash.connection import RedisTrace, TracingRedis
+
+
+def test_tracing_redis():
+    client = TracingRedis(connection_pool=FakeRedis(decode_responses=True).connection_pool)
+    client.set('key', 'value')
+    client.get('key')
+    pipe = client.pipeline()
+    pipe.get('key')
+    pipe.hget('hash', 'field')
+    pipe.execute()
+
+    summary = client.trace.summary()
+    assert summary['round_trips'] == 3
+    assert summary['commands'] == 4
+    assert summary['by_command'] == {'GET': 2, 'SET': 1, 'HGET': 1}
+
+    # pipelines with scripts check the scripts exist before they are executed
+    pipe = client.pipeline()
+    client.register_script("return 1")(client=pipe)
+    assert pipe.execute() == [1]
+    assert client.trace.summary()['round_trips'] == 6
+    assert client.trace.commands['SCRIPT EXISTS'] == 1
+    assert client.trace.commands['SCRIPT LOAD'] == 1
+
+
+def test_trace_header(client, app, monkeypatch):
+    monkeypatch.setitem(app.config, 'REDIS_TRACING', True)
+    monkeypatch.setitem(app.config, 'REDIS_TRACING_HEADER', True)
+    response = client.post(url_for('api_submit'), data=dict(ncbi='FAKE'))
+    job_id = response.json['id']
+
+    # the rate limiter asks for its client before the status view does
+    monkeypatch.setattr(ratelimit, '_empty_buckets', {})
+    monkeypatch.setitem(app.config, 'RATE_LIMITS', {'status': {'ip': (100, 60)}})
+    headers = {'X-Forwarded-For': '10.9.0.1'}
+    get_db().delete('{}:status:ip:10.9.0.1'.format(app.config['RATE_LIMIT_PREFIX']))
+    # the first request loads the scripts
+    client.get(url_for('status', task_id=job_id), headers=headers)
+
+    response = client.get(url_for('status', task_id=job_id), headers=headers)
+    assert 200 == response.status_code
+    trace = response.headers['X-Redis-Trace']
+    assert trace.startswith('commands=3; round_trips=3;')
+    assert trace.endswith('by_command=EVALSHA=2,HMGET=1')
+
+
+def test_profiling(client, app, monkeypatch, tmpdir):
+    monkeypatch.setitem(app.config, 'PROFILE_SAMPLE_RATE', 1.0)
+    monkeypatch.setitem(app.config, 'PROFILE_DIR', str(tmpdir))
+
+    client.get(url_for('get_version'))
+    profiles = tmpdir.listdir()
+    assert len(profiles) == 1
+    assert 'get_version' in profiles[0].basename
+
+
+def test_redis_trace_summary():
+    trace = RedisTrace()
+    trace.record(['get', 'get', 'hset'], 0.002)
+    assert trace.summary() == {'commands': 3, 'round_trips': 1, 'time_ms': 2.0, 'by_command': {'GET': 2, 'HSET': 1}}
@@ -0,0 +1,84 @@
+"""Tests for streaming upload ingestion"""
+import hashlib
+import io
+import json
+import os
+import stat
+
+from flask import url_for
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from websmash import get_db, uploads
+from websmash.uploads import StagedUpload, staging_dir, UploadRequest
+
+
+def test_staged_upload(tmpdir):
+    upload = StagedUpload(str(tmpdir), max_size=10)
+    upload.write(b'>test\n')
+    upload.write(b'ATG\n')
+    upload.seek(0)
+    assert upload.read() == b'>test\nATG\n'
+    assert upload.checksum == "sha256:{}".format(hashlib.sha256(b'>test\nATG\n').hexdigest())
+
+    with pytest.raises(RequestEntityTooLarge):
+        upload.write(b'A')
+
+    upload.close()
+    assert not os.path.exists(upload.path)
+
+
+def test_staged_upload_save_as(tmpdir):
+    upload = StagedUpload(str(tmpdir))
+    upload.write(b'data')
+    destination = str(tmpdir.join('saved.fa'))
+    upload.save_as(destination)
+    upload.close()
+
+    with open(destination, 'rb') as handle:
+        assert handle.read() == b'data'
+    assert os.listdir(str(tmpdir)) == ['saved.fa']
+    # not just readable by the owner like the staging file
+    assert stat.S_IMODE(os.stat(destination).st_mode) == 0o666 & ~uploads._UMASK
+
+
+def test_api_submit_checksums(client, app):
+    """Test uploads are streamed to the job directory and checksummed"""
+    content = b'>test\nATGACCGAGAGTACATAG\n'
+    data = dict(seq=(io.BytesIO(content), 'test.fa'), sideload=(io.BytesIO(b'{}'), 'extra.json'))
+    response = client.post(url_for('api_submit'), data=data)
+    assert 200 == response.status_code
+
+    job_id = response.json['id']
+    checksums = json.loads(get_db().hget('job:{}'.format(job_id), 'input_checksums'))
+    assert checksums == {
+        'test.fa': "sha256:{}".format(hashlib.sha256(content).hexdigest()),
+        'extra.json': "sha256:{}".format(hashlib.sha256(b'{}').hexdigest()),
+    }
+    with open(os.path.join(app.config['RESULTS_PATH'], job_id, 'input', 'test.fa'), 'rb') as handle:
+        assert handle.read() == content
+    assert os.listdir(staging_dir(app.config)) == []
+
+
+def test_api_submit_too_large(client, app, monkeypatch):
+    """Test uploads over the size limit are rejected while streaming"""
+    monkeypatch.setitem(app.config, 'MAX_UPLOAD_FILE_SIZE', 10)
+    data = dict(seq=(io.BytesIO(b'>test\nATGACCGAGAGTACATAG\n'), 'test.fa'))
+    response = client.post(url_for('api_submit'), data=data)
+    assert 413 == response.status_code
+    assert response.json == {'error': 'Request entity too large'}
+    assert os.listdir(staging_dir(app.config)) == []
+
+
+def test_before_upload(client, app, monkeypatch):
+    """Test functions registered with before_upload() see the form fields sent before the first file"""
+    seen = []
+    monkeypatch.setattr(UploadRequest, '_before_upload', [lambda fields: seen.append(fields.to_dict(flat=False))])
+    data = dict(ncbi='', email='test@example.com', seq=(io.BytesIO(b'>test\nATG\n'), 'test.fa'),
+                sideload=(io.BytesIO(b'{}'), 'extra.json'))
+    assert 200 == client.post(url_for('api_submit'), data=data).status_code
+    assert seen == [{'ncbi': [''], 'email': ['test@example.com']}]
+
+    # requests without files don't need them
+    assert 200 == client.post(url_for('api_submit'), data=dict(ncbi='FAKE')).status_code
+    assert len(seen) == 1
@@ -202,6 +202,30 @@ def test__submit_job_ip_waitlist(app):
     assert job.target_queues == [app.config['DEFAULT_QUEUE'], queue]
 
 
+def test__submit_jobs(app, monkeypatch):
+    """Test the per-user limit applies to a batch of submissions as a whole"""
+    fake_db = get_db()
+    email = "bulk@example.com"
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 1)
+    for key in fake_db.scan_iter(match='{}:*'.format(app.config['PENDING_INDEX_PREFIX'])):
+        fake_db.delete(key)
+
+    jobs = []
+    for i in range(5):
+        job = Job(fake_db, 'taxon-bulk{}'.format(i))
+        job.email = email
+        jobs.append(job)
+
+    utils._submit_jobs(fake_db, jobs, app.config, [{}] * len(jobs), batch_size=2)
+
+    assert [job.state for job in jobs] == ['queued', 'queued', 'waiting', 'waiting', 'waiting']
+    for job in jobs:
+        stored = Job(fake_db, job.job_id)
+        stored.fetch()
+        assert stored.state == job.state
+    assert 3 == fake_db.llen("{}:{}".format(app.config['WAITLIST_PREFIX'], email))
+
+
 def test_secure_filename():
     """Test generated filename is secure (enough)"""
     expected = "etc_passwd"
@@ -323,7 +347,7 @@ def test__copy_files(app, mocker):
     new_job = Job.fromExisting('bacteria-new', old_job)
 
     fake_makedirs = mocker.patch('os.makedirs')
-    fake_copyfile = mocker.patch('shutil.copyfile')
+    fake_link_or_copy = mocker.patch('websmash.utils.link_or_copy')
 
     utils._copy_files('fake_base', old_job, new_job)
 
@@ -337,4 +361,138 @@ def test__copy_files(app, mocker):
     new_gff3 = os.path.join('fake_base', new_job.job_id, 'input', new_job.gff3)
     new_sideload = os.path.join("fake_base", new_job.job_id, "input", new_job.sideloads[0])
 
-    fake_copyfile.assert_has_calls([call(old_filename, new_filename), call(old_gff3, new_gff3), call(old_sideload, new_sideload)])
+    fake_link_or_copy.assert_has_calls([call(old_filename, new_filename), call(old_gff3, new_gff3),
+                                        call(old_sideload, new_sideload)])
+
+
+def test__copy_files_shares_data(app, tmpdir):
+    fake_db = get_db()
+    old_job = Job(fake_db, 'bacteria-old')
+    old_job.filename = 'fake.fa'
+    new_job = Job.fromExisting('bacteria-new', old_job)
+    old_dir = tmpdir.mkdir(old_job.job_id).mkdir('input')
+    old_dir.join('fake.fa').write('>test\nATG\n')
+
+    utils._copy_files(str(tmpdir), old_job, new_job)
+
+    old_stat = os.stat(str(old_dir.join('fake.fa')))
+    new_stat = os.stat(os.path.join(str(tmpdir), new_job.job_id, 'input', 'fake.fa'))
+    assert old_stat.st_ino == new_stat.st_ino
+    assert new_stat.st_nlink == 2
+
+
+def test__count_pending_jobs_prunes_stale(app):
+    """Test the pending job index only counts jobs that are still queued"""
+    fake_db = get_db()
+    email = "dave@example.com"
+    index_key = utils._pending_index_key(app.config, 'email', email)
+    fake_db.delete(index_key)
+    app.config['MAX_JOBS_PER_USER'] = 5
+
+    jobs = []
+    for i in range(3):
+        job = Job(fake_db, 'taxon-pending{}'.format(i))
+        job.email = email
+        utils._submit_job(fake_db, job, app.config)
+        jobs.append(job)
+
+    assert utils._count_pending_jobs_with_email(fake_db, jobs[0]) == 3
+
+    jobs[0].state = 'running'
+    jobs[0].commit()
+    assert utils._count_pending_jobs_with_email(fake_db, jobs[0]) == 2
+    assert fake_db.scard(index_key) == 2
+
+
+def test_rebuild_pending_indexes(app):
+    """Test the pending job indexes can be rebuilt from the default queue"""
+    fake_db = get_db()
+    queue = app.config['DEFAULT_QUEUE']
+    fake_db.delete(queue)
+    email = "erin@example.com"
+    ip = "192.168.0.42"
+
+    for i in range(2):
+        job = Job(fake_db, 'taxon-rebuild{}'.format(i))
+        job.email = email
+        job.ip_addr = ip
+        job.state = 'queued'
+        job.commit()
+        fake_db.lpush(queue, job.job_id)
+
+    stale_key = utils._pending_index_key(app.config, 'email', 'stale@example.com')
+    fake_db.sadd(stale_key, 'taxon-gone')
+
+    assert utils.rebuild_pending_indexes(fake_db, app.config, batch_size=1) == 2
+    assert not fake_db.exists(stale_key)
+    assert fake_db.scard(utils._pending_index_key(app.config, 'email', email)) == 2
+    assert fake_db.scard(utils._pending_index_key(app.config, 'ip', ip)) == 2
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['rebuild-pending-index'])
+    assert result.exit_code == 0
+    assert "Indexed 2 pending jobs" in result.output
+
+
+def test__submit_job_limit(app):
+    """Test the per-user limit is applied by the submission script"""
+    fake_db = get_db()
+    email = "frank@example.com"
+    waitlist = "{}:{}".format(app.config['WAITLIST_PREFIX'], email)
+    fake_db.delete(waitlist, utils._pending_index_key(app.config, 'email', email))
+    app.config['MAX_JOBS_PER_USER'] = 1
+
+    states = []
+    for i in range(3):
+        job = Job(fake_db, 'taxon-limit{}'.format(i))
+        job.email = email
+        utils._submit_job(fake_db, job, app.config)
+        states.append(job.state)
+        assert Job(fake_db, job.job_id).fetch().state == job.state
+
+    assert states == ['queued', 'queued', 'waiting']
+    assert fake_db.lrange(waitlist, 0, -1) == ['taxon-limit2']
+    assert fake_db.scard(utils._pending_index_key(app.config, 'email', email)) == 2
+
+
+def test__count_pending_jobs_counts_downloads(app, monkeypatch):
+    """Test jobs still being downloaded count against the per-user limit"""
+    fake_db = get_db()
+    email = "grace@example.com"
+    index_key = utils._pending_index_key(app.config, 'email', email)
+    fake_db.delete(index_key)
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 5)
+
+    job = Job(fake_db, 'taxon-download0')
+    job.email = email
+    job.needs_download = True
+    utils._submit_job(fake_db, job, app.config)
+    fake_db.hset('job:{}'.format(job.job_id), 'state', 'downloading')
+
+    assert utils._count_pending_jobs_with_email(fake_db, job) == 1
+    fake_db.lrem(app.config['DOWNLOAD_QUEUE'], 0, job.job_id)
+
+
+def test_rebuild_pending_indexes_downloads_and_concurrent(app):
+    """Test the rebuild indexes downloading jobs and keeps jobs submitted meanwhile"""
+    fake_db = get_db()
+    email = "heidi@example.com"
+    index_key = utils._pending_index_key(app.config, 'email', email)
+    fake_db.delete(index_key, app.config['DEFAULT_QUEUE'], app.config['DOWNLOAD_QUEUE'])
+
+    job = Job(fake_db, 'taxon-rebuild-download')
+    job.email = email
+    job.state = 'downloading'
+    job.target_queues = [app.config['DEFAULT_QUEUE']]
+    job.commit()
+    fake_db.lpush(app.config['DOWNLOAD_QUEUE'], job.job_id)
+
+    # submitted after the queues were read, and a job that already started
+    for job_id, state in (('taxon-rebuild-fresh', 'queued'), ('taxon-rebuild-running', 'running')):
+        fake_db.hset('job:{}'.format(job_id), 'state', state)
+        fake_db.sadd(index_key, job_id)
+
+    assert utils.rebuild_pending_indexes(fake_db, app.config) == 1
+    assert fake_db.smembers(index_key) == {'taxon-rebuild-download', 'taxon-rebuild-fresh'}
+    assert not fake_db.exists('{}:rebuild'.format(index_key))
+    fake_db.delete(app.config['DOWNLOAD_QUEUE'])
@@ -0,0 +1,155 @@
+"""Tests for the waitlist promotion"""
+from datetime import datetime, timedelta, UTC
+
+from antismash_models import SyncJob as Job
+import pytest
+
+from websmash import events, get_db, utils, waitlist
+
+
+@pytest.fixture
+def fake_db(app, monkeypatch):
+    redis_store = get_db()
+    for pattern in ('{}:*'.format(app.config['WAITLIST_PREFIX']), '{}:*'.format(app.config['PENDING_INDEX_PREFIX'])):
+        for key in redis_store.scan_iter(match=pattern):
+            redis_store.delete(key)
+    redis_store.delete(app.config['WAITLIST_INDEX'], app.config['WAITLIST_DOWNLOADS'], app.config['DEFAULT_QUEUE'],
+                       app.config['DOWNLOAD_QUEUE'])
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 1)
+    return redis_store
+
+
+def _submit(redis_store, config, count, email="waiting@example.com", ip_addr="10.0.0.1", prefix='taxon-wait'):
+    jobs = []
+    for i in range(count):
+        job = Job(redis_store, '{}{}'.format(prefix, i))
+        job.email = email
+        job.ip_addr = ip_addr
+        jobs.append(job)
+    utils._submit_jobs(redis_store, jobs, config, [{}] * count, batch_size=count)
+    return jobs
+
+
+def _finish(redis_store, job_id):
+    redis_store.hset('job:{}'.format(job_id), 'state', 'done')
+
+
+def test_promote_waitlisted(app, fake_db):
+    jobs = _submit(fake_db, app.config, 5)
+    waitlist_name = utils._waitlist_name(app.config, "waiting@example.com")
+    assert fake_db.smembers(app.config['WAITLIST_INDEX']) == {waitlist_name}
+    assert fake_db.llen(waitlist_name) == 3
+
+    # nothing finished yet
+    assert waitlist.promote_waitlisted(fake_db, app.config) == []
+
+    _finish(fake_db, jobs[0].job_id)
+    later = datetime.now(UTC) + timedelta(seconds=60)
+    pubsub = fake_db.pubsub()
+    pubsub.subscribe(events.job_update_channel(app.config, jobs[2].job_id))
+    assert pubsub.get_message(timeout=1)['type'] == 'subscribe'
+    promoted = waitlist.promote_waitlisted(fake_db, app.config, now=later)
+    assert [job_id for job_id, _ in promoted] == [jobs[2].job_id]
+    assert 59 < promoted[0][1] < 70
+    # clients following the job are told it was promoted
+    assert pubsub.get_message(timeout=1)['data'] == jobs[2].job_id
+    pubsub.close()
+
+    job = Job(fake_db, jobs[2].job_id)
+    job.fetch()
+    assert job.state == 'queued'
+    assert job.target_queues == []
+    assert fake_db.lindex(app.config['DEFAULT_QUEUE'], 0) == jobs[2].job_id
+    # the promoted job counts towards the limit
+    assert jobs[2].job_id in fake_db.smembers(utils._pending_index_key(app.config, 'email', "waiting@example.com"))
+
+    # a cancelled job is dropped, the next one keeps its place
+    fake_db.hset('job:{}'.format(jobs[3].job_id), 'state', 'failed')
+    _finish(fake_db, jobs[1].job_id)
+    _finish(fake_db, jobs[2].job_id)
+    assert [job_id for job_id, _ in waitlist.promote_waitlisted(fake_db, app.config)] == [jobs[4].job_id]
+
+    assert fake_db.llen(waitlist_name) == 0
+    assert not fake_db.smembers(app.config['WAITLIST_INDEX'])
+
+
+def test_promote_waitlisted_batches(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'WAITLIST_BATCH_SIZE', 2)
+    monkeypatch.setitem(app.config, 'MAX_JOBS_PER_USER', 0)
+    users = []
+    for i in range(5):
+        jobs = _submit(fake_db, app.config, 2, email="user{}@example.com".format(i), ip_addr="10.0.1.{}".format(i),
+                       prefix='taxon-user{}-'.format(i))
+        _finish(fake_db, jobs[0].job_id)
+        users.append(jobs)
+
+    promoted = waitlist.promote_waitlisted(fake_db, app.config)
+    assert sorted(job_id for job_id, _ in promoted) == sorted(jobs[1].job_id for jobs in users)
+    assert not fake_db.smembers(app.config['WAITLIST_INDEX'])
+
+
+def test_rebuild_waitlist_index(app, fake_db):
+    jobs = []
+    for i in range(3):
+        job = Job(fake_db, 'taxon-download{}'.format(i))
+        job.email = "download@example.com"
+        job.ip_addr = "10.0.0.2"
+        job.needs_download = True
+        jobs.append(job)
+    utils._submit_jobs(fake_db, jobs, app.config, [{}] * 3, batch_size=3)
+    assert jobs[2].state == 'waiting'
+
+    waitlist_name = utils._waitlist_name(app.config, "download@example.com")
+    assert fake_db.smembers(app.config['WAITLIST_INDEX']) == {waitlist_name}
+    # the waitlist is still empty while the job is being downloaded
+    assert waitlist.promote_waitlisted(fake_db, app.config) == []
+    assert not fake_db.smembers(app.config['WAITLIST_INDEX'])
+
+    fake_db.lpush(waitlist_name, jobs[2].job_id)
+    assert waitlist.rebuild_waitlist_index(fake_db, app.config) == 1
+    assert fake_db.smembers(app.config['WAITLIST_INDEX']) == {waitlist_name}
+
+
+def test_index_downloaded_waitlists(app, fake_db):
+    jobs = []
+    for i in range(4):
+        job = Job(fake_db, 'taxon-download{}'.format(i))
+        job.email = "download@example.com"
+        job.ip_addr = "10.0.0.2"
+        job.needs_download = True
+        jobs.append(job)
+    utils._submit_jobs(fake_db, jobs, app.config, [{}] * 4, batch_size=4)
+    assert fake_db.hkeys(app.config['WAITLIST_DOWNLOADS']) == [jobs[2].job_id, jobs[3].job_id]
+    assert waitlist.promote_waitlisted(fake_db, app.config) == []
+    assert not fake_db.smembers(app.config['WAITLIST_INDEX'])
+
+    # still downloading
+    assert waitlist.index_downloaded_waitlists(fake_db, app.config) == 0
+    assert not fake_db.smembers(app.config['WAITLIST_INDEX'])
+
+    waitlist_name = utils._waitlist_name(app.config, "download@example.com")
+    fake_db.lpush(waitlist_name, jobs[2].job_id)
+    fake_db.hset('job:{}'.format(jobs[3].job_id), 'state', 'failed')
+    assert waitlist.index_downloaded_waitlists(fake_db, app.config) == 1
+    assert fake_db.smembers(app.config['WAITLIST_INDEX']) == {waitlist_name}
+    assert fake_db.hlen(app.config['WAITLIST_DOWNLOADS']) == 0
+
+
+def test_run_promoter(app, fake_db, monkeypatch):
+    monkeypatch.setitem(app.config, 'WAITLIST_RESCAN_INTERVAL', 0)
+    jobs = _submit(fake_db, app.config, 3)
+    _finish(fake_db, jobs[0].job_id)
+    waitlist_name = utils._waitlist_name(app.config, "waiting@example.com")
+    fake_db.delete(app.config['WAITLIST_INDEX'])
+
+    scans = []
+
+    def rebuild_waitlist_index(redis_store, config):
+        scans.append(config)
+        redis_store.sadd(config['WAITLIST_INDEX'], waitlist_name)
+
+    monkeypatch.setattr(waitlist, 'rebuild_waitlist_index', rebuild_waitlist_index)
+    checks = iter([False, False, True])
+    assert waitlist.run_promoter(fake_db, app.config, interval=0, should_stop=lambda: next(checks)) == 1
+    # the keyspace is only scanned once
+    assert len(scans) == 1
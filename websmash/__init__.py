@@ -1,19 +1,22 @@
+import functools
+import os
 import subprocess
-from typing import Union
-from urllib.parse import urlparse
+from typing import Optional, TYPE_CHECKING, Union
 
-try:
-    from fakeredis import FakeRedis
-except ImportError:
-    pass
-from flask import Flask, g
+from flask import Flask, g, has_request_context, request
 from flask_mail import Mail
 from redis import Redis
-from redis.sentinel import Sentinel
+import redis.asyncio
 
 import websmash.default_settings
+from websmash.connection import get_async_client, get_client, TracingRedis
+from websmash.uploads import UploadRequest
+
+if TYPE_CHECKING:
+    from fakeredis import FakeRedis
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(websmash.default_settings)
 app.config.from_envvar('WEBSMASH_CONFIG', silent=True)
 mail = Mail(app)
@@ -22,45 +25,97 @@ DataStore = Union["Redis[str]", "FakeRedis"]
 
 
 def get_db() -> DataStore:
+    if app.config['REDIS_TRACING'] and has_request_context():
+        # a tracing client per request, sharing the connections, so its trace holds
+        # everything the request sent whichever hook asked for the client first
+        redis_store = getattr(request, '_traced_database', None)
+        if redis_store is None:
+            redis_store = TracingRedis(connection_pool=_get_untraced_db().connection_pool)
+            request._traced_database = redis_store
+        return redis_store
+    return _get_untraced_db()
+
+
+def _get_untraced_db() -> DataStore:
     redis_store = getattr(g, '_database', None)
     if redis_store is None:
         if 'FAKE_DB' in app.config and app.config['FAKE_DB']:
-            redis_store = g._database = FakeRedis(encoding='utf-8', decode_responses=True)
+            # only needed for testing, and slow to import
+            from fakeredis import FakeRedis
+            redis_store = FakeRedis(encoding='utf-8', decode_responses=True)
         else:
-            if app.config['REDIS_URL'].startswith('redis://'):
-                redis_store = g._database = Redis.from_url(app.config['REDIS_URL'], encoding='utf-8',
-                                                           decode_responses=True)
-            elif app.config['REDIS_URL'].startswith('sentinel://'):
-                parsed_url = urlparse(app.config['REDIS_URL'])
-                service = parsed_url.path.lstrip('/')
-                port = 26379
-                if ':' in parsed_url.netloc:
-                    host, str_port = parsed_url.netloc.split(':')
-                    port = int(str_port)
-                else:
-                    host = parsed_url.netloc
-                sentinel = Sentinel([(host, port)], socket_timeout=0.1)
-                redis_store = sentinel.master_for(
-                                        service, redis_class=Redis, socket_timeout=0.1,
-                                        encoding='utf-8', decode_responses=True)
-            else:
-                raise ValueError(f"Invalid redis configuration: {app.config['REDIS_URL']}")
+            redis_store = get_client(app.config)
+        g._database = redis_store
     return redis_store
 
 
+def get_async_db() -> "redis.asyncio.Redis[str]":
+    """Get a redis.asyncio client for the async serving mode"""
+    if 'FAKE_DB' in app.config and app.config['FAKE_DB']:
+        from fakeredis import FakeAsyncRedis
+        # talk to the same fake server as get_db()
+        kwargs = get_db().connection_pool.connection_kwargs
+        return FakeAsyncRedis(host=kwargs['host'], port=kwargs['port'], encoding='utf-8', decode_responses=True)
+    return get_async_client(app.config)
+
+
+# written at build time, e.g. by `make version`, so workers don't need to ask git
+VERSION_STAMP = os.path.join(os.path.dirname(__file__), 'GIT_VERSION')
+
+
+@functools.cache
+def get_git_version() -> str:
+    """Get the git revision websmash is running from
+
+    Read from the WEBSMASH_GIT_VERSION environment variable or the build-time stamp file,
+    only asking git if neither is available.
+    """
+    version = os.environ.get('WEBSMASH_GIT_VERSION')
+    if version:
+        return version.strip()
+
+    try:
+        with open(VERSION_STAMP, encoding='utf-8') as handle:
+            version = handle.read().strip()
+    except FileNotFoundError:
+        pass
+    # an empty stamp is left by builds that couldn't tell the revision
+    if version:
+        return version
+
+    return _get_git_version()
+
+
 def _get_git_version():
     args = ['git', 'rev-parse', '--short', 'HEAD']
 
     try:
-        output = subprocess.check_output(args)
-    except subprocess.CalledProcessError:
+        output = subprocess.check_output(args, cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
         output = b''
 
     return output.decode('utf-8').strip()
 
 
-git_version = _get_git_version()
+def create_app(config_file: Optional[str] = None) -> Flask:
+    """Get the websmash app ready to serve, e.g. `gunicorn --preload 'websmash:create_app()'`
+
+    Everything that is set up here is shared copy-on-write by forked workers. Redis
+    connections, thread pools and background threads are only created by the workers.
+
+    :param config_file: settings file to load on top of the WEBSMASH_CONFIG one
+    :return: the configured app
+    """
+    if config_file is not None:
+        app.config.from_pyfile(config_file)
+    get_git_version()
+    return app
+
 
 # These imports need to live here to avoid circular dependencies
 import websmash.api  # noqa: E402
+import websmash.commands  # noqa: E402
 import websmash.error_handlers  # noqa: E402
+import websmash.metrics  # noqa: E402
+import websmash.ratelimit  # noqa: E402
+import websmash.tracing  # noqa: E402
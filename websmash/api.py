@@ -1,11 +1,16 @@
 """REST-like API for submitting and querying antiSMASH-style jobs"""
 
-from antismash_models import SyncJob as Job, SyncNotice as Notice, utils as am_utils
-from flask import jsonify, abort, request
-from flask_mail import Message
+import hashlib
+import json
+from typing import Optional
 
-from websmash import app, get_db, mail, git_version
-from websmash.utils import dispatch_job
+from antismash_models import AsyncJob, SyncJob as Job
+from flask import jsonify, abort, request, Response
+
+from websmash import app, get_async_db, get_db, get_git_version, events, notices, outbox, positions, stats, timeseries
+from websmash.error_handlers import BadRequest
+from websmash.job_view import JOB_FIELDS, VERSION_FIELDS, JobView
+from websmash.utils import dispatch_bulk_jobs, dispatch_job, parse_timestamp
 
 
 @app.route('/api/v1.0/version')
@@ -15,7 +20,7 @@ def get_version():
         'api': '1.0.0',
         'antismash_generation': app.config['DEFAULT_JOBTYPE'][-1],
         'taxon': app.config['TAXON'],
-        'git': git_version,
+        'git': get_git_version(),
     }
     return jsonify(version_dict)
 
@@ -27,83 +32,256 @@ def api_submit():
     return jsonify(dict(id=job.job_id))
 
 
+@app.route('/api/v1.0/submit/bulk', methods=['POST'])
+def api_submit_bulk():
+    """Submit one job per NCBI accession ('ncbi') or uploaded file ('seq'), with shared options"""
+    jobs = dispatch_bulk_jobs()
+    return jsonify(ids=[job.job_id for job in jobs])
+
+
 @app.route('/api/v1.0/stats')
 def get_stats():
-    redis_store = get_db()
-    pending = redis_store.llen(app.config['DEFAULT_QUEUE'])
-    fast = redis_store.llen(app.config['FAST_QUEUE'])
-    running = redis_store.llen('jobs:running')
+    return jsonify(stats.get_stats(get_db(), app.config))
+
+
+async def get_stats_async():
+    """Like get_stats(), for the async serving mode"""
+    return jsonify(await stats.get_stats_async(get_async_db(), app.config))
 
-    # carry over jobs count from the old database from the config
-    total_jobs = app.config['OLD_JOB_COUNT'] + redis_store.llen('jobs:completed') + \
-        redis_store.llen('jobs:failed') + redis_store.llen('jobs:removed')
 
-    if pending + running + fast > 0:
-        status = 'working'
-    else:
-        status = 'idle'
+@app.route('/api/v1.0/stats/history')
+def get_stats_history():
+    """Return the minimum, average and maximum queue statistics over a window, e.g. ?window=6h"""
+    try:
+        window = timeseries.parse_window(request.args.get('window', '1h'))
+        history = timeseries.get_history(get_db(), app.config, window)
+    except ValueError as err:
+        raise BadRequest(str(err))
+    return jsonify(history)
+
+
+@app.route('/api/v1.0/news')
+def get_news():
+    """Display current notices"""
+    return jsonify(notices=notices.get_active_notices(get_db(), app.config))
 
-    ts_queued, ts_queued_m = _get_job_timestamps(_get_oldest_job(app.config['DEFAULT_QUEUE']))
-    ts_fast, ts_fast_m = _get_job_timestamps(_get_oldest_job(app.config['FAST_QUEUE']))
 
-    return jsonify(status=status, queue_length=pending, running=running,
-                   fast=fast, ts_fast=ts_fast, ts_fast_m=ts_fast_m,
-                   total_jobs=total_jobs,
-                   ts_queued=ts_queued, ts_queued_m=ts_queued_m)
+async def get_news_async():
+    """Like get_news(), for the async serving mode"""
+    return jsonify(notices=await notices.get_active_notices_async(get_async_db(), app.config))
 
 
-def _get_oldest_job(queue):
-    """Get the oldest job in a queue"""
+@app.route('/api/v1.0/status/<task_id>')
+def status(task_id):
     redis_store = get_db()
-    try:
-        job_id = redis_store.lrange(queue, -1, -1)[0]
-    except IndexError:
-        return None
 
-    job = Job(redis_store, job_id)
-    job.fetch()
-    return job
+    # answer conditional requests from just the fields that identify a job's version,
+    # fetched in one round trip with the queue position
+    [((state, last_changed), position)] = positions.fetch_jobs(redis_store, app.config, [task_id], VERSION_FIELDS)
+
+    etag, not_modified = _check_not_modified(state, last_changed, position)
+    if not_modified is not None:
+        return not_modified
+
+    view = JobView(Job(redis_store, task_id), VERSION_FIELDS, (state, last_changed))
+    if not view.exists:
+        # TODO: Write a json error handler for 404 errors
+        abort(404)
+
+    return _status_response(view.load(), etag, last_changed, position)
+
+
+async def status_async(task_id):
+    """Like status(), for the async serving mode"""
+    redis_store = get_async_db()
+
+    [((state, last_changed), position)] = await positions.fetch_jobs_async(
+        redis_store, app.config, [task_id], VERSION_FIELDS)
+
+    etag, not_modified = _check_not_modified(state, last_changed, position)
+    if not_modified is not None:
+        return not_modified
+
+    view = JobView(AsyncJob(redis_store, task_id), VERSION_FIELDS, (state, last_changed))
+    if not view.exists:
+        abort(404)
+
+    return _status_response(await view.load_async(), etag, last_changed, position)
 
 
-def _get_job_timestamps(job):
-    """Get both a readable and a machine-readable timestamp for a job"""
-    if job is None:
+def _check_not_modified(state, last_changed, position=None):
+    """Check a conditional status request against the state and last change of a job
+
+    :param position: queue position of the job, see positions.parse_position()
+    :return: tuple of the job status' entity tag, None for unknown jobs, and a
+             304 response if the client already has the current status, else None
+    """
+    if last_changed is None:
         return None, None
-    return job.last_changed.strftime("%Y-%m-%d %H:%M"), job.last_changed.strftime("%Y-%m-%dT%H:%M:%SZ")
+    queue_position = position['queue_position'] if position else None
+    etag = _status_etag(state, last_changed, queue_position)
+    # the queue position changes without the job changing, so the last change can't validate it
+    if not _is_not_modified(etag, last_changed, use_date=queue_position is None):
+        return etag, None
+    response = Response(status=304)
+    _set_validators(response, etag, last_changed)
+    return etag, response
+
+
+def _status_response(job, etag, last_changed, position=None):
+    """Build the response to a status request"""
+    response = jsonify(_job_status(job, position))
+    if etag is not None:
+        _set_validators(response, etag, last_changed)
+    return response
+
+
+def _status_etag(state, last_changed: str, queue_position: Optional[int] = None) -> str:
+    """Get the entity tag of a job status from the job's state, last change and queue position"""
+    if queue_position is not None:
+        last_changed = "{}|{}".format(last_changed, queue_position)
+    return hashlib.sha1("{}|{}".format(state, last_changed).encode()).hexdigest()
+
+
+def _is_not_modified(etag: str, last_changed: str, use_date: bool = True) -> bool:
+    """Check if the client already has the current version of a job status"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if use_date and request.if_modified_since:
+        return parse_timestamp(last_changed).replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _set_validators(response, etag: str, last_changed: str) -> None:
+    """Set the headers clients need to revalidate a job status"""
+    response.set_etag(etag)
+    response.last_modified = parse_timestamp(last_changed)
+    response.cache_control.no_cache = True
+
+
+@app.route('/api/v1.0/status/<task_id>/events')
+def status_events(task_id):
+    """Stream status updates of a job as server-sent events
+
+    Every open stream holds a thread for up to EVENTS_MAX_DURATION seconds, so this needs a threaded
+    deployment, or the ASGI mode serving status_events_async(); on sync workers each stream ties up a whole worker.
+    Falls back to a one-shot status response if this worker already has EVENTS_MAX_CONNECTIONS open streams.
+    """
+    if not events.limiter.acquire(app.config['EVENTS_MAX_CONNECTIONS']):
+        return status(task_id)
+
+    redis_store = get_db()
+    if not redis_store.exists("job:{}".format(task_id)):
+        events.limiter.release()
+        abort(404)
 
+    # wake-ups mostly find the job unchanged, only read the whole job after it changed
+    last = {}
+
+    def fetch_status():
+        view = JobView.fetch(redis_store, task_id)
+        if view is None:
+            return None
+        version = (view.state, view.last_changed)
+        if last.get('version') != version:
+            last['version'] = version
+            last['status'] = _job_status(view.load())
+        return last['status']
+
+    response = Response(events.stream_job_updates(redis_store, app.config, task_id, fetch_status),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(events.limiter.release)
+    return response
+
+
+async def status_events_async(task_id):
+    """Like status_events(), for the async serving mode, where open streams don't hold a thread"""
+    if not events.limiter.acquire(app.config['EVENTS_MAX_CONNECTIONS']):
+        return await status_async(task_id)
+
+    redis_store = get_async_db()
+    if not await redis_store.exists("job:{}".format(task_id)):
+        events.limiter.release()
+        abort(404)
+
+    last = {}
+
+    async def fetch_status():
+        view = JobView(AsyncJob(redis_store, task_id), VERSION_FIELDS,
+                       await redis_store.hmget("job:{}".format(task_id), *VERSION_FIELDS))
+        if not view.exists:
+            return None
+        version = (view.state, view.last_changed)
+        if last.get('version') != version:
+            last['version'] = version
+            last['status'] = _job_status(await view.load_async())
+        return last['status']
+
+    response = Response(events.stream_job_updates_async(redis_store, app.config, task_id, fetch_status),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(events.limiter.release)
+    return response
+
+
+@app.route('/api/v1.0/status', methods=['POST'])
+def batch_status():
+    """Get the status of many jobs at once
+
+    Expects a JSON object with a list of job IDs in 'ids'.
+    Large lists are streamed back in chunks of STATUS_BATCH_CHUNK_SIZE jobs.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list) or \
+            not all(isinstance(job_id, str) for job_id in payload['ids']):
+        raise BadRequest("Expected a JSON object with a list of job IDs in 'ids'")
+
+    # drop duplicates, but keep the order
+    job_ids = list(dict.fromkeys(payload['ids']))
+    if len(job_ids) > app.config['STATUS_BATCH_MAX_IDS']:
+        raise BadRequest("Too many job IDs, at most {} are allowed".format(app.config['STATUS_BATCH_MAX_IDS']))
 
-@app.route('/api/v1.0/news')
-def get_news():
-    """Display current notices"""
     redis_store = get_db()
-    notices = []
-    for notice_id in redis_store.keys('notice:*'):
-        notice = Notice(redis_store, notice_id[7:])
-        try:
-            notice.fetch()
-        except ValueError:
-            continue
+    chunk_size = app.config['STATUS_BATCH_CHUNK_SIZE']
+    if len(job_ids) <= chunk_size:
+        return jsonify(jobs=dict(_fetch_job_statuses(redis_store, job_ids)))
+
+    return Response(_stream_job_statuses(redis_store, job_ids, chunk_size), mimetype='application/json')
+
 
-        if notice.show_from > am_utils.now():
-            # show_from is in the future, don't show this yet
+def _fetch_job_statuses(redis_store, job_ids):
+    """Fetch the status of several jobs in a single round trip
+
+    :return: generator of (job ID, status dict) tuples
+    """
+    for job_id, (values, position) in zip(job_ids, positions.fetch_jobs(redis_store, app.config, job_ids, JOB_FIELDS)):
+        view = JobView(Job(redis_store, job_id), JOB_FIELDS, values)
+        if not view.exists:
+            yield job_id, {'error': 'Not found'}
             continue
+        yield job_id, _job_status(view.load(), position)
 
-        notices.append(notice.to_dict())
 
-    return jsonify(notices=notices)
+def _stream_job_statuses(redis_store, job_ids, chunk_size):
+    """Stream the status of many jobs as a JSON document, one chunk of jobs at a time"""
+    yield '{"jobs": {'
+    separator = ''
+    for start in range(0, len(job_ids), chunk_size):
+        for job_id, res in _fetch_job_statuses(redis_store, job_ids[start:start + chunk_size]):
+            yield '{}{}: {}'.format(separator, json.dumps(job_id), app.json.dumps(res))
+            separator = ', '
+    yield '}}'
 
 
-@app.route('/api/v1.0/status/<task_id>')
-def status(task_id):
-    redis_store = get_db()
-    job = Job(redis_store, task_id)
-    try:
-        job.fetch()
-    except ValueError:
-        # TODO: Write a json error handler for 404 errors
-        abort(404)
+def _job_status(job, position=None):
+    """Get the status information of a job as shown to the user
 
+    :param position: queue position of the job, see positions.parse_position()
+    """
     res = job.to_dict()
+    if position:
+        res.update(position)
 
     if job.state == 'done':
         result_url = "%s/%s/index.html" % (app.config['RESULTS_URL'], job.job_id)
@@ -114,30 +292,30 @@ def status(task_id):
     # I hate browser caches.
     res['short_status'] = job.state
 
-    return jsonify(res)
+    return res
 
 
 @app.route('/api/v1.0/email/send', methods=['POST'])
 def send_email():
+    """Queue a feedback email and its confirmation for the mail sender"""
     if 'email' not in request.json:
         abort(400)
     email = request.json['email']
+    # the address ends up in the headers of both messages
+    if not outbox.is_valid_address(email):
+        raise BadRequest("Invalid email address")
 
     if 'message' not in request.json:
         abort(400)
     message = request.json['message']
 
-    with mail.connect() as conn:
-        feedback_message = Message(subject="antiSMASH feedback",
-                                   recipients=app.config['DEFAULT_RECIPIENTS'],
-                                   body=message, sender=email)
-
-        conn.send(feedback_message)
-
-        confirmation_msg = Message(subject='antiSMASH feedback received',
-                                   recipients=[email],
-                                   body="We have received your feedback to antiSMASH "
-                                        "and will reply to you as soon as possible.")
-        conn.send(confirmation_msg)
+    feedback_message = outbox.build_message(subject="antiSMASH feedback",
+                                            recipients=app.config['DEFAULT_RECIPIENTS'],
+                                            body=message, sender=email)
+    confirmation_msg = outbox.build_message(subject='antiSMASH feedback received',
+                                            recipients=[email],
+                                            body="We have received your feedback to antiSMASH "
+                                                 "and will reply to you as soon as possible.")
+    outbox.enqueue_messages(get_db(), app.config, feedback_message, confirmation_msg)
 
     return '', 204
@@ -0,0 +1,291 @@
+"""Async serving mode for ASGI servers, e.g. `uvicorn websmash.asgi:application`
+
+The version, stats, news, status and status event endpoints are served by coroutines using
+redis.asyncio, so a single worker process can keep thousands of mostly idle polling connections
+and event streams open. All other endpoints, including job submission, run the regular Flask
+views in a thread pool, as they spend most of their time parsing forms and writing uploaded
+files to disk. Both share URL routing, error handlers and request hooks with the WSGI app.
+
+Request bodies are streamed to the regular Flask views as they read them, so uploads are only
+written to disk once, by the upload staging. Flask rejects bodies over MAX_CONTENT_LENGTH.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import inspect
+import io
+import sys
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from flask import Flask
+from werkzeug.exceptions import ClientDisconnected, HTTPException, RequestEntityTooLarge
+
+from websmash import api, app, connection, ratelimit
+from websmash.background import dark_launches, SHUTDOWN_TIMEOUT
+
+# endpoints served without blocking the event loop, other endpoints run in the thread pool
+ASYNC_VIEWS: dict[str, Callable[..., Any]] = {
+    'get_version': api.get_version,
+    'get_stats': api.get_stats_async,
+    'get_news': api.get_news_async,
+    'status': api.status_async,
+    'status_events': api.status_events_async,
+}
+
+
+class AsyncAPI:
+    """ASGI application serving the websmash API"""
+
+    def __init__(self, flask_app: Flask, views: dict[str, Callable[..., Any]]) -> None:
+        self.flask_app = flask_app
+        self.views = views
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError("Unsupported ASGI scope type {!r}".format(scope['type']))
+
+        environ = _build_environ(scope)
+        adapter = self.flask_app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, view_args = adapter.match()
+        except HTTPException:
+            # let Flask handle redirects and errors the usual way
+            endpoint, view_args = None, {}
+
+        try:
+            if endpoint in self.views:
+                response = await self._run_async_view(self.views[endpoint], view_args, environ)
+                if hasattr(response.response, '__aiter__'):
+                    await _send_async_response(send, receive, response)
+                else:
+                    await _send_response(send, *response.get_wsgi_response(environ))
+            else:
+                await self._run_wsgi(environ, receive, send)
+        finally:
+            environ['wsgi.input'].close()
+
+    async def _run_async_view(self, view: Callable[..., Any], view_args: dict[str, Any], environ: dict[str, Any]):
+        """Run a view coroutine like Flask would run a regular view"""
+        with self.flask_app.request_context(environ):
+            try:
+                # instead of the blocking check of the request hooks
+                await ratelimit.limit_by_ip_async()
+                rv = self.flask_app.preprocess_request()
+                if rv is None:
+                    rv = view(**view_args)
+                    if inspect.isawaitable(rv):
+                        rv = await rv
+            except Exception as err:
+                try:
+                    rv = self.flask_app.handle_user_exception(err)
+                except Exception as unhandled:
+                    rv = self.flask_app.handle_exception(unhandled)
+            response = self.flask_app.make_response(rv)
+            return self.flask_app.process_response(response)
+
+    async def _run_wsgi(self, environ: dict[str, Any], receive, send) -> None:
+        """Run the Flask WSGI app in the thread pool, streaming its request body and response"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        started: list[tuple[str, list[tuple[str, str]]]] = []
+        body = _RequestBody(receive, loop, self.flask_app.config['MAX_CONTENT_LENGTH'])
+        environ['wsgi.input'] = io.BufferedReader(body)
+        # the body ends with the last message, so Flask can read bodies without a declared length
+        environ['wsgi.input_terminated'] = True
+
+        def start_response(status, headers, exc_info=None):
+            started.append((status, headers))
+
+        # like asyncio.to_thread(), but in our own thread pool
+        call = functools.partial(contextvars.copy_context().run, self.flask_app.wsgi_app, environ, start_response)
+        app_iter = await loop.run_in_executor(executor, call)
+        try:
+            if body.disconnected:
+                # nobody is left to answer
+                return
+            chunks = iter(app_iter)
+            first = await loop.run_in_executor(executor, next, chunks, None)
+            status, headers = started[-1]
+            await _send_response(send, _prepend(first, chunks), status, headers, loop, executor)
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(executor, close)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.flask_app.config['ASGI_THREADS'],
+                                                thread_name_prefix='asgi-wsgi')
+        return self._executor
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # finish the dark launch copies before the worker exits
+                await asyncio.to_thread(dark_launches.shutdown, SHUTDOWN_TIMEOUT)
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await connection.close_async_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _prepend(first: Optional[bytes], chunks: Iterator[bytes]) -> Iterator[bytes]:
+    if first is None:
+        return
+    yield first
+    yield from chunks
+
+
+class _RequestBody(io.RawIOBase):
+    """WSGI input receiving the body of an ASGI request as the app reads it
+
+    Read from the thread pool, every message is received on the event loop.
+
+    :param max_length: maximum number of bytes to receive, None for no limit
+    """
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop, max_length: Optional[int] = None) -> None:
+        super().__init__()
+        self._receive = receive
+        self._loop = loop
+        self._max_length = max_length
+        self._received = 0
+        self._buffer = memoryview(b'')
+        self._more_body = True
+        self.disconnected = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                self.disconnected = True
+                raise ClientDisconnected()
+            self._buffer = memoryview(message.get('body', b''))
+            self._more_body = message.get('more_body', False)
+            self._received += len(self._buffer)
+            # Flask only stops reading at the limit, without telling the body was cut short
+            if self._max_length is not None and self._received > self._max_length:
+                raise RequestEntityTooLarge()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _build_environ(scope) -> dict[str, Any]:
+    """Build a WSGI environ for an ASGI HTTP request, without the request body"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for raw_name, raw_value in scope['headers']:
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_{}'.format(name)
+        if name in environ:
+            value = '{},{}'.format(environ[name], value)
+        environ[name] = value
+
+    return environ
+
+
+async def _send_response(send, body: Iterator[bytes], status: str, headers, loop=None, executor=None) -> None:
+    """Send a WSGI-style response to the ASGI server
+
+    If an executor is given, the body iterator is advanced in it instead of on the event loop.
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+
+    chunks = iter(body)
+    while True:
+        if executor is not None:
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+        else:
+            chunk = next(chunks, None)
+        if chunk is None:
+            break
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _send_async_response(send, receive, response) -> None:
+    """Send a response with an async body iterator, e.g. an event stream, until it ends or the client leaves"""
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+
+    chunks: AsyncIterator[Any] = response.response
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(anext(chunks, None))
+            await asyncio.wait([next_chunk, disconnected], return_when=asyncio.FIRST_COMPLETED)
+            if not next_chunk.done():
+                next_chunk.cancel()
+                await asyncio.gather(next_chunk, return_exceptions=True)
+                return
+            chunk = next_chunk.result()
+            if chunk is None:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        disconnected.cancel()
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+        response.close()
+
+
+async def _wait_for_disconnect(receive) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def create_asgi_app(flask_app: Flask = app) -> AsyncAPI:
+    """Create the ASGI application for a websmash Flask app"""
+    return AsyncAPI(flask_app, ASYNC_VIEWS)
+
+
+application = create_asgi_app()
@@ -0,0 +1,129 @@
+"""Bounded background execution of work the client doesn't need to wait for"""
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundExecutor:
+    """Run tasks in a bounded thread pool, keeping statistics on lag and failures
+
+    The thread pool is only started on the first submitted task, so it is created
+    in the worker process rather than in a preloading parent.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._reset()
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._stats: dict[str, float] = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'last_lag': 0.0,
+            'max_lag': 0.0,
+            'total_lag': 0.0,
+        }
+
+    def submit(self, workers: int, max_pending: int, fn: Callable[..., Any], *args: Any) -> bool:
+        """Run a task in the background
+
+        :param workers: number of threads to run tasks in, 0 to run the task right away
+        :param max_pending: maximum number of tasks waiting or running, further tasks are dropped
+        :param fn: the task to run
+        :param args: arguments to the task
+        :return: False if the task was dropped, True otherwise
+        """
+        queued_at = time.monotonic()
+        with self._lock:
+            self._stats['submitted'] += 1
+            if workers > 0 and self._pending >= max_pending:
+                self._stats['dropped'] += 1
+                logger.warning("%s: dropping task, %d tasks pending", self.name, self._pending)
+                return False
+            self._pending += 1
+            if workers > 0 and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.name)
+            executor = self._executor
+
+        if workers > 0 and executor is not None:
+            executor.submit(self._run, queued_at, fn, args)
+        else:
+            self._run(queued_at, fn, args)
+        return True
+
+    def _run(self, queued_at: float, fn: Callable[..., Any], args: tuple) -> None:
+        failed = False
+        try:
+            fn(*args)
+        except Exception:
+            failed = True
+            logger.exception("%s: task failed", self.name)
+        finally:
+            lag = time.monotonic() - queued_at
+            with self._lock:
+                self._pending -= 1
+                self._stats['failed' if failed else 'completed'] += 1
+                self._stats['last_lag'] = lag
+                self._stats['max_lag'] = max(self._stats['max_lag'], lag)
+                self._stats['total_lag'] += lag
+
+    @property
+    def pending(self) -> int:
+        """Number of tasks waiting or running"""
+        return self._pending
+
+    def stats(self) -> dict[str, float]:
+        """Get task counts and the lag between submitting and finishing tasks, in seconds"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        return stats
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for all pending tasks to finish, e.g. before shutting down
+
+        :param timeout: maximum number of seconds to wait, None to wait until done
+        :return: True if all tasks finished
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._pending > 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """Finish the pending tasks and stop the thread pool
+
+        :param timeout: maximum number of seconds to wait for the pending tasks, None to wait until done,
+                        tasks that haven't started by then are dropped
+        :return: True if all tasks finished
+        """
+        drained = self.drain(timeout)
+        if not drained:
+            logger.warning("%s: shutting down with %d tasks pending", self.name, self._pending)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=drained, cancel_futures=not drained)
+        return drained
+
+
+# seconds a worker waits for pending tasks when exiting
+SHUTDOWN_TIMEOUT = 30
+
+dark_launches = BackgroundExecutor('dark-launch')
+
+os.register_at_fork(after_in_child=dark_launches._reset)
+atexit.register(dark_launches.shutdown, SHUTDOWN_TIMEOUT)
@@ -0,0 +1,103 @@
+"""In-process caching of values that are expensive to compute"""
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class SnapshotCache:
+    """Cache a single value for a limited time, refreshing it at most once concurrently
+
+    While one thread refreshes an expired value, other threads keep getting the old value.
+    Only when there is no value at all yet do they wait for the refresh to finish.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value: Optional[Any] = None
+        self._fetched = 0.0
+        self._generation = 0
+
+    def get(self, max_age: float, refresh: Callable[[], Any]) -> Any:
+        """Get the cached value, refreshing it if it is older than max_age seconds
+
+        :param max_age: maximum age of the cached value in seconds
+        :param refresh: callable to compute a new value
+        :return: the cached or freshly computed value
+        """
+        value = self._value
+        if value is not None and time.monotonic() - self._fetched < max_age:
+            return value
+
+        if not self._lock.acquire(blocking=value is None):
+            # another thread is already refreshing, serve the old value meanwhile
+            return value
+
+        try:
+            if self._value is not None and time.monotonic() - self._fetched < max_age:
+                return self._value
+            generation = self._generation
+            value = refresh()
+            # don't cache values computed from data that was invalidated during the refresh
+            if generation == self._generation:
+                self._value = value
+                self._fetched = time.monotonic()
+            return value
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        """Drop the cached value so the next get() refreshes it"""
+        self._generation += 1
+        self._value = None
+
+
+class AsyncSnapshotCache:
+    """Like SnapshotCache, but for coroutines running on a single event loop
+
+    While one coroutine refreshes an expired value, other coroutines keep getting the old value.
+    Only when there is no value at all yet do they wait for the refresh to finish.
+    """
+
+    def __init__(self) -> None:
+        self._refresh: Optional[asyncio.Future] = None
+        self._value: Optional[Any] = None
+        self._fetched = 0.0
+        self._generation = 0
+
+    async def get(self, max_age: float, refresh: Callable[[], Awaitable[Any]]) -> Any:
+        """Get the cached value, refreshing it if it is older than max_age seconds
+
+        :param max_age: maximum age of the cached value in seconds
+        :param refresh: coroutine function to compute a new value
+        :return: the cached or freshly computed value
+        """
+        value = self._value
+        if value is not None and time.monotonic() - self._fetched < max_age:
+            return value
+
+        if self._refresh is not None and value is not None:
+            # another coroutine is already refreshing, serve the old value meanwhile
+            return value
+
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._run_refresh(refresh))
+        # don't cancel the shared refresh if this caller goes away
+        return await asyncio.shield(self._refresh)
+
+    async def _run_refresh(self, refresh: Callable[[], Awaitable[Any]]) -> Any:
+        generation = self._generation
+        try:
+            value = await refresh()
+            # don't cache values computed from data that was invalidated during the refresh
+            if generation == self._generation:
+                self._value = value
+                self._fetched = time.monotonic()
+            return value
+        finally:
+            self._refresh = None
+
+    def invalidate(self) -> None:
+        """Drop the cached value so the next get() refreshes it"""
+        self._generation += 1
+        self._value = None
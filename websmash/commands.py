@@ -0,0 +1,134 @@
+"""Maintenance commands for the flask CLI"""
+from datetime import UTC
+import uuid
+
+import click
+from antismash_models import SyncNotice as Notice
+
+import websmash
+from websmash import app, fair_share, get_db, input_store, job_history, notices, outbox, positions, timeseries, waitlist
+from websmash.utils import rebuild_pending_indexes
+
+
+@app.cli.command('rebuild-pending-index')
+def rebuild_pending_index_command():
+    """Recreate the per-user pending job indexes from the default queue"""
+    indexed = rebuild_pending_indexes(get_db(), app.config)
+    click.echo("Indexed {} pending jobs".format(indexed))
+
+
+@app.cli.command('rebuild-waitlist-index')
+def rebuild_waitlist_index_command():
+    """Add all waitlists holding jobs to the waitlist index"""
+    indexed = waitlist.rebuild_waitlist_index(get_db(), app.config)
+    click.echo("Indexed {} waitlists".format(indexed))
+
+
+@app.cli.command('rebuild-position-index')
+def rebuild_position_index_command():
+    """Renumber the jobs in the default queue for the queue positions"""
+    indexed = positions.rebuild_position_index(get_db(), app.config)
+    click.echo("Indexed {} queued jobs".format(indexed))
+
+
+@app.cli.command('rebuild-notice-index')
+def rebuild_notice_index_command():
+    """Build the notice indexes from the existing notice keys"""
+    indexed = notices.rebuild_notice_index(get_db(), app.config)
+    click.echo("Indexed {} notices".format(indexed))
+
+
+@app.cli.command('index-notices')
+def index_notices_command():
+    """Add notices stored without add-notice to the notice indexes"""
+    indexed = notices.index_unindexed_notices(get_db(), app.config)
+    click.echo("Indexed {} notices".format(indexed))
+
+
+@app.cli.command('add-notice')
+@click.option('--category', type=click.Choice(sorted(Notice.VALID_CATEGORIES)), default='info')
+@click.option('--show-from', type=click.DateTime(), default=None, help="Start showing the notice at (UTC)")
+@click.option('--show-until', type=click.DateTime(), default=None, help="Stop showing the notice at (UTC)")
+@click.argument('teaser')
+@click.argument('text')
+def add_notice_command(category, show_from, show_until, teaser, text):
+    """Add a notice to show on the website"""
+    if show_from is not None:
+        show_from = show_from.replace(tzinfo=UTC)
+    if show_until is not None:
+        show_until = show_until.replace(tzinfo=UTC)
+    notice = Notice(get_db(), str(uuid.uuid4()), category=category, teaser=teaser, text=text,
+                    show_from=show_from, show_until=show_until)
+    notices.add_notice(get_db(), notice, app.config)
+    click.echo("Added notice {}".format(notice.notice_id))
+
+
+@app.cli.command('gc-input-store')
+def gc_input_store_command():
+    """Remove stored input files that no job uses anymore"""
+    removed = input_store.collect_garbage(app.config)
+    click.echo("Removed {} unused input files".format(removed))
+
+
+@app.cli.command('trim-job-history')
+def trim_job_history_command():
+    """Trim the lists of finished jobs to JOB_HISTORY_LENGTH, counting the trimmed jobs"""
+    trimmed = job_history.trim_job_history(get_db(), app.config)
+    for key, count in trimmed.items():
+        click.echo("Trimmed {} jobs from {}".format(count, key))
+
+
+@app.cli.command('mail-sender')
+@click.option('--once', is_flag=True, help="Send one batch of due messages and exit")
+@click.option('--poll-interval', type=int, default=5, help="Seconds to wait for new messages")
+def mail_sender_command(once, poll_interval):
+    """Send emails queued in the outbox"""
+    redis_store = get_db()
+    if once:
+        outbox.requeue_unacknowledged(redis_store, app.config)
+        outbox.promote_retries(redis_store, app.config)
+        sent = outbox.send_batch(redis_store, app.config, websmash.mail, outbox.pop_batch(redis_store, app.config))
+    else:
+        sent = outbox.run_sender(redis_store, app.config, websmash.mail, poll_interval)
+    click.echo("Sent {} emails".format(sent))
+
+
+@app.cli.command('waitlist-promoter')
+@click.option('--once', is_flag=True, help="Check all waitlists once and exit")
+@click.option('--interval', type=float, default=10, help="Seconds between checks of the waitlists")
+def waitlist_promoter_command(once, interval):
+    """Move waitlisted jobs to the default queue as their submitters' jobs finish"""
+    redis_store = get_db()
+    if once:
+        waitlist.index_downloaded_waitlists(redis_store, app.config)
+        promoted = len(waitlist.promote_waitlisted(redis_store, app.config))
+    else:
+        promoted = waitlist.run_promoter(redis_store, app.config, interval)
+    click.echo("Promoted {} jobs".format(promoted))
+
+
+@app.cli.command('fair-share-feeder')
+@click.option('--once', is_flag=True, help="Top up the default queue once and exit")
+@click.option('--interval', type=float, default=1, help="Seconds between checks of the default queue")
+def fair_share_feeder_command(once, interval):
+    """Keep the default queue filled from the fair-share sub-queues"""
+    redis_store = get_db()
+    if once:
+        fair_share.sync_weights(redis_store, app.config)
+        moved = fair_share.feed_default_queue(redis_store, app.config)
+    else:
+        moved = fair_share.run_feeder(redis_store, app.config, interval)
+    click.echo("Moved {} jobs".format(moved))
+
+
+@app.cli.command('stats-sampler')
+@click.option('--once', is_flag=True, help="Record a single sample and exit")
+def stats_sampler_command(once):
+    """Record the queue statistics history every TIMESERIES_INTERVAL seconds"""
+    redis_store = get_db()
+    if once:
+        values, counters = timeseries.sample(redis_store, app.config)
+        recorded = int(timeseries.record(redis_store, app.config, values, counters))
+    else:
+        recorded = timeseries.run_sampler(redis_store, app.config)
+    click.echo("Recorded {} samples".format(recorded))
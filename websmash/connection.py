@@ -0,0 +1,242 @@
+"""Process-wide Redis connection pools"""
+from collections import Counter
+import os
+import threading
+import time
+from typing import Any
+from urllib.parse import urlparse
+
+from redis import ConnectionPool, Redis
+from redis.client import Pipeline
+import redis.asyncio
+import redis.asyncio.sentinel
+from redis.sentinel import Sentinel, SentinelConnectionPool
+
+DEFAULT_SENTINEL_PORT = 26379
+
+_pools: dict[str, ConnectionPool] = {}
+_clients: dict[str, Redis] = {}
+_async_clients: dict[str, redis.asyncio.Redis] = {}
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    """Drop the parent's pools in a freshly forked worker"""
+    global _lock, _pid
+    _pools.clear()
+    _clients.clear()
+    _async_clients.clear()
+    _pid = os.getpid()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def parse_sentinel_url(url: str) -> tuple[list[tuple[str, int]], str]:
+    """Parse a sentinel://host[:port][,host[:port]...]/service URL
+
+    :param url: the sentinel URL to parse
+    :return: tuple of list of (host, port) sentinel addresses and the service name
+    """
+    parsed_url = urlparse(url)
+    service = parsed_url.path.lstrip('/')
+    if not parsed_url.netloc or not service:
+        raise ValueError(f"Invalid redis configuration: {url}")
+
+    sentinels = []
+    for address in parsed_url.netloc.split(','):
+        if ':' in address:
+            host, str_port = address.split(':')
+            port = int(str_port)
+        else:
+            host = address
+            port = DEFAULT_SENTINEL_PORT
+        sentinels.append((host, port))
+
+    return sentinels, service
+
+
+def _create_pool(config, use_asyncio: bool = False) -> ConnectionPool:
+    """Create a new connection pool for the configured Redis URL
+
+    :param config: websmash config to read the REDIS_* settings from
+    :param use_asyncio: create a pool for redis.asyncio clients instead
+    """
+    if use_asyncio:
+        pool_class = redis.asyncio.ConnectionPool
+        sentinel_class = redis.asyncio.sentinel.Sentinel
+        sentinel_pool_class = redis.asyncio.sentinel.SentinelConnectionPool
+    else:
+        pool_class = ConnectionPool
+        sentinel_class = Sentinel
+        sentinel_pool_class = SentinelConnectionPool
+
+    url = config['REDIS_URL']
+    pool_kwargs: dict[str, Any] = dict(
+        max_connections=config['REDIS_MAX_CONNECTIONS'],
+        socket_connect_timeout=config['REDIS_SOCKET_CONNECT_TIMEOUT'],
+        encoding='utf-8',
+        decode_responses=True,
+    )
+
+    if url.startswith('redis://'):
+        return pool_class.from_url(url, socket_timeout=config['REDIS_SOCKET_TIMEOUT'], **pool_kwargs)
+
+    if url.startswith('sentinel://'):
+        sentinels, service = parse_sentinel_url(url)
+        sentinel_timeout = config['REDIS_SENTINEL_SOCKET_TIMEOUT']
+        socket_timeout = config['REDIS_SOCKET_TIMEOUT']
+        if socket_timeout is None:
+            socket_timeout = sentinel_timeout
+        sentinel = sentinel_class(sentinels, socket_timeout=sentinel_timeout)
+        # the pool only asks the sentinels for the master when opening a new connection,
+        # so master discovery is shared by all requests reusing the pooled connections
+        return sentinel_pool_class(service, sentinel, socket_timeout=socket_timeout, **pool_kwargs)
+
+    raise ValueError(f"Invalid redis configuration: {url}")
+
+
+def get_connection_pool(config) -> ConnectionPool:
+    """Get the connection pool shared by all requests of this process
+
+    :param config: websmash config to read the REDIS_* settings from
+    :return: the connection pool for the configured Redis URL
+    """
+    if _pid != os.getpid():
+        _reset_after_fork()
+
+    url = config['REDIS_URL']
+    pool = _pools.get(url)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(url)
+            if pool is None:
+                pool = _pools[url] = _create_pool(config)
+    return pool
+
+
+def get_client(config) -> Redis:
+    """Get a Redis client using the process-wide connection pool"""
+    pool = get_connection_pool(config)
+    url = config['REDIS_URL']
+    client = _clients.get(url)
+    if client is None:
+        client = _clients.setdefault(url, Redis(connection_pool=pool))
+    return client
+
+
+def get_async_client(config) -> redis.asyncio.Redis:
+    """Get a redis.asyncio client using a process-wide connection pool
+
+    Connections belong to the event loop they were opened on, so the client is meant
+    to be used from the single event loop of an ASGI worker process.
+    """
+    if _pid != os.getpid():
+        _reset_after_fork()
+
+    url = config['REDIS_URL']
+    client = _async_clients.get(url)
+    if client is None:
+        client = _async_clients.setdefault(url, redis.asyncio.Redis(connection_pool=_create_pool(config, True)))
+    return client
+
+
+async def close_async_clients() -> None:
+    """Close the connections of all redis.asyncio clients, e.g. when an ASGI worker shuts down"""
+    while _async_clients:
+        _, client = _async_clients.popitem()
+        await client.aclose(close_connection_pool=True)
+
+
+def pool_stats() -> dict[str, dict[str, Any]]:
+    """Get connection statistics of all connection pools in this process
+
+    :return: dict of Redis URL to a dict of created, in_use, idle and max_connections counts
+    """
+    stats = {}
+    for url, pool in list(_pools.items()):
+        stats[_redact_password(url)] = {
+            'created': pool._created_connections,
+            'in_use': len(pool._in_use_connections),
+            'idle': len(pool._available_connections),
+            'max_connections': pool.max_connections,
+        }
+    return stats
+
+
+def _redact_password(url: str) -> str:
+    """Hide the password of a Redis URL"""
+    parsed_url = urlparse(url)
+    if parsed_url.password is None:
+        return url
+    netloc = parsed_url.netloc.replace(':{}@'.format(parsed_url.password), ':***@', 1)
+    return parsed_url._replace(netloc=netloc).geturl()
+
+
+class RedisTrace:
+    """Commands sent and time spent waiting for Redis, e.g. during one request"""
+
+    def __init__(self) -> None:
+        self.commands: Counter[str] = Counter()
+        self.round_trips = 0
+        self.duration = 0.0
+
+    def record(self, commands: list[str], duration: float) -> None:
+        """Record a round trip sending the given commands"""
+        self.commands.update(command.upper() for command in commands)
+        self.round_trips += 1
+        self.duration += duration
+
+    def summary(self) -> dict[str, Any]:
+        """Summarise the trace, with the commands sent most often first"""
+        return {
+            'commands': sum(self.commands.values()),
+            'round_trips': self.round_trips,
+            'time_ms': round(self.duration * 1000, 3),
+            'by_command': dict(self.commands.most_common()),
+        }
+
+
+class TracingRedis(Redis):
+    """Redis client recording every command it sends in a RedisTrace"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.trace = RedisTrace()
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            self.trace.record([str(args[0])], time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> "TracingPipeline":
+        return TracingPipeline(self.trace, self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TracingPipeline(Pipeline):
+    """Pipeline recording its commands in a RedisTrace when it is executed"""
+
+    def __init__(self, trace: RedisTrace, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.trace = trace
+
+    def immediate_execute_command(self, *args, **options):
+        # e.g. WATCH, or the SCRIPT EXISTS and SCRIPT LOAD sent before a pipeline with scripts
+        start = time.perf_counter()
+        try:
+            return super().immediate_execute_command(*args, **options)
+        finally:
+            self.trace.record([str(args[0])], time.perf_counter() - start)
+
+    def execute(self, raise_on_error: bool = True):
+        commands = [str(args[0]) for args, _ in self.command_stack]
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            if commands:
+                self.trace.record(commands, time.perf_counter() - start)
@@ -6,21 +6,98 @@ SECRET_KEY = "development_key"
 RESULTS_PATH = path.join(path.dirname(path.dirname(__file__)), 'results')
 RESULTS_URL = '/upload'
 
+# Upload limits in bytes for a whole submission and for each uploaded file, None for no limit
+MAX_CONTENT_LENGTH = 8 * 1024 ** 3
+MAX_UPLOAD_FILE_SIZE = 4 * 1024 ** 3
+# Uploads are streamed here before being moved to the job directory,
+# defaults to RESULTS_PATH/.incoming so that move is a rename on the same filesystem
+UPLOAD_STAGING_PATH = None
+# Deduplicate uploaded files in a content-addressed store, job input directories hard link to it.
+# The store defaults to RESULTS_PATH/.store and needs to be on the same filesystem as RESULTS_PATH
+USE_INPUT_STORE = True
+INPUT_STORE_PATH = None
+
 TAXON = "bacteria"
 
 # Flask-Mail settings
 MAIL_SERVER = "mail.example.com"
 DEFAULT_MAIL_SENDER = "antismash@example.com"
 DEFAULT_RECIPIENTS = ["antismash@example.com"]
+# Emails are queued in MAIL_OUTBOX and sent by `flask mail-sender` in batches of MAIL_BATCH_SIZE,
+# kept in MAIL_PROCESSING while they are being sent.
+# Failed messages are retried after MAIL_RETRY_BACKOFF seconds, doubling on each attempt,
+# and moved to MAIL_DEAD_LETTER after MAIL_MAX_ATTEMPTS attempts
+MAIL_OUTBOX = 'mail:outbox'
+MAIL_PROCESSING = 'mail:processing'
+MAIL_RETRY = 'mail:retry'
+MAIL_DEAD_LETTER = 'mail:dead'
+MAIL_BATCH_SIZE = 50
+MAIL_RETRY_BACKOFF = 60
+MAIL_MAX_ATTEMPTS = 8
 
 # Flask-Redis settings
 REDIS_URL = "redis://localhost:6379/0"
+# Connections are pooled per worker process
+REDIS_MAX_CONNECTIONS = 50
+# Timeouts in seconds, None waits forever. Sentinel masters default to REDIS_SENTINEL_SOCKET_TIMEOUT
+REDIS_SOCKET_TIMEOUT = None
+REDIS_SOCKET_CONNECT_TIMEOUT = 5
+REDIS_SENTINEL_SOCKET_TIMEOUT = 0.1
 
 OLD_JOB_COUNT = 0
 
+# Maximum age in seconds of the queue statistics served by /api/v1.0/stats
+STATS_CACHE_TTL = 5
+
+# Batch status requests: maximum number of job IDs, and number of jobs fetched per round trip.
+# Responses for more jobs than fit in one chunk are streamed
+STATUS_BATCH_MAX_IDS = 10000
+STATUS_BATCH_CHUNK_SIZE = 500
+
+# Server-sent job status events: pub/sub channel prefix, maximum open streams per worker
+# (each holds a Redis connection, and a thread unless served in the ASGI mode), seconds between keepalives
+# and maximum stream duration. The streams need the ASGI mode or threaded workers, they would tie up sync workers.
+JOB_UPDATES_PREFIX = 'jobs:updates'
+EVENTS_MAX_CONNECTIONS = 20
+EVENTS_HEARTBEAT = 15
+EVENTS_MAX_DURATION = 3600
+
+# Log the Redis commands sent by each request, and also return them in an X-Redis-Trace header
+REDIS_TRACING = False
+REDIS_TRACING_HEADER = False
+# Fraction of requests to profile, profiles are saved to PROFILE_DIR or logged if that is None
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIR = None
+
+# Seconds between samples of the queue lengths exported at /metrics, 0 to not sample them
+METRICS_SAMPLE_INTERVAL = 15
+
+# Threads per process running the endpoints that are not served asynchronously in the ASGI mode
+ASGI_THREADS = 16
+
+# Prefix of the sorted sets indexing notices by start and expiry time
+NOTICE_INDEX_PREFIX = 'notices'
+# Maximum age in seconds of the notices served by /api/v1.0/news
+NEWS_CACHE_TTL = 60
+
+# Token-bucket rate limits per endpoint, by client IP address and by email address, as
+# (requests, seconds): up to that many requests at once, refilling completely over that many seconds
+RATE_LIMITS = {
+    'api_submit': {'ip': (30, 600), 'email': (30, 600)},
+    'api_submit_bulk': {'ip': (5, 600), 'email': (5, 600)},
+    'status': {'ip': (600, 60)},
+    'batch_status': {'ip': (60, 60)},
+    'get_stats_history': {'ip': (60, 60)},
+}
+RATE_LIMIT_PREFIX = 'ratelimit'
+
 # Job filter settings
 MAX_JOBS_PER_USER = 5
 
+# Bulk submissions: maximum number of jobs per request, and number of jobs submitted per round trip
+BULK_SUBMIT_MAX_JOBS = 500
+BULK_SUBMIT_BATCH_SIZE = 100
+
 # Users with access to the priority queue
 VIP_USERS = set()
 
@@ -31,6 +108,46 @@ PRIORITY_QUEUE = 'jobs:priority'
 DEVELOPMENT_QUEUE = 'jobs:development'
 WAITLIST_PREFIX = 'jobs:waiting'
 DOWNLOAD_QUEUE = 'jobs:downloads'
+# Prefix of the per-email and per-IP sets of pending jobs used for MAX_JOBS_PER_USER
+PENDING_INDEX_PREFIX = 'jobs:pending'
+# Set of the waitlists that might hold jobs. `flask waitlist-promoter` moves waitlisted jobs to
+# DEFAULT_QUEUE once their submitter is below MAX_JOBS_PER_USER again, checking WAITLIST_BATCH_SIZE
+# waitlists per round trip. Waitlisted jobs that need a download are kept in the WAITLIST_DOWNLOADS
+# hash until they reached their waitlist, checked every WAITLIST_RESCAN_INTERVAL seconds
+WAITLIST_INDEX = 'jobs:waitlists'
+WAITLIST_DOWNLOADS = 'jobs:waitlists:downloads'
+WAITLIST_BATCH_SIZE = 500
+WAITLIST_RESCAN_INTERVAL = 60
+# Fair-share queueing: jobs for DEFAULT_QUEUE go to a sub-queue per submitter (email, or IP address
+# without one) instead, and `flask fair-share-feeder` keeps FAIR_SHARE_BUFFER jobs in DEFAULT_QUEUE,
+# taken from the sub-queues in weighted round-robin order. Submitters have a weight of 1 unless set in
+# FAIR_SHARE_WEIGHTS, VIP_USERS get FAIR_SHARE_VIP_WEIGHT instead of the priority queue.
+# Sub-queues only filled after a download are found by rescanning every FAIR_SHARE_RESCAN_INTERVAL seconds
+FAIR_SHARE = False
+FAIR_SHARE_PREFIX = 'jobs:fair'
+FAIR_SHARE_INDEX = 'jobs:fair-share'
+FAIR_SHARE_BUFFER = 10
+FAIR_SHARE_WEIGHTS = {}
+FAIR_SHARE_VIP_WEIGHT = 10
+FAIR_SHARE_RESCAN_INTERVAL = 600
+# Jobs in DEFAULT_QUEUE are numbered in the QUEUE_POSITION_INDEX sorted set, so status requests can show
+# their position. Their start time is estimated from the dequeue rate over the last QUEUE_RATE_WINDOW seconds,
+# sampled at most every QUEUE_RATE_SAMPLE_INTERVAL seconds
+QUEUE_POSITION_INDEX = 'jobs:positions'
+QUEUE_RATE_WINDOW = 1800
+QUEUE_RATE_SAMPLE_INTERVAL = 30
+# The lists of finished job IDs are kept at JOB_HISTORY_LENGTH entries each by `flask trim-job-history`,
+# which adds the number of IDs it trimmed to the JOB_HISTORY_COUNTS hash, so total_jobs still counts them
+JOB_HISTORY_LENGTH = 10000
+JOB_HISTORY_COUNTS = 'jobs:history-counts'
+# Counter of all submitted jobs
+SUBMISSION_COUNTER = 'jobs:submitted'
+# Time series of the queue statistics served by /api/v1.0/stats/history, sampled every TIMESERIES_INTERVAL
+# seconds by `flask stats-sampler`. Each level keeps a ring buffer of the given number of buckets of the given
+# seconds, here a day by the minute, a week by the quarter hour and 90 days by the hour
+TIMESERIES_PREFIX = 'stats:timeseries'
+TIMESERIES_INTERVAL = 60
+TIMESERIES_LEVELS = [(60, 1440), (900, 672), (3600, 2160)]
 
 DEFAULT_JOBTYPE = 'antismash8'
 DARK_LAUNCH_JOBTYPE = 'antismash8'
@@ -48,4 +165,9 @@ DARK_LAUNCH_PERCENTAGE = 10
 # email address so we can (a) track them (b) they don't confuse the submitter
 DARK_LAUNCH_EMAIL = "antismash@example.com"
 
+# Dark launch copies are made by this many background threads per worker, 0 makes them
+# before the submission returns. Further copies are dropped while this many are pending
+DARK_LAUNCH_WORKERS = 2
+DARK_LAUNCH_MAX_PENDING = 100
+
 # End configuration
@@ -33,6 +33,19 @@ def method_not_allowed(error):
     return make_response(jsonify({'error': 'Method not allowed'}), 405)
 
 
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return make_response(jsonify({'error': 'Request entity too large'}), 413)
+
+
+@app.errorhandler(429)
+def too_many_requests(error):
+    response = make_response(jsonify({'error': 'Too many requests'}), 429)
+    if getattr(error, 'retry_after', None) is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
 @app.errorhandler(500)
 def internal_server_error(error):
     return make_response(jsonify({'error': 'Internal server error'}), 500)
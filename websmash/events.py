@@ -0,0 +1,141 @@
+"""Server-sent events pushing job status updates to clients"""
+import json
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+TERMINAL_STATES = {'done', 'failed', 'removed'}
+
+
+class ConnectionLimiter:
+    """Keep track of the number of open event streams in this worker"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def acquire(self, limit: int) -> bool:
+        """Reserve a slot for a new stream, returns False if all slots are taken"""
+        with self._lock:
+            if self.active >= limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self) -> None:
+        """Free the slot of a closed stream"""
+        with self._lock:
+            self.active -= 1
+
+
+limiter = ConnectionLimiter()
+
+
+def job_update_channel(config, job_id: str) -> str:
+    """Get the pub/sub channel job updates are announced on"""
+    return '{}:{}'.format(config['JOB_UPDATES_PREFIX'], job_id)
+
+
+def publish_job_update(redis_store, config, job_id: str) -> None:
+    """Tell clients following a job that its status changed"""
+    redis_store.publish(job_update_channel(config, job_id), job_id)
+
+
+def format_event(data: dict[str, Any], event: str = 'status') -> str:
+    """Format a server-sent event"""
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+def stream_job_updates(redis_store, config, job_id: str,
+                       fetch_status: Callable[[], Optional[dict[str, Any]]]) -> Iterator[str]:
+    """Generate a server-sent event whenever the status of a job changes
+
+    Changes are picked up from the job's update channel and, if the Redis server
+    has keyspace notifications for hashes enabled, from changes to the job hash.
+    Without any notification, the job is checked again every EVENTS_HEARTBEAT seconds.
+
+    :param redis_store: Redis connection to subscribe with
+    :param config: websmash config
+    :param job_id: ID of the job to follow
+    :param fetch_status: callable returning the job's status dict, or None if the job is gone
+    :return: generator of server-sent event strings
+    """
+    db = redis_store.connection_pool.connection_kwargs.get('db', 0)
+    pubsub = redis_store.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(job_update_channel(config, job_id), '__keyspace@{}__:job:{}'.format(db, job_id))
+
+    try:
+        deadline = time.monotonic() + config['EVENTS_MAX_DURATION']
+        last_seen = None
+        while True:
+            status = fetch_status()
+            if status is None:
+                yield format_event({'error': 'Not found'}, event='error')
+                return
+
+            seen = (status.get('state'), status.get('last_changed'))
+            if seen != last_seen:
+                yield format_event(status)
+                last_seen = seen
+
+            if status.get('state') in TERMINAL_STATES:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            message = pubsub.get_message(timeout=min(config['EVENTS_HEARTBEAT'], remaining))
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+
+            # one check covers any burst of notifications
+            while pubsub.get_message(timeout=0) is not None:
+                pass
+    finally:
+        pubsub.close()
+
+
+async def stream_job_updates_async(redis_store, config, job_id: str,
+                                   fetch_status: Callable[[], Awaitable[Optional[dict[str, Any]]]]
+                                   ) -> AsyncIterator[str]:
+    """Like stream_job_updates(), using a redis.asyncio connection
+
+    :param fetch_status: coroutine function returning the job's status dict, or None if the job is gone
+    """
+    db = redis_store.connection_pool.connection_kwargs.get('db', 0)
+    pubsub = redis_store.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(job_update_channel(config, job_id), '__keyspace@{}__:job:{}'.format(db, job_id))
+
+    try:
+        deadline = time.monotonic() + config['EVENTS_MAX_DURATION']
+        last_seen = None
+        while True:
+            status = await fetch_status()
+            if status is None:
+                yield format_event({'error': 'Not found'}, event='error')
+                return
+
+            seen = (status.get('state'), status.get('last_changed'))
+            if seen != last_seen:
+                yield format_event(status)
+                last_seen = seen
+
+            if status.get('state') in TERMINAL_STATES:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            message = await pubsub.get_message(ignore_subscribe_messages=True,
+                                               timeout=min(config['EVENTS_HEARTBEAT'], remaining))
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+
+            while await pubsub.get_message(ignore_subscribe_messages=True, timeout=0) is not None:
+                pass
+    finally:
+        await pubsub.aclose()
@@ -0,0 +1,199 @@
+"""Weighted fair-share queueing of jobs across submitters
+
+With FAIR_SHARE set, jobs that would go to DEFAULT_QUEUE are pushed to a sub-queue per
+submitter instead. The FAIR_SHARE_INDEX sorted set holds the non-empty sub-queues, scored
+by their virtual start time. Taking a job pops the sub-queue with the lowest score, so in
+O(log submitters), and moves that sub-queue on by 1 / weight. A submitter with a weight
+of 2 thus gets twice as many jobs run as one with a weight of 1 while both have jobs
+queued. Sub-queues that become non-empty start at the current virtual time, so idle
+submitters don't build up credit.
+
+The workers keep taking jobs from DEFAULT_QUEUE, `flask fair-share-feeder` keeps it filled
+with FAIR_SHARE_BUFFER jobs from the sub-queues. Keeping the buffer small keeps the order fair.
+"""
+import logging
+import time
+from typing import Callable
+
+from websmash import positions
+
+logger = logging.getLogger(__name__)
+
+# Lua function adding a sub-queue a job was just pushed to to the index
+INDEX_QUEUE_FUNCTION = """
+local function index_fair_queue(index, queue)
+    redis.call('INCR', index .. ':queued')
+    if not redis.call('ZSCORE', index, queue) then
+        local clock = tonumber(redis.call('GET', index .. ':clock') or '0')
+        local finish = tonumber(redis.call('ZSCORE', index .. ':finish', queue) or '0')
+        redis.call('ZADD', index, math.max(clock, finish), queue)
+    end
+end
+"""
+
+TAKE_JOBS_SCRIPT = """
+-- KEYS: fair-share index, optionally a queue to move the jobs to and its position index
+-- ARGV: number of jobs to take, or with a queue to move them to, the length to fill that queue up to
+-- returns the job IDs taken, in order
+""" + positions.INDEX_POSITION_FUNCTION + """
+local index = KEYS[1]
+local count = tonumber(ARGV[1])
+if KEYS[2] then
+    count = count - redis.call('LLEN', KEYS[2])
+end
+
+local jobs = {}
+while #jobs < count do
+    local head = redis.call('ZRANGE', index, 0, 0, 'WITHSCORES')
+    if #head == 0 then
+        break
+    end
+    local queue, start = head[1], tonumber(head[2])
+    local job_id = redis.call('RPOP', queue)
+    if job_id then
+        local weight = tonumber(redis.call('HGET', index .. ':weights', queue) or '1')
+        local finish = start + 1 / weight
+        redis.call('SET', index .. ':clock', start)
+        redis.call('DECR', index .. ':queued')
+        table.insert(jobs, job_id)
+        if redis.call('LLEN', queue) > 0 then
+            redis.call('ZADD', index, finish, queue)
+        else
+            -- remember where the sub-queue got to, so it doesn't jump ahead when refilled at once
+            redis.call('ZREM', index, queue)
+            redis.call('ZADD', index .. ':finish', finish, queue)
+        end
+    else
+        redis.call('ZREM', index, queue)
+    end
+end
+
+if #jobs > 0 then
+    redis.call('ZREMRANGEBYSCORE', index .. ':finish', '-inf', redis.call('GET', index .. ':clock'))
+    if KEYS[2] then
+        redis.call('LPUSH', KEYS[2], unpack(jobs))
+        for _, job_id in ipairs(jobs) do
+            index_position(KEYS[3], job_id)
+        end
+    end
+end
+return jobs
+"""
+
+
+REBUILD_INDEX_SCRIPT = """
+-- KEYS: fair-share index
+-- ARGV: sub-queues found by scanning the keyspace
+-- adds the non-empty sub-queues to the index and sets the count of queued jobs in one step,
+-- so the count can't miss jobs the other scripts push or take meanwhile
+-- returns the number of queued jobs
+local index = KEYS[1]
+local clock = redis.call('GET', index .. ':clock') or '0'
+-- sub-queues created since the scan are in the index already
+local queues = {}
+for _, queue in ipairs(ARGV) do
+    queues[queue] = true
+end
+for _, queue in ipairs(redis.call('ZRANGE', index, 0, -1)) do
+    queues[queue] = true
+end
+
+local queued = 0
+for queue in pairs(queues) do
+    local length = redis.call('LLEN', queue)
+    if length > 0 then
+        queued = queued + length
+        if not redis.call('ZSCORE', index, queue) then
+            redis.call('ZADD', index, clock, queue)
+        end
+    end
+end
+redis.call('SET', index .. ':queued', queued)
+return queued
+"""
+
+
+def submitter(job) -> str:
+    """Get the submitter a job is queued for, the email or without one the IP address"""
+    return job.email or job.ip_addr
+
+
+def queue_name(config, user: str) -> str:
+    """Get the name of the sub-queue of a submitter"""
+    return '{}:{}'.format(config['FAIR_SHARE_PREFIX'], user)
+
+
+def get_weight(config, user: str) -> float:
+    """Get the fair-share weight of a submitter"""
+    if user in config['FAIR_SHARE_WEIGHTS']:
+        return config['FAIR_SHARE_WEIGHTS'][user]
+    if user in config['VIP_USERS']:
+        return config['FAIR_SHARE_VIP_WEIGHT']
+    return 1
+
+
+def sync_weights(redis_store, config) -> None:
+    """Store the weights of the submitters not using the default weight for the scripts to read"""
+    users = set(config['FAIR_SHARE_WEIGHTS']) | set(config['VIP_USERS'])
+    key = '{}:weights'.format(config['FAIR_SHARE_INDEX'])
+    pipe = redis_store.pipeline()
+    pipe.delete(key)
+    if users:
+        pipe.hset(key, mapping={queue_name(config, user): get_weight(config, user) for user in users})
+    pipe.execute()
+
+
+def take_jobs(redis_store, config, count: int) -> list[str]:
+    """Take the next jobs in fair-share order, for workers popping jobs themselves
+
+    :param count: maximum number of jobs to take
+    :return: list of job IDs
+    """
+    script = redis_store.register_script(TAKE_JOBS_SCRIPT)
+    return script(keys=[config['FAIR_SHARE_INDEX']], args=[count])
+
+
+def feed_default_queue(redis_store, config) -> int:
+    """Top up DEFAULT_QUEUE to FAIR_SHARE_BUFFER jobs from the sub-queues
+
+    :return: number of jobs moved
+    """
+    script = redis_store.register_script(TAKE_JOBS_SCRIPT)
+    jobs = script(keys=[config['FAIR_SHARE_INDEX'], config['DEFAULT_QUEUE'], config['QUEUE_POSITION_INDEX']],
+                  args=[config['FAIR_SHARE_BUFFER']])
+    return len(jobs)
+
+
+def rebuild_fair_share_index(redis_store, config, batch_size: int = 1000) -> int:
+    """Add all sub-queues holding jobs to the index and recount the queued jobs
+
+    Jobs that need a download only reach their sub-queue after the download, without
+    being indexed.
+
+    :return: number of sub-queues found
+    """
+    queues = list(redis_store.scan_iter(match='{}:*'.format(config['FAIR_SHARE_PREFIX']), count=batch_size))
+    redis_store.register_script(REBUILD_INDEX_SCRIPT)(keys=[config['FAIR_SHARE_INDEX']], args=queues)
+    return len(queues)
+
+
+def run_feeder(redis_store, config, interval: float = 1,
+               should_stop: Callable[[], bool] = lambda: False) -> int:
+    """Keep DEFAULT_QUEUE topped up from the sub-queues until told to stop
+
+    :param interval: seconds between checks of the default queue length
+    :param should_stop: callable returning True once the feeder should stop
+    :return: number of jobs moved
+    """
+    moved = 0
+    last_rescan = None
+    while not should_stop():
+        if last_rescan is None or time.monotonic() - last_rescan >= config['FAIR_SHARE_RESCAN_INTERVAL']:
+            sync_weights(redis_store, config)
+            found = rebuild_fair_share_index(redis_store, config)
+            logger.debug("Found %d fair-share sub-queues", found)
+            last_rescan = time.monotonic()
+
+        moved += feed_default_queue(redis_store, config)
+        time.sleep(interval)
+    return moved
@@ -0,0 +1,137 @@
+"""Content-addressed store for job input files
+
+Job input directories reference stored files through hard links, so identical
+inputs, e.g. of dark-launched job copies, only take up disk space once.
+The link count of a stored file doubles as its reference count: once no job
+links to it anymore, it is removed by collect_garbage().
+"""
+import errno
+import os
+from os import path
+import shutil
+import stat
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# ioctl request to clone a file's extents (reflink), from linux/fs.h
+FICLONE = 0x40049409
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+# errors meaning the data can't be shared by linking, e.g. across devices
+NOT_LINKABLE = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.EOPNOTSUPP)
+
+
+def store_dir(config) -> str:
+    """Get the directory of the input store"""
+    return config['INPUT_STORE_PATH'] or path.join(config['RESULTS_PATH'], '.store')
+
+
+def store_path(config, checksum: str) -> str:
+    """Get the path a file with the given checksum is stored at"""
+    algorithm, digest = checksum.split(':', 1)
+    return path.join(store_dir(config), algorithm, digest[:2], digest)
+
+
+def link_or_copy(source: str, destination: str) -> str:
+    """Make a file available at another path, sharing its data where possible
+
+    Tries a hard link first, then a reflink, and only copies the data if neither works,
+    e.g. across devices.
+
+    :param source: the existing file
+    :param destination: the path to make the file available at
+    :return: 'link', 'reflink' or 'copy', depending on what was done
+    """
+    try:
+        os.link(source, destination)
+        return 'link'
+    except OSError as err:
+        if err.errno not in NOT_LINKABLE:
+            raise
+
+    if _reflink(source, destination):
+        return 'reflink'
+
+    shutil.copyfile(source, destination)
+    return 'copy'
+
+
+def _reflink(source: str, destination: str) -> bool:
+    """Clone a file without copying its data, if the filesystem supports it"""
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        try:
+            os.unlink(destination)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def add_file(config, filename: str, checksum: str) -> None:
+    """Move a job's input file into the store, leaving a link in its place
+
+    If a file with the same contents is already stored, the job's copy is replaced
+    by a link to the stored file.
+
+    :param config: websmash config
+    :param filename: path of the input file in the job's input directory
+    :param checksum: checksum of the file, as 'algorithm:hexdigest'
+    """
+    stored = store_path(config, checksum)
+    os.makedirs(path.dirname(stored), exist_ok=True)
+
+    try:
+        os.link(filename, stored)
+        os.chmod(stored, READ_ONLY)
+        return
+    except FileExistsError:
+        pass
+    except OSError as err:
+        if err.errno in NOT_LINKABLE:
+            # can't share this file, leave the job's copy as it is
+            return
+        raise
+
+    # same contents already stored, share the stored file instead
+    temp_name = path.join(path.dirname(filename), '.link-{}'.format(uuid.uuid4().hex))
+    try:
+        os.link(stored, temp_name)
+    except FileNotFoundError:
+        # the stored file was just garbage collected, store this one instead
+        add_file(config, filename, checksum)
+        return
+    except OSError as err:
+        if err.errno in NOT_LINKABLE:
+            return
+        raise
+    os.replace(temp_name, filename)
+
+
+def collect_garbage(config) -> int:
+    """Remove stored files no job links to anymore
+
+    :param config: websmash config
+    :return: number of files removed
+    """
+    removed = 0
+    for dirpath, _, filenames in os.walk(store_dir(config)):
+        for filename in filenames:
+            full_name = path.join(dirpath, filename)
+            try:
+                if os.stat(full_name).st_nlink > 1:
+                    continue
+                os.unlink(full_name)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    return removed
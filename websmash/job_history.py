@@ -0,0 +1,52 @@
+"""Bounded lists of finished jobs
+
+The backend pushes the IDs of finished jobs to a list per final state. Left alone those
+lists grow forever, while all they are read for is the total number of jobs. The lists
+are trimmed to their newest JOB_HISTORY_LENGTH IDs instead, and the number of IDs
+trimmed off each list is added to a counter in the JOB_HISTORY_COUNTS hash by the same
+script call. The counter plus the length of the list is then the number of jobs that
+ever reached that state.
+
+Trimming is done TRIM_BATCH_SIZE IDs per list and script call, so trimming the long
+lists of an existing database the first time doesn't block Redis.
+"""
+
+HISTORY_LISTS = ('jobs:completed', 'jobs:failed', 'jobs:removed')
+
+# IDs trimmed off each list per round trip
+TRIM_BATCH_SIZE = 10000
+
+TRIM_SCRIPT = """
+-- KEYS: counts hash, then the lists to trim
+-- ARGV: number of IDs to keep per list, maximum number of IDs to trim per list
+-- returns the number of IDs trimmed off each list
+local keep = tonumber(ARGV[1])
+local trimmed = {}
+for i = 2, #KEYS do
+    local count = math.min(math.max(redis.call('LLEN', KEYS[i]) - keep, 0), tonumber(ARGV[2]))
+    if count > 0 then
+        -- IDs are pushed to the head, so the oldest ones are at the tail
+        redis.call('LTRIM', KEYS[i], 0, -count - 1)
+        redis.call('HINCRBY', KEYS[1], KEYS[i], count)
+    end
+    trimmed[i - 1] = count
+end
+return trimmed
+"""
+
+
+def trim_job_history(redis_store, config, batch_size: int = TRIM_BATCH_SIZE) -> dict[str, int]:
+    """Trim the finished job lists to JOB_HISTORY_LENGTH IDs, counting the trimmed IDs
+
+    :param batch_size: maximum number of IDs to trim off each list per round trip
+    :return: dict of the number of IDs trimmed off each list
+    """
+    script = redis_store.register_script(TRIM_SCRIPT)
+    totals = dict.fromkeys(HISTORY_LISTS, 0)
+    while True:
+        trimmed = script(keys=[config['JOB_HISTORY_COUNTS'], *HISTORY_LISTS],
+                         args=[config['JOB_HISTORY_LENGTH'], batch_size])
+        for key, count in zip(HISTORY_LISTS, trimmed):
+            totals[key] += count
+        if not any(trimmed):
+            return totals
@@ -0,0 +1,83 @@
+"""Projected reads of job hashes
+
+Job.fetch() checks that a job exists and then reads all of its fields, two round trips
+for the whole hash. Most hot paths only need a few fields to decide what to do next.
+A JobView is built from just those fields, read with HMGET, possibly in a pipeline with
+other commands. The other fields are read with a single HMGET the first time any of them
+is used.
+"""
+from typing import Any, Iterable, Optional, Union
+
+from antismash_models import AsyncJob, SyncJob as Job
+
+JOB_FIELDS = Job.PROPERTIES + Job.ATTRIBUTES
+
+# the fields identifying a version of a job's status
+VERSION_FIELDS = ('state', 'last_changed')
+
+
+class JobView:
+    """Some fields of a job, the others are read when first used
+
+    :param job: job to fill in, without any fields set
+    :param fields: fields the values were read for
+    :param values: values of the fields as returned by HMGET
+    """
+
+    def __init__(self, job: Union[Job, AsyncJob], fields: Iterable[str], values: Iterable[Optional[str]]) -> None:
+        self._job = job
+        self._loaded: set[str] = set()
+        fields, values = tuple(fields), tuple(values)
+        # a job hash always has a state, so no value at all means there is no job
+        self.exists = any(value is not None for value in values)
+        if self.exists:
+            self._set(fields, values)
+
+    @classmethod
+    def fetch(cls, redis_store, job_id: str, fields: Iterable[str] = VERSION_FIELDS) -> Optional['JobView']:
+        """Read some fields of a job in a single round trip
+
+        :return: JobView of the job, or None if there is no such job
+        """
+        fields = tuple(fields)
+        view = cls(Job(redis_store, job_id), fields, redis_store.hmget("job:{}".format(job_id), *fields))
+        return view if view.exists else None
+
+    @property
+    def job_id(self) -> str:
+        return self._job.job_id
+
+    @property
+    def missing(self) -> tuple[str, ...]:
+        """Get the fields not read yet"""
+        return tuple(field for field in JOB_FIELDS if field not in self._loaded)
+
+    def load(self) -> Job:
+        """Read the fields not read yet
+
+        :return: the job with all fields set
+        """
+        if isinstance(self._job, AsyncJob):
+            raise TypeError("Use load_async() for jobs using a redis.asyncio connection")
+        missing = self.missing
+        if missing:
+            self._set(missing, self._job._db.hmget(self._job._key, *missing))
+        return self._job
+
+    async def load_async(self) -> AsyncJob:
+        """Like load(), for jobs using a redis.asyncio connection"""
+        missing = self.missing
+        if missing:
+            self._set(missing, await self._job._db.hmget(self._job._key, *missing))
+        return self._job
+
+    def _set(self, fields: tuple[str, ...], values: tuple[Optional[str], ...]) -> None:
+        self._job._parse(fields, values)
+        self._loaded.update(fields)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_') or name not in JOB_FIELDS:
+            raise AttributeError(name)
+        if name not in self._loaded:
+            self.load()
+        return getattr(self._job, name)
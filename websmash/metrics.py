@@ -0,0 +1,195 @@
+"""Prometheus metrics, served at /metrics
+
+Needs the prometheus_client package, without it the metrics are not collected.
+To aggregate the metrics of several worker processes, point the PROMETHEUS_MULTIPROC_DIR
+environment variable at an empty directory before starting the workers.
+
+Queue lengths are sampled every METRICS_SAMPLE_INTERVAL seconds by a background thread,
+in only one worker process at a time, so scrapes never touch Redis. The same thread samples
+the Redis connection pools and background task statistics of every worker process.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+from flask import abort, g, request, Response
+
+from websmash import app, connection, get_db
+from websmash.background import dark_launches
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+SAMPLER_LOCK = 'metrics:sampler'
+
+if prometheus_client is not None:
+    REQUEST_LATENCY = prometheus_client.Histogram(
+        'websmash_request_duration_seconds', 'Time spent handling requests', ['endpoint', 'method'])
+    REQUESTS = prometheus_client.Counter(
+        'websmash_requests_total', 'Requests handled', ['endpoint', 'method', 'status'])
+    JOBS_SUBMITTED = prometheus_client.Counter(
+        'websmash_jobs_submitted_total', 'Submitted jobs by the queue they were pushed to', ['queue'])
+    DARK_LAUNCHES = prometheus_client.Counter(
+        'websmash_dark_launches_total', 'Dark-launched job copies by queue', ['queue'])
+    UPLOADED_FILES = prometheus_client.Counter('websmash_uploaded_files_total', 'Uploaded input files')
+    UPLOADED_BYTES = prometheus_client.Counter('websmash_uploaded_bytes_total', 'Size of uploaded input files')
+    QUEUE_LENGTH = prometheus_client.Gauge(
+        'websmash_queue_length', 'Jobs in each queue', ['queue'], multiprocess_mode='livemostrecent')
+    WAITLISTED_JOBS = prometheus_client.Gauge(
+        'websmash_waitlisted_jobs', 'Jobs on all waitlists', multiprocess_mode='livemostrecent')
+    WAITLIST_PROMOTION_LATENCY = prometheus_client.Histogram(
+        'websmash_waitlist_promotion_seconds', 'Time promoted jobs spent on a waitlist',
+        buckets=(60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400, float('inf')))
+    REDIS_POOL_CONNECTIONS = prometheus_client.Gauge(
+        'websmash_redis_pool_connections', 'Connections of the Redis connection pools by state',
+        ['url', 'state'], multiprocess_mode='livesum')
+    REDIS_POOL_MAX_CONNECTIONS = prometheus_client.Gauge(
+        'websmash_redis_pool_max_connections', 'Connection limit of each Redis connection pool',
+        ['url'], multiprocess_mode='livemax')
+    BACKGROUND_TASKS = prometheus_client.Gauge(
+        'websmash_background_tasks', 'Background tasks of the running workers by outcome',
+        ['executor', 'outcome'], multiprocess_mode='livesum')
+    BACKGROUND_LAG = prometheus_client.Gauge(
+        'websmash_background_task_max_lag_seconds', 'Longest time between submitting and finishing a background task',
+        ['executor'], multiprocess_mode='livemax')
+
+
+def _queue_label(config, queue: str) -> str:
+    """Get the metric label of a queue, grouping all per-user waitlists and sub-queues together"""
+    if queue.startswith('{}:'.format(config['WAITLIST_PREFIX'])):
+        return 'waitlist'
+    if queue.startswith('{}:'.format(config['FAIR_SHARE_PREFIX'])):
+        return 'fair-share'
+    return queue
+
+
+def record_submission(config, queue: str) -> None:
+    """Count a job pushed to a queue on submission"""
+    if prometheus_client is not None:
+        JOBS_SUBMITTED.labels(_queue_label(config, queue)).inc()
+
+
+def record_dark_launch(queue: str) -> None:
+    """Count a job copy pushed to a dark launch queue"""
+    if prometheus_client is not None:
+        DARK_LAUNCHES.labels(queue).inc()
+
+
+def record_upload(size: int) -> None:
+    """Count an uploaded input file"""
+    if prometheus_client is not None:
+        UPLOADED_FILES.inc()
+        UPLOADED_BYTES.inc(size)
+
+
+def record_promotion(waited: float) -> None:
+    """Record how long a job promoted from a waitlist waited"""
+    if prometheus_client is not None:
+        WAITLIST_PROMOTION_LATENCY.observe(waited)
+
+
+def sample_queues(redis_store, config) -> None:
+    """Update the queue length gauges from Redis"""
+    queues = [config['DEFAULT_QUEUE'], config['FAST_QUEUE'], config['PRIORITY_QUEUE'],
+              config['DEVELOPMENT_QUEUE'], config['DOWNLOAD_QUEUE']]
+    waitlists = list(redis_store.smembers(config['WAITLIST_INDEX']))
+
+    pipe = redis_store.pipeline(transaction=False)
+    for queue in queues + waitlists:
+        pipe.llen(queue)
+    lengths = pipe.execute()
+
+    for queue, length in zip(queues, lengths):
+        QUEUE_LENGTH.labels(queue).set(length)
+    WAITLISTED_JOBS.set(sum(lengths[len(queues):]))
+
+
+def sample_pools() -> None:
+    """Update the connection pool gauges from the pools of this process"""
+    for url, stats in connection.pool_stats().items():
+        for state in ('created', 'in_use', 'idle'):
+            REDIS_POOL_CONNECTIONS.labels(url, state).set(stats[state])
+        REDIS_POOL_MAX_CONNECTIONS.labels(url).set(stats['max_connections'])
+
+
+def sample_background_tasks() -> None:
+    """Update the background task gauges from the executors of this process"""
+    stats = dark_launches.stats()
+    for outcome in ('submitted', 'completed', 'failed', 'dropped', 'pending'):
+        BACKGROUND_TASKS.labels(dark_launches.name, outcome).set(stats[outcome])
+    BACKGROUND_LAG.labels(dark_launches.name).set(stats['max_lag'])
+
+
+class QueueSampler:
+    """Background thread sampling the queue lengths, started on the first request of a worker"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def ensure_running(self, interval: float) -> None:
+        if interval <= 0 or (self._pid == os.getpid() and self._thread is not None):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='metrics-sampler', daemon=True)
+            self._thread.start()
+
+    def _run(self, interval: float) -> None:
+        while True:
+            try:
+                sample_pools()
+                sample_background_tasks()
+                with app.app_context():
+                    redis_store = get_db()
+                    # only one worker needs to sample per interval
+                    if redis_store.set(SAMPLER_LOCK, os.getpid(), nx=True, ex=max(int(interval), 1)):
+                        sample_queues(redis_store, app.config)
+            except Exception:
+                app.logger.exception("Failed to sample queue lengths")
+            time.sleep(interval)
+
+
+sampler = QueueSampler()
+
+
+@app.before_request
+def _start_timer():
+    if prometheus_client is None:
+        return
+    g.metrics_start = time.perf_counter()
+    sampler.ensure_running(app.config['METRICS_SAMPLE_INTERVAL'])
+
+
+@app.after_request
+def _observe_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    endpoint = request.endpoint or 'unmatched'
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - start)
+    REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Serve the metrics in the Prometheus text format"""
+    if prometheus_client is None:
+        abort(404)
+
+    sample_pools()
+    sample_background_tasks()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
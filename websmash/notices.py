@@ -0,0 +1,231 @@
+"""Indexed storage of the notices shown by /api/v1.0/news
+
+Notices stored without add_notice(), e.g. with Notice.commit() by other tools, are missing
+from the indexes and not shown until they are indexed by the index-notices command, which
+scans the notice keys outside of the request path.
+"""
+import time
+from typing import Any
+
+from antismash_models import SyncNotice as Notice
+
+from websmash.cache import AsyncSnapshotCache, SnapshotCache
+
+NOTICE_FIELDS = Notice.PROPERTIES + Notice.ATTRIBUTES
+
+# keys checked per SCAN round trip when looking for unindexed notices among all other keys
+SCAN_BATCH_SIZE = 1000
+
+_cache = SnapshotCache()
+_async_cache = AsyncSnapshotCache()
+
+
+def _index_keys(config) -> tuple[str, str]:
+    """Get the keys of the notice indexes by start time and by expiry time"""
+    prefix = config['NOTICE_INDEX_PREFIX']
+    return '{}:show_from'.format(prefix), '{}:show_until'.format(prefix)
+
+
+def _index_notice(pipe, config, notice_id: str, show_from: float, show_until: float) -> None:
+    """Queue the commands to add a notice to the indexes on a pipeline"""
+    by_start, by_expiry = _index_keys(config)
+    pipe.zadd(by_start, {notice_id: show_from})
+    pipe.zadd(by_expiry, {notice_id: show_until})
+
+
+def _invalidate_caches() -> None:
+    """Make sure changed notices are picked up by the next request"""
+    _cache.invalidate()
+    _async_cache.invalidate()
+
+
+def add_notice(redis_store, notice: Notice, config) -> None:
+    """Store a notice and add it to the notice indexes
+
+    :param redis_store: Redis connection to use
+    :param notice: the notice to store
+    :param config: websmash config
+    """
+    notice.commit()
+    pipe = redis_store.pipeline()
+    _index_notice(pipe, config, notice.notice_id, notice.show_from.timestamp(), notice.show_until.timestamp())
+    pipe.execute()
+    _invalidate_caches()
+
+
+def remove_notice(redis_store, notice_id: str, config) -> None:
+    """Delete a notice and remove it from the notice indexes"""
+    by_start, by_expiry = _index_keys(config)
+    pipe = redis_store.pipeline()
+    pipe.delete('notice:{}'.format(notice_id))
+    pipe.zrem(by_start, notice_id)
+    pipe.zrem(by_expiry, notice_id)
+    pipe.execute()
+    _invalidate_caches()
+
+
+def get_active_notices(redis_store, config) -> list[dict[str, Any]]:
+    """Get the notices to show right now, at most NEWS_CACHE_TTL seconds old
+
+    :param redis_store: Redis connection to use when the cached notices need refreshing
+    :param config: websmash config
+    :return: list of notices as dicts
+    """
+    notices, valid_until = _cache.get(config['NEWS_CACHE_TTL'], lambda: fetch_active_notices(redis_store, config))
+    if valid_until <= time.time():
+        # a notice started or expired since the cached list was read
+        _cache.invalidate()
+        notices, _ = _cache.get(config['NEWS_CACHE_TTL'], lambda: fetch_active_notices(redis_store, config))
+    return notices
+
+
+async def get_active_notices_async(redis_store, config) -> list[dict[str, Any]]:
+    """Like get_active_notices(), using a redis.asyncio connection"""
+    notices, valid_until = await _async_cache.get(config['NEWS_CACHE_TTL'],
+                                                  lambda: fetch_active_notices_async(redis_store, config))
+    if valid_until <= time.time():
+        _async_cache.invalidate()
+        notices, _ = await _async_cache.get(config['NEWS_CACHE_TTL'],
+                                            lambda: fetch_active_notices_async(redis_store, config))
+    return notices
+
+
+def fetch_active_notices(redis_store, config) -> tuple[list[dict[str, Any]], float]:
+    """Read the notices to show right now from Redis
+
+    :param redis_store: Redis connection to use
+    :param config: websmash config
+    :return: tuple of list of notices as dicts and the time until which that list is valid
+    """
+    pipe = redis_store.pipeline()
+    _read_indexes(pipe, config, time.time())
+    expired, notice_ids, valid_until = _parse_indexes(pipe.execute())
+
+    pipe = redis_store.pipeline(transaction=False)
+    _read_notices(pipe, config, expired, notice_ids)
+    return _parse_notices(pipe.execute(), expired), valid_until
+
+
+async def fetch_active_notices_async(redis_store, config) -> tuple[list[dict[str, Any]], float]:
+    """Like fetch_active_notices(), using a redis.asyncio connection"""
+    pipe = redis_store.pipeline()
+    _read_indexes(pipe, config, time.time())
+    expired, notice_ids, valid_until = _parse_indexes(await pipe.execute())
+
+    pipe = redis_store.pipeline(transaction=False)
+    _read_notices(pipe, config, expired, notice_ids)
+    return _parse_notices(await pipe.execute(), expired), valid_until
+
+
+def _read_indexes(pipe, config, now: float) -> None:
+    """Queue the commands to find the active notices and drop expired ones on a pipeline
+
+    Missing indexes read like empty ones, i.e. as no notices to show.
+    """
+    by_start, by_expiry = _index_keys(config)
+    pipe.zrangebyscore(by_expiry, '-inf', now)
+    pipe.zremrangebyscore(by_expiry, '-inf', now)
+    pipe.zrangebyscore(by_start, '-inf', now)
+    pipe.zrangebyscore(by_start, '({}'.format(now), '+inf', start=0, num=1, withscores=True)
+    pipe.zrangebyscore(by_expiry, '({}'.format(now), '+inf', start=0, num=1, withscores=True)
+
+
+def _parse_indexes(results: list) -> tuple[set[str], list[str], float]:
+    """Get the expired and active notice IDs and the time until which they are valid from the index reads"""
+    expired, _, started, next_start, next_expiry = results
+    expired = set(expired)
+    notice_ids = [notice_id for notice_id in started if notice_id not in expired]
+    valid_until = min([score for _, score in next_start + next_expiry], default=float('inf'))
+    return expired, notice_ids, valid_until
+
+
+def _read_notices(pipe, config, expired: set[str], notice_ids: list[str]) -> None:
+    """Queue the commands to drop expired notices from the start index and read the active ones"""
+    by_start, _ = _index_keys(config)
+    if expired:
+        pipe.zrem(by_start, *expired)
+    for notice_id in notice_ids:
+        pipe.hgetall('notice:{}'.format(notice_id))
+
+
+def _parse_notices(results: list, expired: set[str]) -> list[dict[str, Any]]:
+    """Get the notices as dicts from the notice reads"""
+    if expired:
+        results = results[1:]
+
+    notices = []
+    for fields in results:
+        if not fields:
+            # the notice hash expired on its own
+            continue
+        notices.append({key: fields[key] for key in NOTICE_FIELDS if key in fields})
+    return notices
+
+
+def index_unindexed_notices(redis_store, config) -> int:
+    """Add notices missing from the notice indexes to them
+
+    This scans all keys of the database, so it is meant to run periodically outside of requests.
+
+    :param redis_store: Redis connection to use
+    :param config: websmash config
+    :return: number of notices indexed
+    """
+    _, by_expiry = _index_keys(config)
+    indexed = set(redis_store.zrange(by_expiry, 0, -1))
+    notice_ids = [key[7:] for key in redis_store.scan_iter(match='notice:*', count=SCAN_BATCH_SIZE)
+                  if key[7:] not in indexed]
+    if not notice_ids:
+        return 0
+
+    pipe = redis_store.pipeline(transaction=False)
+    for notice_id in notice_ids:
+        pipe.hmget('notice:{}'.format(notice_id), 'show_from', 'show_until')
+    values = pipe.execute()
+
+    pipe = redis_store.pipeline()
+    count = _index_found_notices(pipe, config, notice_ids, values)
+    pipe.execute()
+    _invalidate_caches()
+    return count
+
+
+def _index_found_notices(pipe, config, notice_ids: list[str], values: list) -> int:
+    """Queue the commands to index the notices found by a scan, skipping ones that are gone or invalid"""
+    count = 0
+    for notice_id, (show_from, show_until) in zip(notice_ids, values):
+        if show_from is None or show_until is None:
+            continue
+        notice = Notice(None, notice_id)
+        try:
+            notice._parse(('show_from', 'show_until'), (show_from, show_until))
+        except ValueError:
+            continue
+        _index_notice(pipe, config, notice_id, notice.show_from.timestamp(), notice.show_until.timestamp())
+        count += 1
+    return count
+
+
+def rebuild_notice_index(redis_store, config) -> int:
+    """Build the notice indexes from the existing notice keys
+
+    :param redis_store: Redis connection to use
+    :param config: websmash config
+    :return: number of notices indexed
+    """
+    redis_store.delete(*_index_keys(config))
+
+    pipe = redis_store.pipeline()
+    indexed = 0
+    for key in redis_store.scan_iter(match='notice:*'):
+        notice = Notice(redis_store, key[7:])
+        try:
+            notice.fetch()
+        except ValueError:
+            continue
+        _index_notice(pipe, config, notice.notice_id, notice.show_from.timestamp(), notice.show_until.timestamp())
+        indexed += 1
+    pipe.execute()
+
+    _invalidate_caches()
+    return indexed
@@ -0,0 +1,195 @@
+"""Redis-backed outbox for emails, sent by a separate worker instead of during a request
+
+Messages are pushed onto the MAIL_OUTBOX list as JSON. The sender moves them in batches
+to the MAIL_PROCESSING list and sends each batch over a single SMTP connection, removing
+the messages from MAIL_PROCESSING once they are dealt with, so a crashing sender doesn't
+lose them. Messages that fail to send are retried with exponential backoff from the
+MAIL_RETRY sorted set, scored by the time they are due, and moved to the MAIL_DEAD_LETTER
+list after MAIL_MAX_ATTEMPTS attempts. Messages that can't be sent at all, e.g. with
+invalid headers, go to MAIL_DEAD_LETTER right away.
+"""
+import json
+import logging
+import re
+import smtplib
+import time
+from typing import Any, Callable, Optional
+
+from flask_mail import Mail, Message
+
+logger = logging.getLogger(__name__)
+
+# errors that are worth trying again later
+SEND_ERRORS = (smtplib.SMTPException, OSError)
+
+# a single address, without any whitespace that could end the header it is put in
+ADDRESS_PATTERN = re.compile(r'[^@\s<>,;]+@[^@\s<>,;]+\.[^@\s<>,;]+')
+
+PROMOTE_RETRIES_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+    redis.call('LPUSH', KEYS[2], unpack(due))
+end
+return #due
+"""
+
+
+def is_valid_address(address: Any) -> bool:
+    """Check that a value is a single email address that is safe to put in a header"""
+    return isinstance(address, str) and ADDRESS_PATTERN.fullmatch(address) is not None
+
+
+def build_message(subject: str, recipients: list[str], body: str, sender: Optional[str] = None) -> dict[str, Any]:
+    """Describe an email to put into the outbox"""
+    return {
+        'subject': subject,
+        'recipients': recipients,
+        'body': body,
+        'sender': sender,
+        'attempts': 0,
+    }
+
+
+def enqueue_messages(redis_store, config, *messages: dict[str, Any]) -> None:
+    """Put emails into the outbox, in a single round trip"""
+    redis_store.lpush(config['MAIL_OUTBOX'], *(json.dumps(message) for message in messages))
+
+
+def promote_retries(redis_store, config, now: Optional[float] = None) -> int:
+    """Move messages that are due for another attempt back into the outbox
+
+    :return: number of messages moved
+    """
+    if now is None:
+        now = time.time()
+    script = redis_store.register_script(PROMOTE_RETRIES_SCRIPT)
+    return script(keys=[config['MAIL_RETRY'], config['MAIL_OUTBOX']], args=[now, config['MAIL_BATCH_SIZE']])
+
+
+def pop_batch(redis_store, config, timeout: int = 0) -> list[str]:
+    """Move up to MAIL_BATCH_SIZE messages from the outbox to the processing list
+
+    The messages stay on the processing list until send_batch() dealt with them.
+
+    :param timeout: seconds to wait for the first message, 0 to not wait
+    :return: list of JSON encoded messages, oldest first
+    """
+    outbox, processing = config['MAIL_OUTBOX'], config['MAIL_PROCESSING']
+    batch_size = config['MAIL_BATCH_SIZE']
+    if timeout > 0:
+        first = redis_store.blmove(outbox, processing, timeout, 'RIGHT', 'LEFT')
+        if first is None:
+            return []
+        batch = [first]
+        batch_size -= 1
+    else:
+        batch = []
+
+    if batch_size > 0:
+        pipe = redis_store.pipeline(transaction=False)
+        for _ in range(batch_size):
+            pipe.lmove(outbox, processing, 'RIGHT', 'LEFT')
+        batch.extend(raw for raw in pipe.execute() if raw is not None)
+    return batch
+
+
+def requeue_unacknowledged(redis_store, config) -> int:
+    """Move messages a stopped sender left on the processing list back to the front of the outbox
+
+    Only call this while no other sender is running.
+
+    :return: number of messages moved
+    """
+    moved = 0
+    while redis_store.lmove(config['MAIL_PROCESSING'], config['MAIL_OUTBOX'], 'LEFT', 'RIGHT') is not None:
+        moved += 1
+    return moved
+
+
+def send_batch(redis_store, config, mail: Mail, batch: list[str], now: Optional[float] = None) -> int:
+    """Send a batch of messages over one SMTP connection, scheduling retries for failed ones
+
+    Messages that can't be sent at all are moved to the dead letter list. Afterwards, the
+    batch is removed from the processing list.
+
+    :return: number of messages sent
+    """
+    if not batch:
+        return 0
+    if now is None:
+        now = time.time()
+
+    messages = []
+    dead = []
+    for raw in batch:
+        try:
+            messages.append(json.loads(raw))
+        except ValueError:
+            logger.error("Dropping undecodable email %r", raw)
+            dead.append(raw)
+
+    sent = 0
+    handled = 0
+    retries: list[dict[str, Any]] = []
+    try:
+        with mail.connect() as conn:
+            for message in messages:
+                try:
+                    conn.send(Message(subject=message['subject'], recipients=message['recipients'],
+                                      body=message['body'], sender=message['sender']))
+                    sent += 1
+                except smtplib.SMTPServerDisconnected:
+                    # the rest of the batch can't go out over this connection either
+                    break
+                except SEND_ERRORS as err:
+                    logger.warning("Failed to send email %r: %s", message['subject'], err)
+                    retries.append(message)
+                except Exception:
+                    # e.g. invalid headers, trying again won't help
+                    logger.exception("Giving up on email %r", message.get('subject'))
+                    dead.append(json.dumps(message))
+                handled += 1
+    except SEND_ERRORS as err:
+        # connecting or closing the connection failed
+        logger.warning("Failed to connect to mail server: %s", err)
+    retries.extend(messages[handled:])
+
+    _finish_batch(redis_store, config, batch, retries, dead, now)
+    return sent
+
+
+def _finish_batch(redis_store, config, batch: list[str], retries: list[dict[str, Any]], dead: list[str],
+                  now: float) -> None:
+    """Schedule failed messages for another attempt or give up on them, and acknowledge the batch"""
+    pipe = redis_store.pipeline()
+    for message in retries:
+        message['attempts'] += 1
+        if message['attempts'] >= config['MAIL_MAX_ATTEMPTS']:
+            logger.error("Giving up on email %r after %d attempts", message['subject'], message['attempts'])
+            dead.append(json.dumps(message))
+            continue
+        delay = config['MAIL_RETRY_BACKOFF'] * 2 ** (message['attempts'] - 1)
+        pipe.zadd(config['MAIL_RETRY'], {json.dumps(message): now + delay})
+    if dead:
+        pipe.lpush(config['MAIL_DEAD_LETTER'], *dead)
+    for raw in batch:
+        pipe.lrem(config['MAIL_PROCESSING'], 1, raw)
+    pipe.execute()
+
+
+def run_sender(redis_store, config, mail: Mail, poll_interval: int = 5,
+               should_stop: Callable[[], bool] = lambda: False) -> int:
+    """Keep sending messages from the outbox until told to stop
+
+    :param poll_interval: maximum number of seconds to wait for new messages, also the
+                          interval in which retries are checked
+    :param should_stop: callable returning True once the sender should stop
+    :return: number of messages sent
+    """
+    requeue_unacknowledged(redis_store, config)
+    sent = 0
+    while not should_stop():
+        promote_retries(redis_store, config)
+        sent += send_batch(redis_store, config, mail, pop_batch(redis_store, config, timeout=poll_interval))
+    return sent
@@ -0,0 +1,180 @@
+"""Queue positions and estimated start times of jobs in the default queue
+
+Jobs pushed to DEFAULT_QUEUE get the next number of a sequence, and are added to the
+QUEUE_POSITION_INDEX sorted set scored by that number. A job's position is then the
+number of jobs with a lower score, which Redis counts in O(log N) instead of scanning the
+queue. Jobs that left the queue are pruned from the front of the index by their state
+when positions are looked up.
+
+Position lookups also sample the lowest number still queued, at most every
+QUEUE_RATE_SAMPLE_INTERVAL seconds. How far it moved over the last QUEUE_RATE_WINDOW
+seconds gives the dequeue rate the start times are estimated from.
+
+Status requests read the fields of a job in the same script call as its position, so
+looking both up is a single round trip.
+
+Jobs reaching the default queue after a download are pushed there by the downloader and
+not numbered, so positions are estimates.
+"""
+from datetime import datetime, timedelta, UTC
+import time
+from typing import Any, Iterable, Optional
+
+# Lua function numbering a job just pushed to the default queue
+INDEX_POSITION_FUNCTION = """
+local function index_position(index, job_id)
+    redis.call('ZADD', index, redis.call('INCR', index .. ':sequence'), job_id)
+end
+"""
+
+# Lua function looking up the position of a job, see POSITION_SCRIPT
+POSITION_FUNCTION = """
+local function queue_position(index, rates, job_id, now, sample_interval, window, prune_limit)
+    local score = redis.call('ZSCORE', index, job_id)
+    if not score then
+        return false
+    end
+    if redis.call('HGET', 'job:' .. job_id, 'state') ~= 'queued' then
+        redis.call('ZREM', index, job_id)
+        return false
+    end
+
+    -- jobs leave the queue in order, so the ones that left are at the front of the index
+    for _ = 1, tonumber(prune_limit) do
+        local first = redis.call('ZRANGE', index, 0, 0)
+        if redis.call('HGET', 'job:' .. first[1], 'state') == 'queued' then
+            break
+        end
+        redis.call('ZREM', index, first[1])
+    end
+    local head = tonumber(redis.call('ZRANGE', index, 0, 0, 'WITHSCORES')[2])
+    local position = redis.call('ZCOUNT', index, '-inf', '(' .. score)
+
+    local latest = redis.call('ZRANGE', rates, -1, -1, 'WITHSCORES')
+    if #latest == 0 or tonumber(now) - tonumber(latest[2]) >= tonumber(sample_interval) then
+        redis.call('ZADD', rates, now, now .. ':' .. head)
+        redis.call('ZREMRANGEBYSCORE', rates, '-inf', tonumber(now) - tonumber(window))
+    end
+    local oldest = redis.call('ZRANGE', rates, 0, 0, 'WITHSCORES')
+    local oldest_head = tonumber(string.match(oldest[1], ':(.*)$'))
+    return {position, tostring(head - oldest_head), tostring(tonumber(now) - tonumber(oldest[2]))}
+end
+"""
+
+POSITION_SCRIPT = POSITION_FUNCTION + """
+-- KEYS: position index, dequeue rate samples
+-- ARGV: job ID, current time, seconds between rate samples, seconds of rate samples to keep,
+--       maximum number of jobs to prune
+-- returns false for jobs that aren't queued, else the number of jobs ahead of the job,
+-- then the number of jobs dequeued and the seconds that took in the sampled window
+return queue_position(KEYS[1], KEYS[2], unpack(ARGV))
+"""
+
+JOBS_SCRIPT = POSITION_FUNCTION + """
+-- KEYS: position index, dequeue rate samples
+-- ARGV: current time, seconds between rate samples, seconds of rate samples to keep,
+--       maximum number of jobs to prune, number of job fields to read, the fields, then the job IDs
+-- returns the values of the fields and the result of the position lookup of each job
+local field_count = tonumber(ARGV[5])
+local fields = {unpack(ARGV, 6, 5 + field_count)}
+local jobs = {}
+for i = 6 + field_count, #ARGV do
+    local values = redis.call('HMGET', 'job:' .. ARGV[i], unpack(fields))
+    jobs[#jobs + 1] = {values, queue_position(KEYS[1], KEYS[2], ARGV[i], ARGV[1], ARGV[2], ARGV[3], ARGV[4])}
+end
+return jobs
+"""
+
+REBUILD_SCRIPT = """
+-- KEYS: default queue, position index
+local job_ids = redis.call('LRANGE', KEYS[1], 0, -1)
+-- the sampled positions are from the old numbering
+redis.call('DEL', KEYS[2], KEYS[2] .. ':rate')
+for i = #job_ids, 1, -1 do
+    redis.call('ZADD', KEYS[2], #job_ids - i + 1, job_ids[i])
+end
+redis.call('SET', KEYS[2] .. ':sequence', #job_ids)
+return #job_ids
+"""
+
+# jobs that left the queue pruned per lookup, so a lookup never blocks Redis for long
+PRUNE_LIMIT = 100
+
+
+def position_call(config, job_id: str, now: Optional[float] = None) -> tuple[list[str], list[Any]]:
+    """Build the keys and arguments of a position lookup
+
+    :return: tuple of script keys and script arguments
+    """
+    if now is None:
+        now = time.time()
+    index = config['QUEUE_POSITION_INDEX']
+    keys = [index, '{}:rate'.format(index)]
+    args = [job_id, now, config['QUEUE_RATE_SAMPLE_INTERVAL'], config['QUEUE_RATE_WINDOW'], PRUNE_LIMIT]
+    return keys, args
+
+
+def parse_position(result, now: Optional[float] = None) -> Optional[dict[str, Any]]:
+    """Turn the result of a position lookup into the fields to show in a job status
+
+    :return: dict with the 1-based queue position and, if the dequeue rate is known,
+             the estimated start time, or None for jobs not in the default queue
+    """
+    if not result:
+        return None
+    if now is None:
+        now = time.time()
+    ahead, dequeued, seconds = int(result[0]), float(result[1]), float(result[2])
+    fields: dict[str, Any] = {'queue_position': ahead + 1}
+    if dequeued > 0 and seconds > 0:
+        start = datetime.fromtimestamp(now, UTC) + timedelta(seconds=ahead * seconds / dequeued)
+        fields['estimated_start_ts'] = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return fields
+
+
+def get_position(redis_store, config, job_id: str) -> Optional[dict[str, Any]]:
+    """Get the queue position and estimated start time of a job, see parse_position()"""
+    now = time.time()
+    keys, args = position_call(config, job_id, now)
+    return parse_position(redis_store.register_script(POSITION_SCRIPT)(keys=keys, args=args), now)
+
+
+async def get_position_async(redis_store, config, job_id: str) -> Optional[dict[str, Any]]:
+    """Like get_position(), using a redis.asyncio connection"""
+    now = time.time()
+    keys, args = position_call(config, job_id, now)
+    return parse_position(await redis_store.register_script(POSITION_SCRIPT)(keys=keys, args=args), now)
+
+
+def fetch_jobs(redis_store, config, job_ids: list[str], fields: Iterable[str]) -> list[tuple[list, Any]]:
+    """Read some fields and the queue position of several jobs in a single round trip
+
+    :return: list of the field values as returned by HMGET and the position of each job, see parse_position()
+    """
+    now = time.time()
+    keys, args = _jobs_call(config, job_ids, fields, now)
+    return [(values, parse_position(position, now))
+            for values, position in redis_store.register_script(JOBS_SCRIPT)(keys=keys, args=args)]
+
+
+async def fetch_jobs_async(redis_store, config, job_ids: list[str], fields: Iterable[str]) -> list[tuple[list, Any]]:
+    """Like fetch_jobs(), using a redis.asyncio connection"""
+    now = time.time()
+    keys, args = _jobs_call(config, job_ids, fields, now)
+    return [(values, parse_position(position, now))
+            for values, position in await redis_store.register_script(JOBS_SCRIPT)(keys=keys, args=args)]
+
+
+def _jobs_call(config, job_ids: list[str], fields: Iterable[str], now: float) -> tuple[list[str], list[Any]]:
+    keys, args = position_call(config, '', now)
+    fields = tuple(fields)
+    return keys, [*args[1:], len(fields), *fields, *job_ids]
+
+
+def rebuild_position_index(redis_store, config) -> int:
+    """Renumber all jobs in the default queue, e.g. to also count jobs that came from a download
+
+    :return: number of jobs indexed
+    """
+    script = redis_store.register_script(REBUILD_SCRIPT)
+    return script(keys=[config['DEFAULT_QUEUE'], config['QUEUE_POSITION_INDEX']])
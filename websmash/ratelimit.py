@@ -0,0 +1,174 @@
+"""Token-bucket rate limits per endpoint, per client IP address and per email address
+
+Each bucket holds up to a number of tokens and refills at a steady rate, a request takes
+one token from each of its buckets. The buckets live in Redis hashes, so the limits hold
+across worker processes. They are checked and updated by a single script call. Workers
+remember which buckets are empty until when, so rejecting a client that keeps retrying
+doesn't need a round trip.
+
+All limits of a request are checked by a single script call. Endpoints only limited by IP
+address are checked before the request's body is read. The email address is only known once
+the form is parsed, so endpoints also limited by email address are checked with the form fields
+sent before the first uploaded file, before it is written to disk, or by the submission code for
+requests without files. Clients sending the email address after the files have their email
+address limits checked by a second call. Requests over a limit get a 429 response with a
+Retry-After header.
+
+Views served by coroutines in the ASGI mode check the IP address limits with limit_by_ip_async()
+instead, so the event loop doesn't wait for Redis.
+"""
+import math
+import time
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+
+from websmash import app, get_async_db, get_db
+from websmash.uploads import UploadRequest
+
+RATE_LIMIT_SCRIPT = """
+-- KEYS: buckets to take a token from
+-- ARGV: current time, then the capacity and the seconds to refill completely of each bucket
+-- returns 0 if a token was taken from every bucket, else the seconds until that is possible
+-- and the number of the bucket that is empty the longest
+local now = tonumber(ARGV[1])
+local wait = 0
+local empty = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = capacity / tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+    if tokens < 1 and (1 - tokens) / rate > wait then
+        wait = (1 - tokens) / rate
+        empty = i
+    end
+    levels[i] = tokens
+end
+
+-- only take tokens if the request is allowed by all buckets
+if wait > 0 then
+    return {tostring(wait), empty}
+end
+for i, key in ipairs(KEYS) do
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'updated', ARGV[1])
+    -- the bucket is full again by then, which is the same as not existing
+    redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[2 * i + 1])))
+end
+return {'0', 0}
+"""
+
+# Buckets known to be empty until a given time. Clients that keep retrying are rejected by
+# the worker without asking Redis each time
+_empty_buckets: dict[str, float] = {}
+EMPTY_BUCKETS_MAX = 10000
+
+
+def client_ip() -> str:
+    """Get the IP address of the client of the current request"""
+    if 'X-Forwarded-For' in request.headers:
+        return request.headers.getlist("X-Forwarded-For")[0].rpartition(' ')[-1]
+    return request.remote_addr or 'untrackable'
+
+
+def limit(redis_store, config, endpoint: str, **identities: str) -> None:
+    """Take a token from the buckets of an endpoint for the given identities
+
+    :param endpoint: endpoint to use the RATE_LIMITS of
+    :param identities: values to limit by, keyed by the kind of limit, e.g. ip or email
+    :raises TooManyRequests: if any of the buckets is empty
+    """
+    keys, args = _bucket_call(config, endpoint, identities)
+    if keys:
+        _check_result(keys, args[0], redis_store.register_script(RATE_LIMIT_SCRIPT)(keys=keys, args=args))
+
+
+async def limit_async(redis_store, config, endpoint: str, **identities: str) -> None:
+    """Like limit(), using a redis.asyncio connection"""
+    keys, args = _bucket_call(config, endpoint, identities)
+    if keys:
+        _check_result(keys, args[0], await redis_store.register_script(RATE_LIMIT_SCRIPT)(keys=keys, args=args))
+
+
+def _bucket_call(config, endpoint: str, identities: dict[str, str]) -> tuple[list[str], list]:
+    """Build the keys and arguments of the rate limit script call
+
+    :return: tuple of the bucket keys and the script arguments, no keys if nothing is limited
+    :raises TooManyRequests: if a bucket is known to be empty without asking Redis
+    """
+    limits = config['RATE_LIMITS'].get(endpoint, {})
+    keys = []
+    args = [time.time()]
+    for kind, value in identities.items():
+        if kind not in limits or not value:
+            continue
+        requests, seconds = limits[kind]
+        keys.append('{}:{}:{}:{}'.format(config['RATE_LIMIT_PREFIX'], endpoint, kind, value))
+        args.extend((requests, seconds))
+
+    now = args[0]
+    for key in keys:
+        until = _empty_buckets.get(key, 0)
+        if until > now:
+            raise TooManyRequests("Rate limit exceeded, try again later", retry_after=math.ceil(until - now))
+    return keys, args
+
+
+def _check_result(keys: list[str], now: float, result) -> None:
+    """Remember the empty bucket and reject the request if the script found one"""
+    wait, empty = result
+    wait = float(wait)
+    if wait > 0:
+        if len(_empty_buckets) >= EMPTY_BUCKETS_MAX:
+            _empty_buckets.clear()
+        _empty_buckets[keys[int(empty) - 1]] = now + wait
+        raise TooManyRequests("Rate limit exceeded, try again later", retry_after=math.ceil(wait))
+
+
+# WSGI environ key of the kinds of limits already checked for a request
+CHECKED_ENVIRON_KEY = 'websmash.ratelimit_checked'
+
+
+def limit_request(**identities: str) -> None:
+    """Check the limits of the current request for its client IP address and the given identities
+
+    Limits already checked for the request are skipped, empty identities are checked once known.
+
+    :param identities: values to limit by, keyed by the kind of limit, e.g. email
+    :raises TooManyRequests: if any of the buckets is empty
+    """
+    limits = app.config['RATE_LIMITS'].get(request.endpoint)
+    if not limits:
+        return
+    checked = request.environ.setdefault(CHECKED_ENVIRON_KEY, set())
+    identities = {'ip': client_ip(), **identities}
+    unchecked = {kind: value for kind, value in identities.items()
+                 if kind in limits and value and kind not in checked}
+    if unchecked:
+        checked.update(unchecked)
+        limit(get_db(), app.config, request.endpoint, **unchecked)
+
+
+@app.before_request
+def _limit_by_ip():
+    # email address limits are checked along with these once the address is known
+    if 'email' not in app.config['RATE_LIMITS'].get(request.endpoint, {}):
+        limit_request()
+
+
+@UploadRequest.before_upload
+def _limit_before_upload(fields) -> None:
+    limit_request(email=fields.get('email', '').strip())
+
+
+async def limit_by_ip_async() -> None:
+    """Check the IP address limits of the current request, for views served by coroutines
+
+    Call this before the request hooks run, so they skip the blocking check.
+    """
+    request.environ[CHECKED_ENVIRON_KEY] = {'ip'}
+    if request.endpoint in app.config['RATE_LIMITS']:
+        await limit_async(get_async_db(), app.config, request.endpoint, ip=client_ip())
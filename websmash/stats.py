@@ -0,0 +1,107 @@
+"""Queue statistics, served from a periodically refreshed snapshot"""
+from datetime import datetime
+from typing import Any, Optional
+
+from websmash.cache import AsyncSnapshotCache, SnapshotCache
+from websmash.job_history import HISTORY_LISTS
+from websmash.utils import parse_timestamp
+
+STATS_SCRIPT = """
+-- KEYS: default queue, fast queue, then the other lists to get the length of,
+--       then the counter of jobs in fair-share sub-queues, then the job history counts
+-- returns the lengths of all lists and the counter, then the number of jobs trimmed off
+-- the finished job lists, then the last_changed field of the oldest job in the default
+-- and fast queues
+local result = {}
+for i = 1, #KEYS - 2 do
+    result[i] = redis.call('LLEN', KEYS[i])
+end
+result[#KEYS - 1] = tonumber(redis.call('GET', KEYS[#KEYS - 1]) or '0')
+local trimmed = 0
+for _, count in ipairs(redis.call('HVALS', KEYS[#KEYS])) do
+    trimmed = trimmed + tonumber(count)
+end
+result[#KEYS] = trimmed
+for i = 1, 2 do
+    local last_changed = false
+    local job_id = redis.call('LINDEX', KEYS[i], -1)
+    if job_id then
+        last_changed = redis.call('HGET', 'job:' .. job_id, 'last_changed')
+    end
+    result[#KEYS + i] = last_changed
+end
+return result
+"""
+
+_cache = SnapshotCache()
+_async_cache = AsyncSnapshotCache()
+
+
+def get_stats(redis_store, config) -> dict[str, Any]:
+    """Get the queue statistics, at most STATS_CACHE_TTL seconds old
+
+    :param redis_store: Redis connection to use when the snapshot needs refreshing
+    :param config: websmash config
+    :return: dict of queue statistics
+    """
+    return _cache.get(config['STATS_CACHE_TTL'], lambda: fetch_stats(redis_store, config))
+
+
+async def get_stats_async(redis_store, config) -> dict[str, Any]:
+    """Like get_stats(), using a redis.asyncio connection"""
+    return await _async_cache.get(config['STATS_CACHE_TTL'], lambda: fetch_stats_async(redis_store, config))
+
+
+def fetch_stats(redis_store, config) -> dict[str, Any]:
+    """Read the queue statistics from Redis in a single round trip"""
+    script = redis_store.register_script(STATS_SCRIPT)
+    return _build_stats(config, script(keys=_stats_keys(config)))
+
+
+async def fetch_stats_async(redis_store, config) -> dict[str, Any]:
+    """Like fetch_stats(), using a redis.asyncio connection"""
+    script = redis_store.register_script(STATS_SCRIPT)
+    return _build_stats(config, await script(keys=_stats_keys(config)))
+
+
+def _stats_keys(config) -> list[str]:
+    """Get the keys the statistics are read from"""
+    return [
+        config['DEFAULT_QUEUE'],
+        config['FAST_QUEUE'],
+        'jobs:running',
+        *HISTORY_LISTS,
+        '{}:queued'.format(config['FAIR_SHARE_INDEX']),
+        config['JOB_HISTORY_COUNTS'],
+    ]
+
+
+def _build_stats(config, values: list) -> dict[str, Any]:
+    """Build the queue statistics from the values returned by STATS_SCRIPT"""
+    (pending, fast, running, completed, failed, removed, fair_share_queued, trimmed,
+     queued_changed, fast_changed) = values
+    # the counter can briefly be off for jobs that reached their sub-queue after a download
+    pending += max(fair_share_queued, 0)
+
+    # carry over jobs count from the old database from the config
+    total_jobs = config['OLD_JOB_COUNT'] + trimmed + completed + failed + removed
+
+    if pending + running + fast > 0:
+        status = 'working'
+    else:
+        status = 'idle'
+
+    ts_queued, ts_queued_m = _get_timestamps(parse_timestamp(queued_changed))
+    ts_fast, ts_fast_m = _get_timestamps(parse_timestamp(fast_changed))
+
+    return dict(status=status, queue_length=pending, running=running,
+                fast=fast, ts_fast=ts_fast, ts_fast_m=ts_fast_m,
+                total_jobs=total_jobs,
+                ts_queued=ts_queued, ts_queued_m=ts_queued_m)
+
+
+def _get_timestamps(timestamp: Optional[datetime]) -> tuple[Optional[str], Optional[str]]:
+    """Get both a readable and a machine-readable version of a timestamp"""
+    if timestamp is None:
+        return None, None
+    return timestamp.strftime("%Y-%m-%d %H:%M"), timestamp.strftime("%Y-%m-%dT%H:%M:%SZ")
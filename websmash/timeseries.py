@@ -0,0 +1,210 @@
+"""Rolling time series of the queue statistics
+
+`flask stats-sampler` samples the queue lengths, the number of running jobs, how long the
+oldest job in the default queue has waited and, from the job counters, the number of jobs
+submitted, completed and failed per minute, every TIMESERIES_INTERVAL seconds.
+
+Samples are aggregated into buckets at each of the TIMESERIES_LEVELS, keeping the minimum,
+sum, maximum and number of samples per value. The buckets of a level are a ring buffer of
+a fixed number of slots in a Redis hash, a new bucket overwrites the slot of the bucket
+that many buckets before it, so memory use doesn't depend on how long the sampler runs.
+History requests read the finest level covering the requested window.
+"""
+from datetime import datetime, UTC
+import json
+import math
+import re
+import time
+from typing import Any, Callable, Optional
+
+from websmash import stats
+from websmash.utils import parse_timestamp
+
+RECORD_SCRIPT = """
+-- KEYS: last sample, then the ring buffer hash of each level
+-- ARGV: sample time, JSON object of the sampled values, JSON object of the counters to turn
+--       into per-minute rates, JSON list of the bucket seconds and slots of each level,
+--       minimum seconds since the last sample
+-- returns 1 if the sample was recorded, 0 if another sampler recorded one just now
+local now = tonumber(ARGV[1])
+local values = cjson.decode(ARGV[2])
+local counters = cjson.decode(ARGV[3])
+local last = redis.call('GET', KEYS[1])
+if last then
+    last = cjson.decode(last)
+    local elapsed = now - last.time
+    if elapsed < tonumber(ARGV[5]) then
+        return 0
+    end
+    for name, value in pairs(counters) do
+        -- counters that went down were reset, skip them this once
+        if last.counters[name] and value >= last.counters[name] then
+            values[name] = (value - last.counters[name]) * 60 / elapsed
+        end
+    end
+end
+redis.call('SET', KEYS[1], cjson.encode({time = now, counters = counters}))
+
+for i, level in ipairs(cjson.decode(ARGV[4])) do
+    local bucket = math.floor(now / level[1])
+    local slot = tostring(bucket % level[2])
+    local entry = redis.call('HGET', KEYS[i + 1], slot)
+    if entry then
+        entry = cjson.decode(entry)
+    end
+    if not entry or entry.bucket ~= bucket then
+        entry = {bucket = bucket, values = {}}
+    end
+    for name, value in pairs(values) do
+        local aggregate = entry.values[name]
+        if aggregate then
+            aggregate[1] = math.min(aggregate[1], value)
+            aggregate[2] = aggregate[2] + value
+            aggregate[3] = math.max(aggregate[3], value)
+            aggregate[4] = aggregate[4] + 1
+        else
+            entry.values[name] = {value, value, value, 1}
+        end
+    end
+    redis.call('HSET', KEYS[i + 1], slot, cjson.encode(entry))
+end
+return 1
+"""
+
+WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def level_key(config, seconds: int) -> str:
+    """Get the name of the ring buffer hash of the level with buckets of the given seconds"""
+    return '{}:{}'.format(config['TIMESERIES_PREFIX'], seconds)
+
+
+def sample(redis_store, config) -> tuple[dict[str, float], dict[str, int]]:
+    """Read the current queue statistics and job counters in a single round trip
+
+    :return: tuple of the sampled values and the job counters
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    redis_store.register_script(stats.STATS_SCRIPT)(keys=stats._stats_keys(config), client=pipe)
+    for queue in ('PRIORITY_QUEUE', 'DEVELOPMENT_QUEUE', 'DOWNLOAD_QUEUE'):
+        pipe.llen(config[queue])
+    pipe.get(config['SUBMISSION_COUNTER'])
+    pipe.hmget(config['JOB_HISTORY_COUNTS'], 'jobs:completed', 'jobs:failed')
+    stats_values, priority, development, downloads, submitted, trimmed = pipe.execute()
+
+    pending, fast, running, completed, failed, _, fair_share_queued, _, queued_changed, _ = stats_values
+    oldest = parse_timestamp(queued_changed)
+    wait = (datetime.now(UTC) - oldest).total_seconds() if oldest is not None else 0
+    values = {
+        'queued': pending + max(fair_share_queued, 0),
+        'fast': fast,
+        'priority': priority,
+        'development': development,
+        'downloads': downloads,
+        'running': running,
+        'wait': max(wait, 0),
+    }
+    counters = {
+        'submitted': int(submitted or 0),
+        'completed': completed + int(trimmed[0] or 0),
+        'failed': failed + int(trimmed[1] or 0),
+    }
+    return values, counters
+
+
+def record(redis_store, config, values: dict[str, float], counters: dict[str, int],
+           now: Optional[float] = None) -> bool:
+    """Add a sample to the buckets of all levels
+
+    :param values: sampled values
+    :param counters: counters whose change since the last sample is recorded per minute
+    :return: True if the sample was recorded, False if another sampler just recorded one
+    """
+    if now is None:
+        now = time.time()
+    keys = ['{}:last'.format(config['TIMESERIES_PREFIX'])]
+    keys.extend(level_key(config, seconds) for seconds, _ in config['TIMESERIES_LEVELS'])
+    args = [now, json.dumps(values), json.dumps(counters), json.dumps(config['TIMESERIES_LEVELS']),
+            config['TIMESERIES_INTERVAL'] / 2]
+    return bool(redis_store.register_script(RECORD_SCRIPT)(keys=keys, args=args))
+
+
+def parse_window(value: str) -> int:
+    """Parse a window length like 90, 30m, 6h or 7d into seconds
+
+    :raises ValueError: if the value isn't a positive window length
+    """
+    match = re.fullmatch(r'(\d+)([smhd]?)', value.strip())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError("Invalid window {!r}, expected a number of seconds, or of minutes, hours or days "
+                         "like 30m, 6h or 7d".format(value))
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2) or 's']
+
+
+def get_history(redis_store, config, window: int, now: Optional[float] = None) -> dict[str, Any]:
+    """Get the minimum, average and maximum of the sampled values over a window
+
+    :param window: seconds to look back
+    :return: dict of the bucket seconds used, the summary of each value over the whole window
+             and the series of buckets
+    :raises ValueError: if the window is longer than the longest level keeps
+    """
+    if now is None:
+        now = time.time()
+    for seconds, slots in sorted(config['TIMESERIES_LEVELS']):
+        if seconds * slots >= window:
+            break
+    else:
+        longest = max(seconds * slots for seconds, slots in config['TIMESERIES_LEVELS'])
+        raise ValueError("Window too long, at most {} seconds of history are kept".format(longest))
+
+    last_bucket = math.floor(now / seconds)
+    buckets = list(range(math.floor((now - window) / seconds) + 1, last_bucket + 1))
+    entries = redis_store.hmget(level_key(config, seconds), [str(bucket % slots) for bucket in buckets])
+
+    series = []
+    totals: dict[str, list[float]] = {}
+    for bucket, entry in zip(buckets, entries):
+        if entry is None:
+            continue
+        entry = json.loads(entry)
+        # slots not overwritten since an earlier round of the ring buffer
+        if entry['bucket'] != bucket:
+            continue
+        point: dict[str, Any] = {'time': _format_time(bucket * seconds)}
+        for name, (low, total, high, count) in entry['values'].items():
+            point[name] = _summary(low, total, high, count)
+            if name in totals:
+                aggregate = totals[name]
+                totals[name] = [min(aggregate[0], low), aggregate[1] + total, max(aggregate[2], high),
+                                aggregate[3] + count]
+            else:
+                totals[name] = [low, total, high, count]
+        series.append(point)
+
+    summary = {name: _summary(*aggregate) for name, aggregate in totals.items()}
+    return dict(window=window, resolution=seconds, summary=summary, series=series)
+
+
+def run_sampler(redis_store, config, should_stop: Callable[[], bool] = lambda: False) -> int:
+    """Record a sample every TIMESERIES_INTERVAL seconds until told to stop
+
+    :param should_stop: callable returning True once the sampler should stop
+    :return: number of samples recorded
+    """
+    recorded = 0
+    while not should_stop():
+        values, counters = sample(redis_store, config)
+        recorded += record(redis_store, config, values, counters)
+        time.sleep(config['TIMESERIES_INTERVAL'])
+    return recorded
+
+
+def _summary(low: float, total: float, high: float, count: int) -> dict[str, float]:
+    """Get the minimum, average and maximum of an aggregate"""
+    return dict(min=low, avg=round(total / count, 2), max=high)
+
+
+def _format_time(timestamp: float) -> str:
+    """Format a bucket start time"""
+    return datetime.fromtimestamp(timestamp, UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -0,0 +1,85 @@
+"""Opt-in tracing of Redis commands and sampled profiling of requests
+
+With REDIS_TRACING set, the commands each request sends to Redis are counted and timed,
+and a summary is logged. With REDIS_TRACING_HEADER also set, the summary is returned in
+the X-Redis-Trace response header. Commands sent while a streamed response is generated
+are not included.
+
+PROFILE_SAMPLE_RATE is the fraction of requests to run under cProfile. Profiles are saved
+to PROFILE_DIR, or logged as a short listing of the most expensive calls without one.
+"""
+import cProfile
+import io
+import json
+import os
+from os import path
+import pstats
+import random
+import time
+
+from flask import g, request
+
+from websmash import app
+from websmash.connection import TracingRedis
+
+PROFILE_LINES = 25
+
+
+@app.before_request
+def _start_profiling():
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already running in this process
+            return
+        g.profiler = profiler
+
+
+@app.after_request
+def _finish_tracing(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        _save_profile(profiler)
+
+    # get_db() gives every request its own tracing client
+    redis_store = getattr(request, '_traced_database', None)
+    if not isinstance(redis_store, TracingRedis):
+        return response
+
+    summary = redis_store.trace.summary()
+    app.logger.info("redis trace %s", json.dumps({
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        **summary,
+    }, sort_keys=True))
+
+    if app.config['REDIS_TRACING_HEADER']:
+        response.headers['X-Redis-Trace'] = format_trace_header(summary)
+    return response
+
+
+def format_trace_header(summary) -> str:
+    """Format a trace summary for the X-Redis-Trace header"""
+    commands = ','.join('{}={}'.format(name, count) for name, count in summary['by_command'].items())
+    return 'commands={}; round_trips={}; time_ms={}; by_command={}'.format(
+        summary['commands'], summary['round_trips'], summary['time_ms'], commands)
+
+
+def _save_profile(profiler: cProfile.Profile) -> None:
+    """Save or log the profile of a request"""
+    profile_dir = app.config['PROFILE_DIR']
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        filename = '{:.6f}-{}-{}.prof'.format(time.time(), request.endpoint or 'unmatched', os.getpid())
+        profiler.dump_stats(path.join(profile_dir, filename))
+        return
+
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    app.logger.info("profile of %s %s\n%s", request.method, request.path, output.getvalue())
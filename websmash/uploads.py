@@ -0,0 +1,195 @@
+"""Streaming ingestion of uploaded input files"""
+import errno
+import hashlib
+import os
+from os import path
+import shutil
+import tempfile
+from typing import Callable, IO, Optional
+
+from flask import current_app, Request
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import FormDataParser
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 1024 * 1024
+
+# read while importing, os.umask() can only be read by setting it, which isn't thread-safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def staging_dir(config) -> str:
+    """Get the directory uploads are streamed to before they are assigned to a job
+
+    This lives below RESULTS_PATH unless configured otherwise, so moving files into
+    a job's input directory is a rename instead of a copy.
+    """
+    dirname = config['UPLOAD_STAGING_PATH'] or path.join(config['RESULTS_PATH'], '.incoming')
+    os.makedirs(dirname, exist_ok=True)
+    return dirname
+
+
+class StagedUpload:
+    """An uploaded file written to a staging file as it arrives
+
+    The size limit is enforced and the checksum calculated while the data is written.
+    Unless it was moved to its final location with save_as(), the staging file is
+    removed again when the upload is closed.
+    """
+
+    def __init__(self, dirname: str, max_size: Optional[int] = None) -> None:
+        fd, self.path = tempfile.mkstemp(dir=dirname, prefix='upload-')
+        self._file: IO[bytes] = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._saved = False
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            # the form parser drops parts that fail, so nothing else would clean this up
+            self.close()
+            raise RequestEntityTooLarge("Uploaded file is larger than {} bytes".format(self.max_size))
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    @property
+    def checksum(self) -> str:
+        """The checksum of the data written so far"""
+        return "sha256:{}".format(self._hash.hexdigest())
+
+    def save_as(self, destination: str) -> None:
+        """Move the staging file to its final location"""
+        self._file.flush()
+        # staging files are only readable by their owner, saved files get the usual permissions
+        os.chmod(self.path, 0o666 & ~_UMASK)
+        try:
+            os.replace(self.path, destination)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            shutil.move(self.path, destination)
+        self._saved = True
+
+    def close(self) -> None:
+        self._file.close()
+        if not self._saved:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class _LeadingFieldsReader:
+    """Multipart request body keeping track of the form fields sent before the first file
+
+    The form parser reads the body through this, so the fields are known when it gets to the first file.
+    """
+
+    def __init__(self, stream: IO[bytes], boundary: bytes, max_form_memory_size: Optional[int]) -> None:
+        self._stream = stream
+        self._decoder: Optional[MultipartDecoder] = MultipartDecoder(
+            boundary, max_form_memory_size=max_form_memory_size)
+        self._value: list[bytes] = []
+        self._name = ''
+        self.fields: MultiDict[str, str] = MultiDict()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        if self._decoder is not None:
+            try:
+                self._feed(self._decoder, data)
+            except ValueError:
+                # the form parser fails on the same data
+                self._decoder = None
+        return data
+
+    def _feed(self, decoder: MultipartDecoder, data: bytes) -> None:
+        decoder.receive_data(data or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                self._decoder = None
+                return
+            if isinstance(event, Field):
+                self._name = event.name
+                self._value = []
+            elif isinstance(event, Data):
+                self._value.append(event.data)
+                if not event.more_data:
+                    self.fields.add(self._name, b''.join(self._value).decode('utf-8', 'replace'))
+            event = decoder.next_event()
+
+
+class _UploadFormDataParser(FormDataParser):
+    """Form parser noting the form fields sent before the first file of multipart requests"""
+
+    leading_fields: MultiDict[str, str]
+
+    def _parse_multipart(self, stream, mimetype, content_length, options):
+        self.leading_fields = MultiDict()
+        boundary = options.get('boundary', '').encode('ascii')
+        if boundary:
+            reader = _LeadingFieldsReader(stream, boundary, self.max_form_memory_size)
+            self.leading_fields = reader.fields
+            _, form, files = super()._parse_multipart(reader, mimetype, content_length, options)
+            return stream, form, files
+        return super()._parse_multipart(stream, mimetype, content_length, options)
+
+
+class UploadRequest(Request):
+    """Request streaming file uploads to staging files with a size limit
+
+    Functions registered with before_upload() are called with the form fields sent before the
+    first uploaded file, just before that file is written, e.g. to reject a request without
+    writing anything to disk.
+    """
+
+    form_data_parser_class = _UploadFormDataParser
+    _before_upload: list[Callable[[MultiDict], None]] = []
+
+    @classmethod
+    def before_upload(cls, func: Callable[[MultiDict], None]) -> Callable[[MultiDict], None]:
+        """Register a function to call with the form fields sent before the first uploaded file"""
+        cls._before_upload.append(func)
+        return func
+
+    def make_form_data_parser(self) -> FormDataParser:
+        self._form_data_parser = super().make_form_data_parser()
+        return self._form_data_parser
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not getattr(self, '_uploads_started', False):
+            self._uploads_started = True
+            parser = getattr(self, '_form_data_parser', None)
+            fields = getattr(parser, 'leading_fields', None) or MultiDict()
+            for func in self._before_upload:
+                func(fields)
+        config = current_app.config
+        return StagedUpload(staging_dir(config), config['MAX_UPLOAD_FILE_SIZE'])
+
+
+def save_upload(upload: FileStorage, destination: str) -> str:
+    """Save an uploaded file without copying it if it was streamed to a staging file
+
+    :param upload: the uploaded file
+    :param destination: path to save the file to
+    :return: checksum of the file's contents
+    """
+    stream = upload.stream
+    if isinstance(stream, StagedUpload):
+        stream.save_as(destination)
+        return stream.checksum
+
+    checksum = hashlib.sha256()
+    with open(destination, 'wb') as handle:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            checksum.update(chunk)
+            handle.write(chunk)
+    return "sha256:{}".format(checksum.hexdigest())
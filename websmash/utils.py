@@ -1,19 +1,24 @@
 #!/usr/bin/env python
 """Utility functions for websmash"""
+from datetime import datetime, UTC
+import json
 import os
-import shutil
 
 from flask import request
 from os import path
 import platform
 import random
+from typing import Optional
 import uuid
 
 import werkzeug.utils
 from antismash_models import SyncJob as Job
 
-from websmash import app, get_db, DataStore
+from websmash import app, events, fair_share, get_db, input_store, metrics, positions, ratelimit, DataStore
+from websmash.background import dark_launches
 from websmash.error_handlers import BadRequest
+from websmash.input_store import link_or_copy
+from websmash.uploads import save_upload
 
 
 def generate_confirmation_mail(message):
@@ -26,42 +31,241 @@ Your message was:
     return confirmation_template % message
 
 
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse a timestamp as stored in a job hash"""
+    if value is None:
+        return None
+    # We're not totally fixated on sub-second resolution
+    try:
+        timestamp = datetime.strptime(value, "%Y-%m-%d %H:%M:%S.%f")
+    except ValueError:
+        timestamp = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    return timestamp.replace(tzinfo=UTC)
+
+
 def _generate_jobid(taxon: str) -> str:
     """Generate a job uid based on the taxon"""
     return "{}-{}".format(taxon, uuid.uuid4())
 
 
-def _add_to_queue(redis_store, job):
-    """Add job to a specified job queue"""
-    queue = job.target_queues.pop()
-    job.commit()
-    redis_store.lpush(queue, job.job_id)
+# States of jobs that count against MAX_JOBS_PER_USER, jobs needing a download are only
+# queued once the download is done
+PENDING_STATES = ('downloading', 'validating', 'queued')
+
+# Lua function counting the pending jobs in a pending job index, pruning jobs that left the queue
+COUNT_PENDING_FUNCTION = """
+local pending_states = {}
+for _, state in ipairs({'""" + "', '".join(PENDING_STATES) + """'}) do
+    pending_states[state] = true
+end
+
+local function is_pending(job_id)
+    return pending_states[redis.call('HGET', 'job:' .. job_id, 'state') or ''] == true
+end
+
+local function count_pending(index)
+    local count = 0
+    for _, job_id in ipairs(redis.call('SMEMBERS', index)) do
+        if is_pending(job_id) then
+            count = count + 1
+        else
+            redis.call('SREM', index, job_id)
+        end
+    end
+    return count
+end
+"""
+
+SUBMIT_JOB_SCRIPT = """
+-- KEYS: job hash, email pending index, IP pending index,
+--       then the queues to push to for the queued, email-waitlisted and IP-waitlisted outcomes,
+--       then the waitlist index and the email and IP waitlists, then the fair-share and position indexes,
+--       then the submission counter, then the hash of waitlisted jobs being downloaded
+-- ARGV: job ID, limit check flag, limit, has email flag, has IP flag,
+--       then state, status and target_queues of the three outcomes,
+--       then the fair-share and position flags, then the job's update channel,
+--       then the job hash as field/value pairs
+""" + COUNT_PENDING_FUNCTION + fair_share.INDEX_QUEUE_FUNCTION + positions.INDEX_POSITION_FUNCTION + """
+
+local outcome = 0
+if ARGV[2] == '1' then
+    local limit = tonumber(ARGV[3])
+    if ARGV[4] == '1' and count_pending(KEYS[2]) > limit then
+        outcome = 1
+    elseif count_pending(KEYS[3]) > limit then
+        outcome = 2
+    end
+end
+
+local offset = 6 + outcome * 3
+redis.call('HSET', KEYS[1], unpack(ARGV, 18))
+redis.call('HSET', KEYS[1], 'state', ARGV[offset], 'status', ARGV[offset + 1], 'target_queues', ARGV[offset + 2])
+redis.call('LPUSH', KEYS[4 + outcome], ARGV[1])
+
+if outcome > 0 then
+    -- the job might only reach the waitlist after being downloaded, index it now anyway
+    redis.call('SADD', KEYS[7], KEYS[7 + outcome])
+    if KEYS[4 + outcome] ~= KEYS[7 + outcome] then
+        -- and again once it got there, see waitlist.index_downloaded_waitlists()
+        redis.call('HSET', KEYS[13], ARGV[1], KEYS[7 + outcome])
+    end
+elseif ARGV[15] == '1' then
+    index_fair_queue(KEYS[10], KEYS[4])
+elseif ARGV[16] == '1' then
+    index_position(KEYS[11], ARGV[1])
+end
+
+if outcome == 0 and ARGV[2] == '1' then
+    if ARGV[4] == '1' then
+        redis.call('SADD', KEYS[2], ARGV[1])
+    end
+    if ARGV[5] == '1' then
+        redis.call('SADD', KEYS[3], ARGV[1])
+    end
+end
+redis.call('INCR', KEYS[12])
+-- tell clients following the job, see events.publish_job_update()
+redis.call('PUBLISH', ARGV[17], ARGV[1])
+
+return outcome
+"""
+
+WAITLIST_STATUS = 'waiting: Too many jobs in queue for this user.'
 
 
-def _submit_job(redis_store, job, config):
-    """Submit a new job"""
+def _add_to_queue(redis_store, job, extra_fields=None):
+    """Add job to a specified job queue, committing and pushing it in a single round trip
+
+    :param extra_fields: fields not covered by the job model to store in the job hash
+    """
+    queue = job.target_queues.pop()
+    pipe = redis_store.pipeline()
+    pipe.hset("job:{}".format(job.job_id), mapping={**job.to_dict(), **(extra_fields or {})})
+    pipe.lpush(queue, job.job_id)
+    pipe.execute()
+
+
+def _submit_job(redis_store, job, config, extra_fields=None):
+    """Submit a new job
+
+    Checking the per-user limit, picking the queue and storing the job happen atomically
+    in a single server-side script call.
+
+    :param extra_fields: fields not covered by the job model to store in the job hash
+    """
+    keys, args, outcomes = _submit_script_call(job, config, extra_fields)
+    outcome = int(redis_store.register_script(SUBMIT_JOB_SCRIPT)(keys=keys, args=args))
+    _apply_outcome(job, outcomes[outcome])
+    metrics.record_submission(config, outcomes[outcome][0])
+
+
+def _submit_jobs(redis_store, jobs, config, extra_fields, batch_size):
+    """Submit many new jobs, pipelining batch_size submissions per round trip
+
+    The jobs are submitted in order, so each job's limit check counts the jobs submitted
+    before it and the per-user limit applies to all of them together.
+
+    :param jobs: list of jobs to submit
+    :param extra_fields: list of fields not covered by the job model to store in each job hash
+    :param batch_size: number of jobs to submit per round trip
+    """
+    script = redis_store.register_script(SUBMIT_JOB_SCRIPT)
+    for start in range(0, len(jobs), batch_size):
+        batch = list(zip(jobs[start:start + batch_size], extra_fields[start:start + batch_size]))
+        pipe = redis_store.pipeline(transaction=False)
+        all_outcomes = []
+        for job, fields in batch:
+            keys, args, outcomes = _submit_script_call(job, config, fields)
+            script(keys=keys, args=args, client=pipe)
+            all_outcomes.append(outcomes)
+        for (job, _), outcomes, outcome in zip(batch, all_outcomes, pipe.execute()):
+            _apply_outcome(job, outcomes[int(outcome)])
+            metrics.record_submission(config, outcomes[int(outcome)][0])
+
+
+def _submit_script_call(job, config, extra_fields=None):
+    """Pick a job's target queue and build the arguments of the submission script
+
+    :return: tuple of script keys, script arguments and the list of possible outcomes
+    """
     job.state = 'queued'
     limit = config['MAX_JOBS_PER_USER']
     vips = config['VIP_USERS']
+    check_limit = False
 
-    if job.email in vips:
+    if config['FAIR_SHARE'] and not job.minimal:
+        # VIP users get a higher weight instead of the priority queue
+        job.target_queues.append(fair_share.queue_name(config, fair_share.submitter(job)))
+        check_limit = job.email not in vips
+    elif job.email in vips:
         job.target_queues.append(config['PRIORITY_QUEUE'])
     elif job.minimal:
         job.target_queues.append(config['FAST_QUEUE'])
     else:
         job.target_queues.append(config['DEFAULT_QUEUE'])
-
-        if job.email and _count_pending_jobs_with_email(redis_store, job) > limit:
-            _waitlist_job(job, job.email)
-        elif _count_pending_jobs_with_ip(redis_store, job) > limit:
-            _waitlist_job(job, job.ip_addr)
+        check_limit = True
+
+    # queued, waitlisted by email, waitlisted by IP
+    outcomes = [_submit_outcome(job, config, None)]
+    for attribute in (job.email, job.ip_addr):
+        outcomes.append(_submit_outcome(job, config, attribute if check_limit else None))
+
+    keys = [
+        "job:{}".format(job.job_id),
+        _pending_index_key(config, 'email', job.email),
+        _pending_index_key(config, 'ip', job.ip_addr),
+    ]
+    args = [job.job_id, int(check_limit), limit, int(bool(job.email)), int(bool(job.ip_addr))]
+    for queue, state, status, target_queues in outcomes:
+        keys.append(queue)
+        args.extend((state, status, json.dumps(target_queues)))
+    keys.extend((config['WAITLIST_INDEX'], _waitlist_name(config, job.email), _waitlist_name(config, job.ip_addr)))
+    keys.extend((config['FAIR_SHARE_INDEX'], config['QUEUE_POSITION_INDEX'], config['SUBMISSION_COUNTER'],
+                 config['WAITLIST_DOWNLOADS']))
+    # jobs only reach their fair-share sub-queue or the default queue directly without a download
+    args.append(int(config['FAIR_SHARE'] and outcomes[0][0].startswith('{}:'.format(config['FAIR_SHARE_PREFIX']))))
+    args.append(int(outcomes[0][0] == config['DEFAULT_QUEUE']))
+    args.append(events.job_update_channel(config, job.job_id))
+    for field, value in {**job.to_dict(), **(extra_fields or {})}.items():
+        args.extend((field, value))
+
+    return keys, args, outcomes
+
+
+def _apply_outcome(job, outcome):
+    """Update a job to match the submission outcome the script picked"""
+    _, state, status, target_queues = outcome
+    if state != job.state:
+        job.state = state
+        job.status = status
+    job.target_queues = target_queues
+
+
+def _submit_outcome(job, config, waitlist_attribute):
+    """Work out the queue to push to and the job state for one possible submission outcome
+
+    :param job: job to submit, with its target queue already set
+    :param config: websmash config
+    :param waitlist_attribute: email or IP address to waitlist the job for, or None to queue it
+    :return: tuple of queue to push to, job state, job status and remaining target queues
+    """
+    target_queues = list(job.target_queues)
+    state = job.state
+    status = job.status
+
+    if waitlist_attribute is not None:
+        state = 'waiting'
+        status = WAITLIST_STATUS
+        target_queues.append(_waitlist_name(config, waitlist_attribute))
 
     if job.needs_download:
-        job.target_queues.append(config['DOWNLOAD_QUEUE'])
-    _add_to_queue(redis_store, job)
+        target_queues.append(config['DOWNLOAD_QUEUE'])
+
+    queue = target_queues.pop()
+    return queue, state, status, target_queues
 
 
-def _dark_launch_job(redis_store, job, config):
+def _dark_launch_job(redis_store, job, config, extra_fields=None):
     """Support dark launching jobs to test new versions on real data"""
     launches = config.get("DARK_LAUNCHES")
 
@@ -91,10 +295,10 @@ def _dark_launch_job(redis_store, job, config):
         }]
 
     for launch in launches:
-        _dark_launch_to_queue(redis_store, job, config, launch)
+        _dark_launch_to_queue(redis_store, job, config, launch, extra_fields)
 
 
-def _dark_launch_to_queue(redis_store, job, config, launch):
+def _dark_launch_to_queue(redis_store, job, config, launch, extra_fields=None):
     """Submit a copy of the job to a separate queue so we can test new versions on real data"""
     if not _want_to_run(launch["percentage"]):
         return
@@ -120,7 +324,8 @@ def _dark_launch_to_queue(redis_store, job, config, launch):
     if new_job.needs_download:
         new_job.target_queues.append(config['DOWNLOAD_QUEUE'])
 
-    _add_to_queue(redis_store, new_job)
+    _add_to_queue(redis_store, new_job, extra_fields)
+    metrics.record_dark_launch(launch["queue"])
 
 
 def _want_to_run(percentage: int) -> bool:
@@ -130,7 +335,10 @@ def _want_to_run(percentage: int) -> bool:
 
 
 def _copy_files(basedir, old_job, new_job):
-    """When duplicating a job, copy over available input files"""
+    """When duplicating a job, make the available input files available to the new job
+
+    Files are hard linked or reflinked where possible, so they don't take up extra space.
+    """
 
     old_dirname = path.join(basedir, old_job.job_id, 'input')
     new_dirname = path.join(basedir, new_job.job_id, 'input')
@@ -140,47 +348,132 @@ def _copy_files(basedir, old_job, new_job):
     if old_job.filename:
         old_filename = path.join(old_dirname, old_job.filename)
         new_filename = path.join(new_dirname, new_job.filename)
-        shutil.copyfile(old_filename, new_filename)
+        link_or_copy(old_filename, new_filename)
 
     if old_job.gff3:
         old_filename = path.join(old_dirname, old_job.gff3)
         new_filename = path.join(new_dirname, new_job.gff3)
-        shutil.copyfile(old_filename, new_filename)
+        link_or_copy(old_filename, new_filename)
 
     for sideload in old_job.sideloads:
         old_filename = path.join(old_dirname, sideload)
         new_filename = path.join(new_dirname, sideload)
-        shutil.copyfile(old_filename, new_filename)
+        link_or_copy(old_filename, new_filename)
+
+
+def _pending_index_key(config, attribute: str, value: str) -> str:
+    """Get the key of the set indexing pending jobs for an email or IP address"""
+    return '{}:{}:{}'.format(config['PENDING_INDEX_PREFIX'], attribute, value)
+
+
+def _count_pending_jobs(redis_store: DataStore, index_key: str) -> int:
+    """Count the jobs in a pending job index that are still pending
+
+    Jobs leave the queue in the dispatcher, so stale index entries are pruned here
+    """
+    job_ids = list(redis_store.smembers(index_key))
+    if not job_ids:
+        return 0
+
+    pipe = redis_store.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipe.hget("job:{}".format(job_id), 'state')
+    states = pipe.execute()
+
+    stale = [job_id for job_id, state in zip(job_ids, states) if state not in PENDING_STATES]
+    if stale:
+        redis_store.srem(index_key, *stale)
+
+    return len(job_ids) - len(stale)
 
 
 def _count_pending_jobs_with_email(redis_store: DataStore, job: Job) -> int:
     """Count how many jobs are pending for the email of the current job"""
-    count = 0
-    for job_id in redis_store.lrange(app.config['DEFAULT_QUEUE'], 0, -1):
-        job_key = "job:{}".format(job_id)
-        if redis_store.hget(job_key, 'email') == job.email:
-            count += 1
-
-    return count
+    return _count_pending_jobs(redis_store, _pending_index_key(app.config, 'email', job.email))
 
 
 def _count_pending_jobs_with_ip(redis_store: DataStore, job: Job) -> int:
     """Count how many jobs are pending for the IP address of the current job"""
-    count = 0
-    for job_id in redis_store.lrange(app.config['DEFAULT_QUEUE'], 0, -1):
-        job_key = "job:{}".format(job_id)
-        if redis_store.hget(job_key, 'ip_addr') == job.ip_addr:
-            count += 1
-
-    return count
+    return _count_pending_jobs(redis_store, _pending_index_key(app.config, 'ip', job.ip_addr))
+
+
+REPLACE_INDEX_SCRIPT = """
+-- KEYS: rebuilt index, index to replace
+-- keeps the jobs submitted while the index was rebuilt, then moves the rebuilt index over the old one
+""" + COUNT_PENDING_FUNCTION + """
+for _, job_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    if is_pending(job_id) then
+        redis.call('SADD', KEYS[1], job_id)
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+"""
 
 
-def _waitlist_job(job, attribute):
-    """Put the given job on a waitlist"""
-    job.state = 'waiting'
-    job.status = 'waiting: Too many jobs in queue for this user.'
-    waitlist = '{}:{}'.format(app.config['WAITLIST_PREFIX'], attribute)
-    job.target_queues.append(waitlist)
+def rebuild_pending_indexes(redis_store: DataStore, config, batch_size: int = 1000) -> int:
+    """Recreate the per-email and per-IP pending job indexes from the queues
+
+    Each index is built in a temporary key that replaces the old index in a single script
+    call, so submissions running at the same time are neither lost nor counted twice.
+
+    :param redis_store: Redis connection to use
+    :param config: websmash config to read queue and index names from
+    :param batch_size: number of jobs to read per pipelined round trip
+    :return: number of jobs added to the indexes
+    """
+    pattern = '{}:*'.format(config['PENDING_INDEX_PREFIX'])
+    index_keys = {key for key in redis_store.scan_iter(match=pattern, count=batch_size)
+                  if not key.endswith(':rebuild')}
+    limited_queues = [config['DEFAULT_QUEUE'], *redis_store.zrange(config['FAIR_SHARE_INDEX'], 0, -1)]
+
+    indexes: dict[str, set[str]] = {}
+    indexed = 0
+    for queue in limited_queues + [config['DOWNLOAD_QUEUE']]:
+        start = 0
+        while True:
+            job_ids = redis_store.lrange(queue, start, start + batch_size - 1)
+            if not job_ids:
+                break
+            start += len(job_ids)
+
+            pipe = redis_store.pipeline(transaction=False)
+            for job_id in job_ids:
+                pipe.hmget("job:{}".format(job_id), 'email', 'ip_addr', 'state', 'target_queues')
+            fields = pipe.execute()
+
+            for job_id, (email, ip_addr, state, target_queues) in zip(job_ids, fields):
+                if state not in PENDING_STATES:
+                    continue
+                # downloading jobs count against the limit of the queue they go to next
+                if queue == config['DOWNLOAD_QUEUE'] and \
+                        not set(json.loads(target_queues or '[]')).intersection(limited_queues):
+                    continue
+                if email:
+                    indexes.setdefault(_pending_index_key(config, 'email', email), set()).add(job_id)
+                if ip_addr:
+                    indexes.setdefault(_pending_index_key(config, 'ip', ip_addr), set()).add(job_id)
+                indexed += 1
+
+    script = redis_store.register_script(REPLACE_INDEX_SCRIPT)
+    for index_key in index_keys | set(indexes):
+        rebuilt_key = '{}:rebuild'.format(index_key)
+        pipe = redis_store.pipeline(transaction=False)
+        pipe.delete(rebuilt_key)
+        if indexes.get(index_key):
+            pipe.sadd(rebuilt_key, *indexes[index_key])
+        script(keys=[rebuilt_key, index_key], client=pipe)
+        pipe.execute()
+
+    return indexed
+
+
+def _waitlist_name(config, attribute: str) -> str:
+    """Get the name of the waitlist for the given email or IP address"""
+    return '{}:{}'.format(config['WAITLIST_PREFIX'], attribute)
 
 
 def _get_checkbox(req, name):
@@ -189,20 +482,11 @@ def _get_checkbox(req, name):
     return str_value == u'on' or str_value == 'true'
 
 
-def dispatch_job():
-    """Internal helper to dispatch a new job"""
-    redis_store = get_db()
-    taxon = app.config['TAXON']
-    job_id = _generate_jobid(taxon)
+def _job_from_request(redis_store) -> Job:
+    """Create a new job with the submitter's details and the options set in the request"""
+    job = Job(redis_store, _generate_jobid(app.config['TAXON']))
 
-    job = Job(redis_store, job_id)
-
-    if 'X-Forwarded-For' in request.headers:
-        job.ip_addr = request.headers.getlist("X-Forwarded-For")[0].rpartition(' ')[-1]
-    else:
-        job.ip_addr = request.remote_addr or 'untrackable'
-
-    ncbi = request.form.get('ncbi', '').strip()
+    job.ip_addr = ratelimit.client_ip()
 
     val = request.form.get('email', '').strip()
     if val:
@@ -249,8 +533,20 @@ def dispatch_job():
     job.tfbs = _get_checkbox(request, "tfbs")
     job.ncbi_context = _get_checkbox(request, 'ncbi_context')
 
+    job.trace.append("{}-api".format(platform.node()))
+    return job
+
+
+def dispatch_job():
+    """Internal helper to dispatch a new job"""
+    redis_store = get_db()
+    job = _job_from_request(redis_store)
+    ratelimit.limit_request(email=job.email)
+    ncbi = request.form.get('ncbi', '').strip()
+
     dirname = path.join(app.config['RESULTS_PATH'], job.job_id, 'input')
     os.makedirs(dirname)
+    checksums = {}
 
     if ncbi != '':
         if ' ' in ncbi:
@@ -269,9 +565,7 @@ def dispatch_job():
                 raise BadRequest("Fungal FASTA inputs need to provide gff3 gene calls")
 
         filename = secure_filename(upload.filename)
-        upload.save(path.join(dirname, filename))
-        if not path.exists(path.join(dirname, filename)):
-            raise BadRequest("Could not save file!")
+        checksums[filename] = _save_upload(upload, dirname, filename, "Could not save file!")
         job.filename = filename
         job.needs_download = False
 
@@ -279,9 +573,7 @@ def dispatch_job():
             gff_upload = request.files['gff3']
             if gff_upload is not None:
                 gff_filename = secure_filename(gff_upload.filename)
-                gff_upload.save(path.join(dirname, gff_filename))
-                if not path.exists(path.join(dirname, gff_filename)):
-                    raise BadRequest("Could not save GFF file!")
+                checksums[gff_filename] = _save_upload(gff_upload, dirname, gff_filename, "Could not save GFF file!")
                 job.gff3 = gff_filename
 
     for key in request.files.keys():
@@ -290,18 +582,91 @@ def dispatch_job():
         sideload = request.files[key]
         if sideload is not None:
             sideload_filename = secure_filename(sideload.filename)
-            sideload.save(path.join(dirname, sideload_filename))
-            if not path.exists(path.join(dirname, sideload_filename)):
-                raise BadRequest("Could not save sideload info file!")
+            checksums[sideload_filename] = _save_upload(sideload, dirname, sideload_filename,
+                                                        "Could not save sideload info file!")
             job.sideloads.append(sideload_filename)
 
-    job.trace.append("{}-api".format(platform.node()))
+    extra_fields = {}
+    if checksums:
+        extra_fields['input_checksums'] = json.dumps(checksums)
 
-    _submit_job(redis_store, job, app.config)
-    _dark_launch_job(redis_store, job, app.config)
+    _submit_job(redis_store, job, app.config, extra_fields)
+    # the submitter doesn't need to wait for the copies to be made
+    dark_launches.submit(app.config['DARK_LAUNCH_WORKERS'], app.config['DARK_LAUNCH_MAX_PENDING'],
+                         _dark_launch_job, redis_store, job, app.config, extra_fields)
     return job
 
 
+def dispatch_bulk_jobs() -> list[Job]:
+    """Internal helper to dispatch one job per NCBI accession or uploaded file in a request
+
+    All jobs share the options set in the request. Every input is checked before any job
+    is created, and the per-user limit applies to all jobs of the request together.
+    """
+    redis_store = get_db()
+    ratelimit.limit_request(email=request.form.get('email', '').strip())
+    accessions = [ncbi.strip() for ncbi in request.form.getlist('ncbi') if ncbi.strip()]
+    uploads = request.files.getlist('seq')
+
+    if not accessions and not uploads:
+        raise BadRequest("No NCBI IDs or input files given.")
+    if len(accessions) + len(uploads) > app.config['BULK_SUBMIT_MAX_JOBS']:
+        raise BadRequest("Too many jobs, at most {} are allowed".format(app.config['BULK_SUBMIT_MAX_JOBS']))
+    if any(key == 'gff3' or key.startswith('sideload') for key in request.files.keys()):
+        raise BadRequest("GFF3 and sideload files are not supported for bulk submissions.")
+    for ncbi in accessions:
+        if ' ' in ncbi:
+            raise BadRequest("Spaces are not allowed in an NCBI ID.")
+    for upload in uploads:
+        if not upload.filename or not secure_filename(upload.filename):
+            raise BadRequest("Uploading input file failed!")
+        if _is_fasta_file(upload.filename) and app.config['TAXON'] == "fungi":
+            raise BadRequest("Fungal FASTA inputs need to provide gff3 gene calls")
+
+    # parsing the shared options again for every job is cheap and keeps the jobs independent
+    jobs = [_job_from_request(redis_store) for _ in range(len(accessions) + len(uploads))]
+    extra_fields = []
+    for job in jobs:
+        os.makedirs(path.join(app.config['RESULTS_PATH'], job.job_id, 'input'))
+
+    for job, ncbi in zip(jobs, accessions):
+        job.download = ncbi
+        job.needs_download = True
+        job.ncbi_context = True
+        extra_fields.append({})
+
+    for job, upload in zip(jobs[len(accessions):], uploads):
+        dirname = path.join(app.config['RESULTS_PATH'], job.job_id, 'input')
+        filename = secure_filename(upload.filename)
+        checksum = _save_upload(upload, dirname, filename, "Could not save file!")
+        job.filename = filename
+        job.needs_download = False
+        extra_fields.append({'input_checksums': json.dumps({filename: checksum})})
+
+    _submit_jobs(redis_store, jobs, app.config, extra_fields, app.config['BULK_SUBMIT_BATCH_SIZE'])
+    for job, fields in zip(jobs, extra_fields):
+        dark_launches.submit(app.config['DARK_LAUNCH_WORKERS'], app.config['DARK_LAUNCH_MAX_PENDING'],
+                             _dark_launch_job, redis_store, job, app.config, fields)
+    return jobs
+
+
+def _save_upload(upload, dirname: str, filename: str, error_message: str) -> str:
+    """Save an uploaded file to a job's input directory
+
+    :return: the checksum of the uploaded file
+    """
+    destination = path.join(dirname, filename)
+    try:
+        checksum = save_upload(upload, destination)
+    except OSError:
+        raise BadRequest(error_message)
+    metrics.record_upload(path.getsize(destination))
+
+    if app.config['USE_INPUT_STORE']:
+        input_store.add_file(app.config, destination, checksum)
+    return checksum
+
+
 def _is_fasta_file(name: str) -> bool:
     """ check if a file seems to be a FASTA file based on the file ending """
     _, ext = path.splitext(name)
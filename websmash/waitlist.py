@@ -0,0 +1,181 @@
+"""Promotion of waitlisted jobs to the default queue
+
+Jobs of users over MAX_JOBS_PER_USER are parked on a waitlist per email or IP address.
+The waitlists that might hold jobs are tracked in the WAITLIST_INDEX set, so the promoter
+doesn't need to scan the keyspace. Each waitlist is checked by a server-side script that
+moves jobs from its head to DEFAULT_QUEUE, or with FAIR_SHARE to the submitter's sub-queue,
+while their submitter has free slots, keeping the order the jobs were waitlisted in, and
+drops the waitlist from the index once it is empty. Waitlists are checked
+WAITLIST_BATCH_SIZE at a time in a single round trip.
+
+Jobs that need a download only reach their waitlist after the download, when the waitlist
+might have been dropped from the index already. They are tracked in the WAITLIST_DOWNLOADS
+hash, which the promoter checks every WAITLIST_RESCAN_INTERVAL seconds to index their
+waitlists again once they arrived. Scanning the keyspace for all waitlists is only done when
+the promoter starts and by `flask rebuild-waitlist-index`.
+"""
+from datetime import datetime, UTC
+import logging
+import time
+from typing import Callable, Optional
+
+from websmash import fair_share, metrics, positions
+from websmash.utils import COUNT_PENDING_FUNCTION, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+PROMOTE_SCRIPT = """
+-- KEYS: waitlist, waitlist index, queue to promote to, fair-share index, position index
+-- ARGV: per-user limit, pending index prefix, timestamp of the promotion,
+--       fair-share sub-queue prefix to promote to instead, or an empty string,
+--       prefix of the job update channels
+""" + COUNT_PENDING_FUNCTION + fair_share.INDEX_QUEUE_FUNCTION + positions.INDEX_POSITION_FUNCTION + """
+local limit = tonumber(ARGV[1])
+local promoted = {}
+while true do
+    local job_id = redis.call('LINDEX', KEYS[1], -1)
+    if not job_id then
+        redis.call('SREM', KEYS[2], KEYS[1])
+        break
+    end
+
+    local job_key = 'job:' .. job_id
+    local job = redis.call('HMGET', job_key, 'state', 'email', 'ip_addr', 'last_changed')
+    -- jobs that aren't waiting anymore, e.g. cancelled ones, are just dropped
+    if job[1] == 'waiting' then
+        local email_index = ARGV[2] .. ':email:' .. tostring(job[2])
+        local ip_index = ARGV[2] .. ':ip:' .. tostring(job[3])
+        if (job[2] and count_pending(email_index) > limit) or count_pending(ip_index) > limit then
+            break
+        end
+
+        redis.call('HSET', job_key, 'state', 'queued', 'status', 'pending', 'target_queues', '[]',
+                   'last_changed', ARGV[3])
+        if ARGV[4] ~= '' then
+            local queue = ARGV[4] .. ':' .. tostring(job[2] or job[3])
+            redis.call('LPUSH', queue, job_id)
+            index_fair_queue(KEYS[4], queue)
+        else
+            redis.call('LPUSH', KEYS[3], job_id)
+            index_position(KEYS[5], job_id)
+        end
+        if job[2] then
+            redis.call('SADD', email_index, job_id)
+        end
+        if job[3] then
+            redis.call('SADD', ip_index, job_id)
+        end
+        -- like events.publish_job_update()
+        redis.call('PUBLISH', ARGV[5] .. ':' .. job_id, job_id)
+        table.insert(promoted, job_id)
+        table.insert(promoted, job[4] or '')
+    end
+    redis.call('RPOP', KEYS[1])
+end
+return promoted
+"""
+
+
+INDEX_DOWNLOADED_SCRIPT = """
+-- KEYS: hash of waitlisted jobs being downloaded to their waitlist, waitlist index
+-- ARGV: job IDs to check
+-- returns the number of jobs that reached their waitlist
+local arrived = 0
+for _, job_id in ipairs(ARGV) do
+    local waitlist = redis.call('HGET', KEYS[1], job_id)
+    if waitlist then
+        if redis.call('HGET', 'job:' .. job_id, 'state') ~= 'waiting' then
+            -- e.g. the download failed
+            redis.call('HDEL', KEYS[1], job_id)
+        elseif redis.call('LPOS', waitlist, job_id) then
+            redis.call('SADD', KEYS[2], waitlist)
+            redis.call('HDEL', KEYS[1], job_id)
+            arrived = arrived + 1
+        end
+    end
+end
+return arrived
+"""
+
+
+def index_downloaded_waitlists(redis_store, config) -> int:
+    """Index the waitlists of waitlisted jobs that were downloaded since the last check
+
+    :return: number of jobs that reached their waitlist
+    """
+    batch_size = config['WAITLIST_BATCH_SIZE']
+    script = redis_store.register_script(INDEX_DOWNLOADED_SCRIPT)
+    job_ids = list(redis_store.hkeys(config['WAITLIST_DOWNLOADS']))
+    arrived = 0
+    for start in range(0, len(job_ids), batch_size):
+        arrived += script(keys=[config['WAITLIST_DOWNLOADS'], config['WAITLIST_INDEX']],
+                          args=job_ids[start:start + batch_size])
+    return arrived
+
+
+def rebuild_waitlist_index(redis_store, config, batch_size: int = 1000) -> int:
+    """Add all waitlists holding jobs to the waitlist index, scanning the whole keyspace
+
+    :return: number of waitlists found
+    """
+    waitlists = list(redis_store.scan_iter(match='{}:*'.format(config['WAITLIST_PREFIX']), count=batch_size))
+    for start in range(0, len(waitlists), batch_size):
+        redis_store.sadd(config['WAITLIST_INDEX'], *waitlists[start:start + batch_size])
+    return len(waitlists)
+
+
+def promote_waitlisted(redis_store, config, now: Optional[datetime] = None) -> list[tuple[str, float]]:
+    """Move waitlisted jobs to the default queue for all submitters with free slots
+
+    :return: list of the promoted job IDs and the seconds they spent on the waitlist
+    """
+    if now is None:
+        now = datetime.now(UTC)
+    timestamp = now.strftime("%Y-%m-%d %H:%M:%S.%f")
+    batch_size = config['WAITLIST_BATCH_SIZE']
+    script = redis_store.register_script(PROMOTE_SCRIPT)
+    fair_share_prefix = config['FAIR_SHARE_PREFIX'] if config['FAIR_SHARE'] else ''
+
+    waitlists = list(redis_store.sscan_iter(config['WAITLIST_INDEX'], count=batch_size))
+    promoted = []
+    for start in range(0, len(waitlists), batch_size):
+        pipe = redis_store.pipeline(transaction=False)
+        for waitlist in waitlists[start:start + batch_size]:
+            script(keys=[waitlist, config['WAITLIST_INDEX'], config['DEFAULT_QUEUE'], config['FAIR_SHARE_INDEX'],
+                         config['QUEUE_POSITION_INDEX']],
+                   args=[config['MAX_JOBS_PER_USER'], config['PENDING_INDEX_PREFIX'], timestamp, fair_share_prefix,
+                         config['JOB_UPDATES_PREFIX']],
+                   client=pipe)
+        for result in pipe.execute():
+            for job_id, last_changed in zip(result[::2], result[1::2]):
+                waited = (now - parse_timestamp(last_changed)).total_seconds() if last_changed else 0.0
+                metrics.record_promotion(waited)
+                promoted.append((job_id, waited))
+    return promoted
+
+
+def run_promoter(redis_store, config, interval: float = 10,
+                 should_stop: Callable[[], bool] = lambda: False) -> int:
+    """Keep promoting waitlisted jobs until told to stop
+
+    :param interval: seconds between checks of the waitlists
+    :param should_stop: callable returning True once the promoter should stop
+    :return: number of jobs promoted
+    """
+    promoted = 0
+    # waitlists filled while no promoter was running
+    rebuild_waitlist_index(redis_store, config)
+    last_rescan = time.monotonic()
+    while not should_stop():
+        if time.monotonic() - last_rescan >= config['WAITLIST_RESCAN_INTERVAL']:
+            index_downloaded_waitlists(redis_store, config)
+            last_rescan = time.monotonic()
+
+        batch = promote_waitlisted(redis_store, config)
+        if batch:
+            waited = [seconds for _, seconds in batch]
+            logger.info("Promoted %d waitlisted jobs, waited %.1fs on average and %.1fs at most",
+                        len(batch), sum(waited) / len(waited), max(waited))
+        promoted += len(batch)
+        time.sleep(interval)
+    return promoted